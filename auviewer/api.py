@@ -4,31 +4,39 @@ import sys
 import logging
 import traceback
 
-from flask import Flask
+from flask import Flask, current_app
 from pathlib import Path
 from typing import List, Dict, Optional
 from pathlib import Path
 
 from . import models
+from .coalesce import rangedOutputFlights, rangedRequestGenerations
 from .config import config, set_data_path
 from .file import File
+from .prefetch import prefetcher
 from .project import Project
+from .downsamplequeue import DownsampleQueue, JOB_DOWNSAMPLE, JOB_UPDATE, STATUS_COMPLETED
+from .scheduler import PRIORITY_ASSIGNED, PRIORITY_DEFAULT, reportJobRestarted, reportSeriesComplete
 from .shared import createEmptyJSONFile, getProcFNFromOrigFN
-
-import multiprocessing as mp
+from .payloadcache import sharedPayloadCache
+from .tilecache import tileCache
 
 # Will hold loaded projects
 loadedProjects = []
 
-# Initiate the donwsampling pool
-downsamplePool = None
+# Will hold the downsample queue
+downsampleQueue = None
 
-def downsampleFile(filepath: str, destinationpath: str) -> bool:
+def downsampleFile(filepath: str, destinationpath: str, threads: Optional[int] = None, resume: Optional[List[str]] = None, visibleSeries: Optional[List[str]] = None) -> bool:
     """
     Downsamples an original file, placing the processed file in the destination folder.
     Raises an exception in case of error.
     :param filepath: path to the original file
     :param destinationpath: path to the destination folder
+    :param threads: number of threads to downsample series with (defaults to the downsampleThreads config setting)
+    :param resume: IDs of series already completed in a partially processed file in the destination folder, after
+        which to resume downsampling (if it cannot be resumed, the file is downsampled from scratch)
+    :param visibleSeries: IDs of the series shown by the project template, which are downsampled first
     :return: None
     """
     fp = Path(filepath)
@@ -40,15 +48,89 @@ def downsampleFile(filepath: str, destinationpath: str) -> bool:
         raise Exception(f"Destination '{destinationpath}' does not exist or is not a directory.")
 
     ds_file = File(None, -1, fp, dp / getProcFNFromOrigFN(fp))
-    ds_file.process()
+
+    # Report progress to the downsample queue, if running in its scheduler
+    onSeriesComplete = lambda seriesIDs: reportSeriesComplete(seriesIDs, len(ds_file.series))
+
+    if resume:
+        try:
+            ds_file.process(threads=threads, resume=set(resume), onSeriesComplete=onSeriesComplete, visibleSeries=visibleSeries)
+        except Exception as e:
+            logging.warning(f"Unable to resume downsampling {filepath}. Downsampling from scratch.\n{e}")
+            reportJobRestarted()
+            ds_file = File(None, -1, fp, dp / getProcFNFromOrigFN(fp))
+            ds_file.process(threads=threads, onSeriesComplete=onSeriesComplete, visibleSeries=visibleSeries)
+    else:
+        ds_file.process(threads=threads, onSeriesComplete=onSeriesComplete, visibleSeries=visibleSeries)
+
     ds_file.close()
     del ds_file
 
-# Sets a global downsample
-def instantiatePool(pool):
-    global downsamplePool
-    if downsamplePool is None: 
-        downsamplePool = pool
+def updateDownsampledFile(filepath: str, destinationpath: str) -> None:
+    """
+    Extends an already-downsampled file in the destination folder with any data appended to the original file since
+    it was downsampled. Only the appended data is downsampled. If the file has not been downsampled yet, it is
+    downsampled in full. Raises an exception in case of error.
+    :param filepath: path to the original file
+    :param destinationpath: path to the destination folder
+    :return: None
+    """
+    fp = Path(filepath)
+    if not (fp.exists() and fp.is_file()):
+        raise Exception(f"File '{filepath}' does not exist or is not a file.")
+
+    dp = Path(destinationpath)
+    if not (dp.exists() and dp.is_dir()):
+        raise Exception(f"Destination '{destinationpath}' does not exist or is not a directory.")
+
+    ds_file = File(None, -1, fp, dp / getProcFNFromOrigFN(fp))
+    ds_file.processAppended()
+    ds_file.close()
+    del ds_file
+
+# Instantiates the global downsample queue, if it does not exist yet. Must be
+# called within a Flask app context.
+def instantiateDownsampleQueue():
+    global downsampleQueue
+    if downsampleQueue is None:
+        downsampleQueue = DownsampleQueue(current_app._get_current_object(), jobMemoryLimit=config['downsampleJobMemoryLimit'])
+
+def prioritizeDownsample(file) -> bool:
+    """
+    Moves the downsampling (or updating) of a file ahead of all other queued files, e.g. because a user has opened it.
+    :param file: the file to prioritize
+    :return: True if the file is queued for downsampling, False otherwise
+    """
+    if downsampleQueue is None:
+        return False
+    return downsampleQueue.prioritize(file)
+
+def getDownsampleStatus() -> Optional[Dict]:
+    """
+    Returns the status of background downsampling: the number of queued & running files, their progress, recent
+    failures, and an estimate of the seconds remaining (see DownsampleQueue.getStatus).
+    :return: dict describing the status, or None if projects have not been loaded
+    """
+    if downsampleQueue is None:
+        return None
+    return downsampleQueue.getStatus()
+
+
+def getTileCacheStatus() -> Dict:
+    """
+    Returns the status of the tile cache of ranged series output: the number & size of cached tiles, the budget, and
+    the hit, miss & eviction counts (see TileCache.getStats), along with the status of the prefetching of ranges into
+    the cache (see Prefetcher.getStats), the numbers of ranged data requests coalesced (see SingleFlight) &
+    superseded (see RequestGenerations), and the status of the cache of shared initial file payloads (see
+    SharedPayloadCache.getStats).
+    """
+    return {
+        **tileCache.getStats(),
+        'prefetch': prefetcher.getStats(),
+        'payloads': sharedPayloadCache.getStats(),
+        'coalesced': rangedOutputFlights.coalesced,
+        'superseded': rangedRequestGenerations.superseded,
+    }
 
 
 def getProject(id) -> Optional[Project]:
@@ -147,15 +229,15 @@ def loadProjects() -> Dict[int, Project]:
 
     global loadedProjects
 
-    # Instantiate a global downsample pool
-    pool = mp.Pool(processes=mp.cpu_count()//2)
-    instantiatePool(pool)
+    # Instantiate the global downsample queue
+    instantiateDownsampleQueue()
 
     logging.info("Loading projects.")
 
     # Reset projects to empty list
     loadedProjects = []
     notProcessedFiles = []
+    outdatedFiles = []
 
     # Load projects from the database
     projs = models.Project.query.all()
@@ -217,13 +299,36 @@ def loadProjects() -> Dict[int, Project]:
             # TODO(gus): We need to have project take absolute path and project name!
             loadedProjects.append(Project(project))
 
+    # Files belonging to pattern sets assigned to users are downsampled first
+    assignedFileIDs = {fid for (fid,) in models.db.session.query(models.Pattern.file_id).join(models.PatternSet).filter(models.PatternSet.users.any()).distinct()}
+
     # Delete all files that may have been downsampled incorrectly and adds unprocessed files to be downsampled
     for project in loadedProjects:
         for projFile in project.files:
+
+            # Skip files already being downsampled (e.g. if projects are
+            # reloaded while the queue is working)
+            if downsampleQueue.isScheduled(projFile):
+                continue
+
+            priority = PRIORITY_ASSIGNED if projFile.id in assignedFileIDs else PRIORITY_DEFAULT
+
+            # Job for the file interrupted by the last shutdown, if any
+            interruptedJob = downsampleQueue.getInterruptedJob(projFile)
+
             tmp_file = Path(str(projFile.procFilePathObj)+'.tmp')
             if tmp_file.exists():
+
+                # Resume downsampling after the series completed before the
+                # interruption, if any
+                if interruptedJob is not None and interruptedJob.type == JOB_DOWNSAMPLE and len(interruptedJob.series) > 0 and projFile.procFilePathObj.exists():
+                    logging.info(f"Resuming downsampling of {str(projFile.origFilePathObj)} after {len(interruptedJob.series)} completed series.")
+                    notProcessedFiles.append((projFile, priority, interruptedJob, [s.series for s in interruptedJob.series]))
+                    continue
+
                 try:
                     projFile.procFilePathObj.unlink(missing_ok=True)
+                    projFile.deleteOverview()
                 except Exception as e:
                     raise RuntimeError(f"Downsample file {str(projFile.procFilePathObj)} exists and could not be deleted. The viewer will quit now. It is recommended that the processed file be deleted manually. \n{e}\n{traceback.format_exc()}")
                 else:
@@ -233,11 +338,26 @@ def loadProjects() -> Dict[int, Project]:
             
             # Add all non processed files for downsampling
             if not projFile.procFilePathObj.exists():
-                notProcessedFiles.append((str(projFile.origFilePathObj.resolve()), str(projFile.procFilePathObj.parent.resolve())))
-
-    for downsampParam in notProcessedFiles:
-        downsamplePool.apply_async(downsampleFile, downsampParam)
-
+                notProcessedFiles.append((projFile, priority, interruptedJob, None))
+
+            # Add all files modified since they were processed (e.g. data
+            # appended by a continuous recording) for updating
+            elif projFile.origFilePathObj.stat().st_mtime > projFile.procFilePathObj.stat().st_mtime:
+                outdatedFiles.append((projFile, priority, interruptedJob))
+
+            # A job interrupted after its processed file was completed has
+            # nothing left to do
+            elif interruptedJob is not None:
+                interruptedJob.status = STATUS_COMPLETED
+                models.db.session.commit()
+
+    for projFile, priority, job, resume in notProcessedFiles:
+        downsampParam = (str(projFile.origFilePathObj.resolve()), str(projFile.procFilePathObj.parent.resolve()), None, resume, projFile.projparent.getVisibleSeriesIDs())
+        downsampleQueue.submit(projFile, JOB_DOWNSAMPLE, downsampleFile, downsampParam, priority, job=job, keepSeries=resume is not None)
+
+    for projFile, priority, job in outdatedFiles:
+        downsampParam = (str(projFile.origFilePathObj.resolve()), str(projFile.procFilePathObj.parent.resolve()))
+        downsampleQueue.submit(projFile, JOB_UPDATE, updateDownsampledFile, downsampParam, priority, job=job)
 
     logging.info("Finished loading projects.")
 
@@ -0,0 +1,111 @@
+"""Coalescing of identical in-flight requests, and supersession of stale ones."""
+
+from collections import OrderedDict
+import threading
+
+# Maximum number of request channels whose latest generation is tracked (see
+# RequestGenerations), beyond which the least recently used are forgotten
+MAX_CHANNELS = 10000
+
+class SingleFlight:
+    """
+    Coalesces identical calls made concurrently, such as requests from several users for the same ranged output of a
+    file: while a call with a given key is in flight, further calls with the same key wait for it and share its
+    result (or exception) rather than repeating the work.
+    """
+
+    def __init__(self):
+
+        # Guards the calls in flight
+        self.lock = threading.Lock()
+
+        # Calls in flight, mapped from key to [event, result, exception]
+        self.calls = {}
+
+        self.coalesced = 0
+
+    def do(self, key, fn):
+        """Returns fn(), or the result of the identical call with the given key already in flight, if any."""
+
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = [threading.Event(), None, None]
+            else:
+                self.coalesced = self.coalesced + 1
+
+        if not leader:
+            call[0].wait()
+            if call[2] is not None:
+                raise call[2]
+            return call[1]
+
+        try:
+            call[1] = fn()
+        except Exception as e:
+            call[2] = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call[0].set()
+
+        return call[1]
+
+class RequestGenerations:
+    """
+    Tracks the latest generation of the requests made on each channel (e.g. a client's requests for the data of the
+    view of a file), so that a request superseded by a later one on the same channel may be abandoned. Generations
+    increase with each request a client makes on a channel.
+    """
+
+    def __init__(self):
+
+        # Guards the generations
+        self.lock = threading.Lock()
+
+        # Latest generation by channel, from least to most recently used
+        self.generations = OrderedDict()
+
+        self.superseded = 0
+
+    def begin(self, channel, generation):
+        """
+        Records a request of the given generation on the channel.
+        :return: False if a later request has already been made on the channel (i.e. the request is stale), True
+        otherwise
+        """
+
+        with self.lock:
+
+            latest = self.generations.get(channel)
+            if latest is not None and generation < latest:
+                self.superseded = self.superseded + 1
+                return False
+
+            self.generations[channel] = generation
+            self.generations.move_to_end(channel)
+            while len(self.generations) > MAX_CHANNELS:
+                self.generations.popitem(last=False)
+
+        return True
+
+    def isCurrent(self, channel, generation):
+        """Returns whether no later request than the given generation has been made on the channel."""
+
+        with self.lock:
+
+            latest = self.generations.get(channel)
+            if latest is not None and generation < latest:
+                self.superseded = self.superseded + 1
+                return False
+
+        return True
+
+# Coalesces identical requests for the ranged output of series of a file (see
+# File.getSeriesRangedOutput), across users & the prefetcher
+rangedOutputFlights = SingleFlight()
+
+# Tracks the generations of clients' requests for ranged series data
+rangedRequestGenerations = RequestGenerations()
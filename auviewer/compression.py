@@ -0,0 +1,114 @@
+"""Negotiated compression & chunked streaming of data responses."""
+
+import zlib
+
+from .config import config
+
+# Brotli compression is available only if the brotli package is installed.
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Brotli quality used for responses. Qualities above 5 compress series data
+# little further at a much greater cost in time.
+BROTLI_QUALITY = 5
+
+# Returns the content codings supported for responses, in order of preference
+def getSupportedEncodings():
+    return (['br'] if brotli is not None else []) + ['gzip', 'deflate']
+
+# Returns the content coding with which to compress a response per the client's
+# accepted encodings (e.g. request.accept_encodings), or None if the response
+# should not be compressed (i.e. the client accepts none of the supported
+# encodings, or compression is disabled).
+def negotiateEncoding(acceptEncodings):
+    if config['responseCompressionMinSize'] is None:
+        return None
+    return acceptEncodings.best_match(getSupportedEncodings())
+
+# Returns a compressor object for the content coding, with compress(data) and
+# flush() methods returning bytes
+def newCompressor(encoding):
+    if encoding == 'br':
+        return BrotliCompressor()
+    level = config['responseCompressionLevel']
+    return zlib.compressobj(level=-1 if level is None else level, wbits=31 if encoding == 'gzip' else 15)
+
+class BrotliCompressor:
+    """Adapts brotli.Compressor to the interface of zlib compressor objects."""
+
+    def __init__(self):
+        self.compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+
+    def compress(self, data):
+        return self.compressor.process(data)
+
+    def flush(self):
+        return self.compressor.finish()
+
+# Yields the chunks (str or bytes) as bytes coalesced into chunks of at least
+# size bytes (except the last), so that a response generated in many small
+# pieces (e.g. by a JSON encoder) is sent & compressed efficiently.
+def coalesceChunks(chunks, size):
+
+    buffer = []
+    bufferSize = 0
+
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        buffer.append(chunk)
+        bufferSize = bufferSize + len(chunk)
+        if bufferSize >= size:
+            yield b''.join(buffer)
+            buffer = []
+            bufferSize = 0
+
+    if bufferSize > 0:
+        yield b''.join(buffer)
+
+# Yields the chunks compressed with the content coding
+def compressChunks(chunks, encoding):
+
+    compressor = newCompressor(encoding)
+
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if len(compressed) > 0:
+            yield compressed
+
+    yield compressor.flush()
+
+# Returns the body of a response generated as chunks (str or bytes), along with
+# its content coding (or None), per the accepted encodings (see
+# negotiateEncoding). The body is the response itself, as bytes, if it is
+# smaller than the responseCompressionMinSize config setting (or, if it is not
+# to be compressed, than a chunk). Otherwise, the body is a generator
+# which encodes (and compresses) the rest of the response as it is streamed,
+# so that the full encoded response is never held in memory at once.
+def streamResponseBody(chunks, acceptEncodings):
+
+    encoding = negotiateEncoding(acceptEncodings)
+    minSize = config['responseCompressionMinSize'] if encoding is not None else config['responseChunkSize']
+
+    # Read ahead until the response is known to be at least minSize
+    chunks = coalesceChunks(chunks, config['responseChunkSize'])
+    head = []
+    headSize = 0
+    for chunk in chunks:
+        head.append(chunk)
+        headSize = headSize + len(chunk)
+        if headSize >= minSize:
+            break
+    else:
+        return b''.join(head), None
+
+    def generate():
+        yield from head
+        yield from chunks
+
+    if encoding is None:
+        return generate(), None
+
+    return compressChunks(generate(), encoding), encoding
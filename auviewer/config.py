@@ -40,6 +40,109 @@ config = {
     # is 3K intervals, the second 6K, the third 12K, and so forth.
     'stepMultiplier': 2,
 
+    # Memory budget, in megabytes, for downsampling a single series. Series
+    # whose raw data would exceed this budget are downsampled by streaming the
+    # raw data from the original file in chunks instead of reading it into
+    # memory all at once.
+    'downsampleMemoryBudget': 1024,
+
+    # Number of threads used to downsample the series of a file concurrently
+    # (series belonging to the same dataset are downsampled together). Note
+    # that each thread may use up to downsampleMemoryBudget.
+    'downsampleThreads': 1,
+
+    # Number of partitions (and threads) used to build each downsample level of
+    # a single large series concurrently. Partitioning only applies to levels
+    # with enough data points to make it worthwhile.
+    'downsamplePartitions': 1,
+
+    # Whether downsamples store per-interval aggregates (count, sum, sum of
+    # squares, first & last value) in addition to time, min & max, so that
+    # statistics over a time range may be computed from a downsample rather
+    # than the raw data.
+    'downsampleAggregates': True,
+
+    # Storage layout of downsamples in processed files. Downsamples are stored
+    # in HDF5 chunks of downsampleChunkRows intervals (or an automatically
+    # chosen size if None), compressed with downsampleCompression ('gzip',
+    # 'lzf', 'blosc' if hdf5plugin is installed, or None) at
+    # downsampleCompressionLevel (or the filter's default if None). If
+    # downsampleFloat32 is set, min, max, first & last values are stored as
+    # float32. If downsampleTimeOffsets is set, time offsets are stored
+    # relative to the first interval of each downsample, as float32 where that
+    # resolves them to within 1% of an interval. The layout of each downsample
+    # is recorded in the processed file and decoded transparently.
+    'downsampleChunkRows': None,
+    'downsampleCompression': 'gzip',
+    'downsampleCompressionLevel': None,
+    'downsampleFloat32': False,
+    'downsampleTimeOffsets': False,
+
+    # Number of files downsampled concurrently in the background (or half the
+    # CPU count if None). Files opened by users are downsampled first, then
+    # files in assigned pattern sets, then the rest.
+    'downsampleConcurrency': None,
+
+    # Memory limit, in megabytes, for downsampling a single file in the
+    # background (or no limit if None). Downsampling of a file exceeding it
+    # fails rather than exhausting memory.
+    'downsampleJobMemoryLimit': None,
+
+    # Number of the coarsest downsample levels of every series which are built
+    # & published in an overview file before the full downsamples are built, so
+    # that a file being downsampled may be viewed from those levels (see
+    # File.processOverview). Series shown by the project template are done
+    # first. 0 disables the overview.
+    'downsampleOverviewLevels': 6,
+
+    # If set, a visual pyramid of M4 points (the first, last, min & max point of
+    # each bucket) is built and stored alongside the min/max downsamples, so
+    # that series may be output in 'm4' or 'lttb' mode. downsampleMode is the
+    # default output mode ('minmax', 'm4' or 'lttb'), which may be overridden
+    # per project or series in the project template (see
+    # Project.getSeriesDownsampleMode). Series without an M4 pyramid are output
+    # in 'minmax' mode.
+    'downsampleVisualPyramid': False,
+    'downsampleMode': 'minmax',
+
+    # Clients may request series data for a plot of a given pixel width (or
+    # with a given point budget), in which case the downsample is chosen to
+    # deliver about intervalsPerPixel intervals per pixel rather than M, with no
+    # more than maxPointBudget per series.
+    'intervalsPerPixel': 2,
+    'maxPointBudget': 20000,
+
+    # Memory budget, in megabytes, of the cache of tiles of ranged series
+    # output shared by all files & users (or 0 to disable the cache). See
+    # tilecache.py.
+    'tileCacheBudget': 256,
+
+    # After answering a request for ranged series data, the tile cache is
+    # warmed in the background with the ranges the user is likely to request
+    # next (the windows one viewport to the left & right, and the next zoom-out
+    # level), by prefetchThreads threads which yield to foreground requests.
+    # Each user may have up to prefetchBudget ranges pending (or 0 to disable
+    # prefetching). See prefetch.py.
+    'prefetchBudget': 6,
+    'prefetchThreads': 1,
+
+    # Memory budget, in megabytes, of the cache of the user-independent portion
+    # of initial file payloads (series, metadata & events) shared by all files &
+    # users. Up to payloadBlobsPerFile of these (for different point budgets)
+    # are also stored as blobs next to each processed file, so that they survive
+    # restarts (or 0 to disable the blobs). See payloadcache.py.
+    'payloadCacheBudget': 128,
+    'payloadBlobsPerFile': 4,
+
+    # Series data responses of at least responseCompressionMinSize bytes are
+    # compressed (with brotli if installed, gzip or deflate, per the client's
+    # Accept-Encoding header) at responseCompressionLevel (or zlib's default if
+    # None). If responseCompressionMinSize is None, responses are not
+    # compressed. Large responses are streamed in chunks of responseChunkSize
+    # bytes as they are encoded.
+    'responseCompressionMinSize': 1024,
+    'responseCompressionLevel': 6,
+    'responseChunkSize': 65536,
 
 
     ### Asset locations
@@ -188,6 +291,31 @@ def load_config(cp):
         'rootWebPath',
         'secret_key',
         'mail',
+
+        'downsampleMemoryBudget',
+        'downsampleThreads',
+        'downsamplePartitions',
+        'downsampleAggregates',
+        'downsampleChunkRows',
+        'downsampleCompression',
+        'downsampleCompressionLevel',
+        'downsampleFloat32',
+        'downsampleTimeOffsets',
+        'downsampleConcurrency',
+        'downsampleJobMemoryLimit',
+        'downsampleOverviewLevels',
+        'downsampleVisualPyramid',
+        'downsampleMode',
+        'intervalsPerPixel',
+        'maxPointBudget',
+        'tileCacheBudget',
+        'prefetchBudget',
+        'prefetchThreads',
+        'payloadCacheBudget',
+        'payloadBlobsPerFile',
+        'responseCompressionMinSize',
+        'responseCompressionLevel',
+        'responseChunkSize',
     ]
 
     # Set/override any valid settings provided in the json config file
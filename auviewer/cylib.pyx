@@ -6,101 +6,194 @@
 import logging
 import numpy as np
 cimport numpy as np
-from libc.math cimport floor
-
-# Given an already-built downsample, this function builds the next downsample up.
-# It bases the "next downsample up" on the time-per-interval of the original
-# downsample and the step multiplier provided. For example, if the original
-# time-per-interval is 5s and the step multiplier is 3, the new downsample will
-# have a time-per-interval of 5*3=15s.
-def buildNextDownsampleUp(np.ndarray[np.float64_t, ndim=2] intervalsOrig, double timePerIntervalOrig, int stepMultiplier):
-
-    # Get the number of intervals in the original downsample.
-    cdef int numIntervalsOrig = intervalsOrig.shape[0]
-
-    # Do a sanity check
-    if numIntervalsOrig < stepMultiplier:
-        return
-
-    # Will hold our new downsample. We allocate the worst-case number of
-    # intervals needed for the new downsample, which would be equal to the
-    # original downsample (for example, if each interval of the original
-    # downsample were separated from the other by at least
-    # timePerIntervalOrig * stepMultiplier.
-    cdef np.ndarray[np.float64_t, ndim=2] intervalsNew = np.zeros((numIntervalsOrig, 3))
+from libc.math cimport fabs, floor
+
+# The downsample kernels below do not hold the GIL while they run, so that
+# several series may be downsampled concurrently by threads within a single
+# process. Each kernel is implemented once as a resumable cdef function which
+# operates on a chunk of input data and carries the interval currently being
+# built across calls in a state array. The Python-facing functions build a
+# downsample either from a complete array at once (e.g. buildDownsampleFromRaw)
+# or from consecutive chunks (e.g. buildDownsampleFromRawChunk).
+#
+# Each downsample interval is a row of either 3 columns (time offset, min &
+# max) or, if aggregates are requested, 8 columns (time offset, min, max, count,
+# sum, sum of squares, first value & last value). The count, sum & sum of
+# squares exclude NaN values. Aggregates are rolled up exactly from one
+# downsample to the next, so that statistics over a range may be computed from
+# any downsample.
+cdef enum:
+    NUM_COLUMNS = 3
+    NUM_COLUMNS_AGGREGATES = 8
+
+# Layout of the state array carried between calls to the raw downsample kernel.
+# The state holds the boundaries and statistics of the interval currently being
+# built, which may continue into the next chunk.
+cdef enum:
+    RAW_STATE_LEFTBOUNDARY = 0
+    RAW_STATE_RIGHTBOUNDARY = 1
+    RAW_STATE_OPEN = 2
+    RAW_STATE_TIME = 3
+    RAW_STATE_MIN = 4
+    RAW_STATE_MAX = 5
+    RAW_STATE_NUMCOLUMNS = 6
+    RAW_STATE_COUNT = 7
+    RAW_STATE_SUM = 8
+    RAW_STATE_SUMSQ = 9
+    RAW_STATE_FIRST = 10
+    RAW_STATE_LAST = 11
+    RAW_STATE_SIZE = 12
+
+# Layout of the state array carried between calls to the next-downsample-up
+# kernel. In addition to the interval currently being built, it holds the base
+# offset, which is taken from the first original interval received. The count
+# is the number of original intervals in the interval, while the data count is
+# the count aggregate.
+cdef enum:
+    UP_STATE_INITIALIZED = 0
+    UP_STATE_BASEOFFSET = 1
+    UP_STATE_LEFTBOUNDARY = 2
+    UP_STATE_RIGHTBOUNDARY = 3
+    UP_STATE_OPEN = 4
+    UP_STATE_TIMESUM = 5
+    UP_STATE_MIN = 6
+    UP_STATE_MAX = 7
+    UP_STATE_COUNT = 8
+    UP_STATE_NUMCOLUMNS = 9
+    UP_STATE_DATACOUNT = 10
+    UP_STATE_SUM = 11
+    UP_STATE_SUMSQ = 12
+    UP_STATE_FIRST = 13
+    UP_STATE_LAST = 14
+    UP_STATE_SIZE = 15
+
+# Builds downsample intervals from a chunk of the original downsample intervals
+# into the intervalsNew output array, continuing the interval left open in the
+# state array by the previous chunk. Completed intervals are written to
+# intervalsNew, and the number written is returned. If the final parameter is
+# set, the last interval is completed as well; otherwise it is left open in the
+# state for the next chunk. Returns -1 if intervalsNew is too small. The number
+# of times the rounding heuristic (see below) was used is added to
+# numHeuristic.
+cdef long _buildNextDownsampleUp(const double[:, :] intervalsOrig, double timePerIntervalOrig, int stepMultiplier, double[:] state, double[:, :] intervalsNew, bint final, long *numHeuristic) nogil:
+
+    # Get the number of intervals in this chunk of the original downsample.
+    cdef long numIntervalsOrig = intervalsOrig.shape[0]
+
+    # Holds the capacity of the output array
+    cdef long maxIntervalsNew = intervalsNew.shape[0]
 
     # Determine the new time-per-interval
     cdef double timePerIntervalNew = timePerIntervalOrig*stepMultiplier
 
     # This is the base offset, or essentially the time offset of the original
-    # first raw data point in the series.
-    cdef double baseOffset = intervalsOrig[0,0] - (timePerIntervalOrig / 2)
+    # first raw data point in the series. It is determined by the very first
+    # original interval.
+    if state[UP_STATE_INITIALIZED] == 0 and numIntervalsOrig > 0:
+        state[UP_STATE_INITIALIZED] = 1
+        state[UP_STATE_BASEOFFSET] = intervalsOrig[0,0] - (timePerIntervalOrig / 2)
+        state[UP_STATE_LEFTBOUNDARY] = state[UP_STATE_BASEOFFSET]
+        state[UP_STATE_RIGHTBOUNDARY] = state[UP_STATE_BASEOFFSET] + timePerIntervalNew
+    cdef double baseOffset = state[UP_STATE_BASEOFFSET]
 
     # Will track the stepwise left & right boundary of the new intervals
-    cdef double leftboundaryNew = baseOffset
-    cdef double rightboundaryNew = leftboundaryNew + timePerIntervalNew
+    cdef double leftboundaryNew = state[UP_STATE_LEFTBOUNDARY]
+    cdef double rightboundaryNew = state[UP_STATE_RIGHTBOUNDARY]
 
     # Holds the index of the current original interval we're working on.
-    cdef int cio = 0
+    cdef long cio = 0
 
     # Holds the index of the current new interval we're working on. We start at
     # -1 because the loop will increment the index the first time it runs in
     # order to point to the "first" interval.
-    cdef int cin = -1
+    cdef long cin = -1
 
-    # Temporary-use iterator to be used below
+    # Holds the number of original intervals in the current new interval
     cdef int i
 
-    while cio < numIntervalsOrig:
-
-        # If this original interval does not belong to the current new interval
-        # boundaries, compute the subsequent new interval boundaries to which
-        # it belongs.
-        if intervalsOrig[cio,0] >= rightboundaryNew:
-
-            leftboundaryNew = floor( (intervalsOrig[cio,0]-baseOffset) / timePerIntervalNew) * timePerIntervalNew + baseOffset
-            rightboundaryNew = leftboundaryNew + timePerIntervalNew
-
-            # NOTE: We do not progress cin because we have simply skipped an
-            # empty interval, and we do not store/represent empty intervals.
-
-        # The above code block (if statement) calculates precisely which
-        # interval window the data point is a member of. However, in the case of
-        # very small intervals (e.g. if a data series has dense data and
-        # requires downsampling using high floating point precision), there may
-        # be floating point rounding which mucks things up and the data point
-        # actually belongs to an adjacent interval. This is a heuristic to
-        # account for such a possibility. The while loop criterion matches what
-        # is used in the while loop below, so we avoid an infinite loop
-        # situation in case there is a rounding error as described.
-        #
-        # NOTE: For some reason, the while loop (C addition) will use 15 places
-        # past the decimal for the exponent, but the computation in the if
-        # statement above only uses 12. In testing, the below while loop is used
-        # not infrequently for dense data sets (e.g. waveforms at 500 Hz). It
-        # has been observed to be used frequently for the downsample with the
-        # smallest interval and for 4-5 data points in waveform data sets in the
-        # 270-330MM data points range.
-        while intervalsOrig[cio,0] >= rightboundaryNew:
-
-            logging.info("Using the while heuristic for data point " + str(intervalsOrig[cio,0]))
-
-            # Update left & right boundaries to the next interval
-            leftboundaryNew = rightboundaryNew
-            rightboundaryNew = leftboundaryNew + timePerIntervalNew
+    # Whether the current new interval is resumed from the previous chunk
+    cdef bint resumed = state[UP_STATE_OPEN] != 0
+
+    # Whether aggregates are built
+    cdef bint aggregates = intervalsNew.shape[1] >= NUM_COLUMNS_AGGREGATES
+
+    while cio < numIntervalsOrig or resumed:
 
         # Increment the current index pointer to the next available interval.
         cin = cin + 1
 
         # Do a sanity check and double check that we have not gone out of bounds.
-        if cin >= numIntervalsOrig:
-            raise RuntimeError("Unexpectedly require more than numIntervalsOrig during downsample building from downsample.")
+        if cin >= maxIntervalsNew:
+            return -1
+
+        if resumed:
+
+            # Continue the interval left open by the previous chunk
+            intervalsNew[cin,0] = state[UP_STATE_TIMESUM]
+            intervalsNew[cin,1] = state[UP_STATE_MIN]
+            intervalsNew[cin,2] = state[UP_STATE_MAX]
+            i = <int>state[UP_STATE_COUNT]
+            if aggregates:
+                intervalsNew[cin,3] = state[UP_STATE_DATACOUNT]
+                intervalsNew[cin,4] = state[UP_STATE_SUM]
+                intervalsNew[cin,5] = state[UP_STATE_SUMSQ]
+                intervalsNew[cin,6] = state[UP_STATE_FIRST]
+                intervalsNew[cin,7] = state[UP_STATE_LAST]
+            resumed = False
+
+        else:
 
-        # Prime the min & max of the new interval to the first original interval
-        intervalsNew[cin,1] = intervalsOrig[cio,1]
-        intervalsNew[cin,2] = intervalsOrig[cio,2]
+            # If this original interval does not belong to the current new
+            # interval boundaries, compute the subsequent new interval
+            # boundaries to which it belongs.
+            if intervalsOrig[cio,0] >= rightboundaryNew:
+
+                leftboundaryNew = floor( (intervalsOrig[cio,0]-baseOffset) / timePerIntervalNew) * timePerIntervalNew + baseOffset
+                rightboundaryNew = leftboundaryNew + timePerIntervalNew
+
+                # NOTE: We do not progress cin because we have simply skipped an
+                # empty interval, and we do not store/represent empty intervals.
+
+            # The above code block (if statement) calculates precisely which
+            # interval window the data point is a member of. However, in the
+            # case of very small intervals (e.g. if a data series has dense data
+            # and requires downsampling using high floating point precision),
+            # there may be floating point rounding which mucks things up and the
+            # data point actually belongs to an adjacent interval. This is a
+            # heuristic to account for such a possibility. The while loop
+            # criterion matches what is used in the while loop below, so we
+            # avoid an infinite loop situation in case there is a rounding error
+            # as described.
+            #
+            # NOTE: For some reason, the while loop (C addition) will use 15
+            # places past the decimal for the exponent, but the computation in
+            # the if statement above only uses 12. In testing, the below while
+            # loop is used not infrequently for dense data sets (e.g. waveforms
+            # at 500 Hz). It has been observed to be used frequently for the
+            # downsample with the smallest interval and for 4-5 data points in
+            # waveform data sets in the 270-330MM data points range.
+            while intervalsOrig[cio,0] >= rightboundaryNew:
+
+                numHeuristic[0] = numHeuristic[0] + 1
+
+                # Update left & right boundaries to the next interval
+                leftboundaryNew = rightboundaryNew
+                rightboundaryNew = leftboundaryNew + timePerIntervalNew
+
+            # Prime the min & max of the new interval to the first original
+            # interval
+            intervalsNew[cin,0] = 0
+            intervalsNew[cin,1] = intervalsOrig[cio,1]
+            intervalsNew[cin,2] = intervalsOrig[cio,2]
+            i = 0
+
+            # Prime the aggregates of the new interval
+            if aggregates:
+                intervalsNew[cin,3] = 0
+                intervalsNew[cin,4] = 0
+                intervalsNew[cin,5] = 0
+                intervalsNew[cin,6] = intervalsOrig[cio,6]
 
-        i = 0
         while cio < numIntervalsOrig and i < stepMultiplier and intervalsOrig[cio,0] < rightboundaryNew:
 
             # Update min & max
@@ -113,111 +206,247 @@ def buildNextDownsampleUp(np.ndarray[np.float64_t, ndim=2] intervalsOrig, double
             # end to yield the average time offset for the new interval
             intervalsNew[cin,0] = intervalsNew[cin,0] + intervalsOrig[cio,0]
 
+            # Roll up the aggregates
+            if aggregates:
+                intervalsNew[cin,3] = intervalsNew[cin,3] + intervalsOrig[cio,3]
+                intervalsNew[cin,4] = intervalsNew[cin,4] + intervalsOrig[cio,4]
+                intervalsNew[cin,5] = intervalsNew[cin,5] + intervalsOrig[cio,5]
+                intervalsNew[cin,7] = intervalsOrig[cio,7]
+
             cio = cio + 1
             i = i + 1
 
+        # If this chunk was exhausted and more chunks follow, the interval may
+        # continue in the next chunk, so carry it over in the state instead of
+        # completing it.
+        if cio == numIntervalsOrig and not final:
+            state[UP_STATE_OPEN] = 1
+            state[UP_STATE_TIMESUM] = intervalsNew[cin,0]
+            state[UP_STATE_MIN] = intervalsNew[cin,1]
+            state[UP_STATE_MAX] = intervalsNew[cin,2]
+            state[UP_STATE_COUNT] = i
+            if aggregates:
+                state[UP_STATE_DATACOUNT] = intervalsNew[cin,3]
+                state[UP_STATE_SUM] = intervalsNew[cin,4]
+                state[UP_STATE_SUMSQ] = intervalsNew[cin,5]
+                state[UP_STATE_FIRST] = intervalsNew[cin,6]
+                state[UP_STATE_LAST] = intervalsNew[cin,7]
+            cin = cin - 1
+            break
+
+        state[UP_STATE_OPEN] = 0
+
         # Divide the time offset for the new interval by i to yield the
         # average time offset of the original intervals represented.
         intervalsNew[cin,0] = intervalsNew[cin,0] / i
 
-    # Slice off the unused intervals
-    intervalsNew = intervalsNew[:cin+1]
-
-    # Return the new downsample intervals
-    return intervalsNew
+    # Save the boundaries of the current interval
+    state[UP_STATE_LEFTBOUNDARY] = leftboundaryNew
+    state[UP_STATE_RIGHTBOUNDARY] = rightboundaryNew
 
-# Given a series of raw values and a time-per-interval parameter, produces and
-# returns a two-dimension NumPy array of downsample intervals
-def buildDownsampleFromRaw(np.ndarray[np.float64_t, ndim=1] rawOffsets, np.ndarray[np.float64_t, ndim=1] rawValues, int numIntervals):
+    return cin + 1
 
-    # Calculate the timespan of the entire dataset
-    cdef double timespan = rawOffsets[rawOffsets.shape[0]-1] - rawOffsets[0]
+# Given an already-built downsample, this function builds the next downsample up.
+# It bases the "next downsample up" on the time-per-interval of the original
+# downsample and the step multiplier provided. For example, if the original
+# time-per-interval is 5s and the step multiplier is 3, the new downsample will
+# have a time-per-interval of 5*3=15s.
+def buildNextDownsampleUp(const double[:, :] intervalsOrig, double timePerIntervalOrig, int stepMultiplier):
 
-    # Calculate the interval size in seconds
-    cdef double timePerInterval = timespan / numIntervals
+    # Get the number of intervals in the original downsample.
+    cdef long numIntervalsOrig = intervalsOrig.shape[0]
 
-    # TODO(gus): FIX THIS BS!
-    origNumIntervals = numIntervals
-    numIntervals = numIntervals + 1
+    # Do a sanity check
+    if numIntervalsOrig < stepMultiplier:
+        return
 
-    # Allocate the maximum number of intervals needed (excess will be sliced off
-    # at the end). The two-dimensional array will have 3 columns and numIntervals
-    # rows. The columns, in order, will be: Time Offset, Min, Max, # Points.
-    cdef np.ndarray[np.float64_t, ndim=2] intervals = np.zeros((numIntervals, 3))
+    # Will hold our new downsample. We allocate the worst-case number of
+    # intervals needed for the new downsample, which would be equal to the
+    # original downsample (for example, if each interval of the original
+    # downsample were separated from the other by at least
+    # timePerIntervalOrig * stepMultiplier.
+    intervalsNew = np.zeros((numIntervalsOrig, intervalsOrig.shape[1]))
+
+    cdef double[:] state = newUpChunkState(aggregates=intervalsOrig.shape[1] >= NUM_COLUMNS_AGGREGATES)
+    cdef double[:, :] intervalsNewView = intervalsNew
+    cdef long numIntervalsNew
+    cdef long numHeuristic = 0
+
+    with nogil:
+        numIntervalsNew = _buildNextDownsampleUp(intervalsOrig, timePerIntervalOrig, stepMultiplier, state, intervalsNewView, True, &numHeuristic)
+
+    if numIntervalsNew < 0:
+        raise RuntimeError("Unexpectedly require more than numIntervalsOrig during downsample building from downsample.")
+
+    if numHeuristic > 0:
+        logging.info(f"Used the while heuristic for {numHeuristic} data points.")
+
+    # Slice off the unused intervals and return the new downsample intervals
+    return intervalsNew[:numIntervalsNew]
+
+# Returns a new state array for use with buildNextDownsampleUpChunk. If a base
+# offset is provided, the state is for a partition of the original downsample
+# which begins at an interval boundary (see buildNextDownsampleUpPartitioned),
+# so the boundaries of the first new interval are computed from the first
+# original interval received. If aggregates is set, the original intervals are
+# expected to include aggregates, which are rolled up into the new intervals.
+def newUpChunkState(baseOffset=None, bint aggregates=False):
+    state = np.zeros(UP_STATE_SIZE)
+    state[UP_STATE_NUMCOLUMNS] = NUM_COLUMNS_AGGREGATES if aggregates else NUM_COLUMNS
+    if baseOffset is not None:
+        state[UP_STATE_INITIALIZED] = 1
+        state[UP_STATE_BASEOFFSET] = baseOffset
+        state[UP_STATE_LEFTBOUNDARY] = -np.inf
+        state[UP_STATE_RIGHTBOUNDARY] = -np.inf
+    return state
+
+# Returns whether the given chunk of original downsample intervals begins a new
+# interval, with boundaries computed from its first original interval, when
+# continuing from the state. In this case, the chunk may be built independently
+# of the preceding chunks (see newUpChunkState).
+def upChunkStartsNewInterval(double[:] state, const double[:, :] intervalsOrig):
+    return intervalsOrig.shape[0] == 0 or intervalsOrig[0,0] >= state[UP_STATE_RIGHTBOUNDARY]
+
+# Resumable variant of buildNextDownsampleUp, which builds the next downsample
+# up from original downsample intervals delivered in consecutive chunks. The
+# state array (see newUpChunkState) holds the interval currently being built
+# across calls. Only the intervals completed by this chunk are returned. Once
+# all chunks have been provided, the final interval may be retrieved with
+# finishUpChunkState.
+def buildNextDownsampleUpChunk(const double[:, :] intervalsOrig, double timePerIntervalOrig, int stepMultiplier, double[:] state):
+
+    # Allocate the maximum number of completed intervals possible, which is one
+    # per original interval plus the interval carried over from the previous
+    # chunk.
+    intervalsNew = np.zeros((intervalsOrig.shape[0] + 1, <long>state[UP_STATE_NUMCOLUMNS]))
+
+    cdef double[:, :] intervalsNewView = intervalsNew
+    cdef long numIntervalsNew
+    cdef long numHeuristic = 0
+
+    if intervalsOrig.shape[0] > 0 and intervalsOrig.shape[1] < intervalsNew.shape[1]:
+        raise ValueError("The original intervals do not include aggregates.")
+
+    with nogil:
+        numIntervalsNew = _buildNextDownsampleUp(intervalsOrig, timePerIntervalOrig, stepMultiplier, state, intervalsNewView, False, &numHeuristic)
+
+    if numHeuristic > 0:
+        logging.info(f"Used the while heuristic for {numHeuristic} data points.")
+
+    return intervalsNew[:numIntervalsNew]
+
+# Returns the interval left open in the state array of a chunked next-downsample
+# build as a 1-row array (or 0-row if there is none) and closes it.
+def finishUpChunkState(double[:] state):
+    if state[UP_STATE_OPEN] == 0:
+        return np.zeros((0, <long>state[UP_STATE_NUMCOLUMNS]))
+    state[UP_STATE_OPEN] = 0
+    interval = [state[UP_STATE_TIMESUM] / state[UP_STATE_COUNT], state[UP_STATE_MIN], state[UP_STATE_MAX]]
+    if state[UP_STATE_NUMCOLUMNS] >= NUM_COLUMNS_AGGREGATES:
+        interval.extend([state[UP_STATE_DATACOUNT], state[UP_STATE_SUM], state[UP_STATE_SUMSQ], state[UP_STATE_FIRST], state[UP_STATE_LAST]])
+    return np.array([interval])
+
+# Builds downsample intervals from a chunk of raw data into the intervals output
+# array, continuing the interval left open in the state array by the previous
+# chunk. The baseOffset is the time offset of the first data point of the entire
+# series. Completed intervals are written to intervals, and the number written
+# is returned. If the final parameter is set, the last interval is completed as
+# well; otherwise it is left open in the state for the next chunk. Returns -1 if
+# the intervals array is too small.
+cdef long _buildDownsampleFromRaw(const double[:] rawOffsets, const double[:] rawValues, double baseOffset, double timePerInterval, double[:] state, double[:, :] intervals, bint final) nogil:
 
-    # This is the base offset, or the time offset of the first data point.
-    cdef double baseOffset = rawOffsets[0]
+    # Grab data points length so we don't have to look it up every time.
+    cdef long numDataPoints = rawOffsets.shape[0]
 
-    # Establish our initial boundaries for the first interval
-    cdef double leftboundary = baseOffset
-    cdef double rightboundary = leftboundary + timePerInterval
+    # Holds the capacity of the output array
+    cdef long maxIntervals = intervals.shape[0]
 
-    # Grab data points length so we don't have to look it up every time.
-    cdef int numDataPoints = rawOffsets.shape[0]
+    # Establish our boundaries for the current interval
+    cdef double leftboundary = state[RAW_STATE_LEFTBOUNDARY]
+    cdef double rightboundary = state[RAW_STATE_RIGHTBOUNDARY]
 
     # Holds the index of the current data point we're working on.
-    cdef int cdpi = 0
+    cdef long cdpi = 0
 
     # Holds the index of the current interval we're working on. We start at -1
     # because the loop will increment the index the first time it runs in order
     # to point to the "first" interval.
-    cdef int cii = -1
+    cdef long cii = -1
+
+    # Whether the current interval is resumed from the previous chunk
+    cdef bint resumed = state[RAW_STATE_OPEN] != 0
 
-    cdef double leftboundaryORIG, rightboundaryORIG, leftboundaryIF, rightboundaryIF, leftboundaryWHILE, rightboundaryWHILE
+    # Whether aggregates are built
+    cdef bint aggregates = intervals.shape[1] >= NUM_COLUMNS_AGGREGATES
+
+    # Holds the value of the current data point
+    cdef double value
 
     # For all data points
-    while cdpi < numDataPoints:
-
-        # If the next data point does not belong to the current interval
-        # boundaries, compute the next interval boundaries to which it belongs.
-        if rawOffsets[cdpi] >= rightboundary:
-
-            # Compute the left & right boundaries for the new interval.
-            leftboundary = floor( (rawOffsets[cdpi]-baseOffset) / timePerInterval) * timePerInterval + baseOffset
-            rightboundary = leftboundary + timePerInterval
-
-            # NOTE: We do not progress cii because we have simply skipped an
-            # empty interval, and we do not store/represent empty intervals.
-
-        # The above code block (if statement) calculates precisely which
-        # interval window the data point is a member of. However, in the case of
-        # very small intervals (e.g. if a data series has dense data and
-        # requires downsampling using high floating point precision), there may
-        # be floating point rounding which mucks things up and the data point
-        # actually belongs to an adjacent interval. This is a heuristic to
-        # account for such a possibility. The while loop criterion matches what
-        # is used in the while loop below, so we avoid an infinite loop
-        # situation in case there is a rounding error as described.
-        #
-        # NOTE: For some reason, the while loop (C addition) will use 15 places
-        # past the decimal for the exponent, but the computation in the if
-        # statement above only uses 12. In testing, the below while loop is used
-        # not infrequently for dense data sets (e.g. waveforms at 500 Hz). It
-        # has been observed to be used frequently for the downsample with the
-        # smallest interval and for 4-5 data points in waveform data sets in the
-        # 270-330MM data points range.
-        while rawOffsets[cdpi] >= rightboundary:
-
-            #print("Using the while heuristic for data point " + str(rawOffsets[cdpi]))
-
-            # Update left & right boundaries to the next interval
-            leftboundary = rightboundary
-            rightboundary = leftboundary + timePerInterval
+    while cdpi < numDataPoints or resumed:
 
         # Increment the current index pointer to the next available interval.
         cii = cii + 1
 
-        # Do a sanity check. We don't expect to ever need more than numIntervals
-        # intervals. However, double check that we have not gone out of bounds.
-        if cii >= numIntervals:
-            raise RuntimeError("Unexpectedly required more than numIntervals intervals during downsample building from raw. numIntervals: "+str(numIntervals)+", cii: "+str(cii)+", leftboundary: "+str(leftboundary)+", rightboundary: "+str(rightboundary)+", cdpi: "+str(cdpi)+", numDataPoints: "+str(numDataPoints)+", rawOffsets[cdpi]: "+str(rawOffsets[cdpi])+", rawValues[cdpi]: "+str(rawValues[cdpi]))
+        # Do a sanity check. We don't expect to ever need more than the
+        # intervals allocated. However, double check that we have not gone out
+        # of bounds.
+        if cii >= maxIntervals:
+            return -1
+
+        if resumed:
+
+            # Continue the interval left open by the previous chunk
+            intervals[cii,0] = state[RAW_STATE_TIME]
+            intervals[cii,1] = state[RAW_STATE_MIN]
+            intervals[cii,2] = state[RAW_STATE_MAX]
+            if aggregates:
+                intervals[cii,3] = state[RAW_STATE_COUNT]
+                intervals[cii,4] = state[RAW_STATE_SUM]
+                intervals[cii,5] = state[RAW_STATE_SUMSQ]
+                intervals[cii,6] = state[RAW_STATE_FIRST]
+                intervals[cii,7] = state[RAW_STATE_LAST]
+            resumed = False
+
+        else:
+
+            # If the next data point does not belong to the current interval
+            # boundaries, compute the next interval boundaries to which it
+            # belongs.
+            if rawOffsets[cdpi] >= rightboundary:
+
+                # Compute the left & right boundaries for the new interval.
+                leftboundary = floor( (rawOffsets[cdpi]-baseOffset) / timePerInterval) * timePerInterval + baseOffset
+                rightboundary = leftboundary + timePerInterval
+
+                # NOTE: We do not progress cii because we have simply skipped an
+                # empty interval, and we do not store/represent empty intervals.
 
-        # Set the time for the interval
-        intervals[cii,0] = leftboundary + (timePerInterval / 2)
+            # The above code block (if statement) calculates precisely which
+            # interval window the data point is a member of. However, in the
+            # case of very small intervals, there may be floating point rounding
+            # which mucks things up and the data point actually belongs to an
+            # adjacent interval. See _buildNextDownsampleUp for details of this
+            # heuristic.
+            while rawOffsets[cdpi] >= rightboundary:
 
-        # Prime this interval's min & max with the first data point
-        intervals[cii,1] = rawValues[cdpi]
-        intervals[cii,2] = rawValues[cdpi]
+                # Update left & right boundaries to the next interval
+                leftboundary = rightboundary
+                rightboundary = leftboundary + timePerInterval
+
+            # Set the time for the interval
+            intervals[cii,0] = leftboundary + (timePerInterval / 2)
+
+            # Prime this interval's min & max with the first data point
+            intervals[cii,1] = rawValues[cdpi]
+            intervals[cii,2] = rawValues[cdpi]
+
+            # Prime this interval's aggregates
+            if aggregates:
+                intervals[cii,3] = 0
+                intervals[cii,4] = 0
+                intervals[cii,5] = 0
+                intervals[cii,6] = rawValues[cdpi]
 
         # While the next data point occurs within the current interval, add
         # it to the interval's statistics.
@@ -229,20 +458,368 @@ def buildDownsampleFromRaw(np.ndarray[np.float64_t, ndim=1] rawOffsets, np.ndarr
             if intervals[cii,2] < rawValues[cdpi]:
                 intervals[cii,2] = rawValues[cdpi]
 
+            # Update interval's aggregates, excluding NaN values from the
+            # count, sum & sum of squares
+            if aggregates:
+                value = rawValues[cdpi]
+                if value == value:
+                    intervals[cii,3] = intervals[cii,3] + 1
+                    intervals[cii,4] = intervals[cii,4] + value
+                    intervals[cii,5] = intervals[cii,5] + value * value
+                intervals[cii,7] = value
+
             # Increment cdpi to progress to the next data point
             cdpi = cdpi + 1
 
+        # If this chunk was exhausted and more chunks follow, the interval may
+        # continue in the next chunk, so carry it over in the state instead of
+        # completing it.
+        if cdpi == numDataPoints and not final:
+            state[RAW_STATE_OPEN] = 1
+            state[RAW_STATE_TIME] = intervals[cii,0]
+            state[RAW_STATE_MIN] = intervals[cii,1]
+            state[RAW_STATE_MAX] = intervals[cii,2]
+            if aggregates:
+                state[RAW_STATE_COUNT] = intervals[cii,3]
+                state[RAW_STATE_SUM] = intervals[cii,4]
+                state[RAW_STATE_SUMSQ] = intervals[cii,5]
+                state[RAW_STATE_FIRST] = intervals[cii,6]
+                state[RAW_STATE_LAST] = intervals[cii,7]
+            cii = cii - 1
+            break
+
+        state[RAW_STATE_OPEN] = 0
+
+    # Save the boundaries of the current interval
+    state[RAW_STATE_LEFTBOUNDARY] = leftboundary
+    state[RAW_STATE_RIGHTBOUNDARY] = rightboundary
+
+    return cii + 1
+
+# Given a series of raw values and a time-per-interval parameter, produces and
+# returns a two-dimension NumPy array of downsample intervals. If aggregates is
+# set, the intervals include aggregates.
+def buildDownsampleFromRaw(const double[:] rawOffsets, const double[:] rawValues, int numIntervals, bint aggregates=False):
+
+    # Grab data points length so we don't have to look it up every time.
+    cdef long numDataPoints = rawOffsets.shape[0]
+
+    # Calculate the timespan of the entire dataset
+    cdef double timespan = rawOffsets[numDataPoints-1] - rawOffsets[0]
+
+    # Calculate the interval size in seconds
+    cdef double timePerInterval = timespan / numIntervals
+
+    # TODO(gus): FIX THIS BS!
+    origNumIntervals = numIntervals
+    numIntervals = numIntervals + 1
+
+    # Allocate the maximum number of intervals needed (excess will be sliced off
+    # at the end). The two-dimensional array will have 3 columns (or 8 with
+    # aggregates) and numIntervals rows. The columns, in order, will be: Time
+    # Offset, Min, Max (followed by Count, Sum, Sum of Squares, First, Last).
+    intervals = np.zeros((numIntervals, NUM_COLUMNS_AGGREGATES if aggregates else NUM_COLUMNS))
+
+    # The base offset is the time offset of the first data point.
+    cdef double[:] state = newRawChunkState(rawOffsets[0], timePerInterval, aggregates=aggregates)
+    cdef double[:, :] intervalsView = intervals
+    cdef long numIntervalsBuilt
+
+    with nogil:
+        numIntervalsBuilt = _buildDownsampleFromRaw(rawOffsets, rawValues, rawOffsets[0], timePerInterval, state, intervalsView, True)
+
+    # Make sure we did not require more than numIntervals intervals.
+    if numIntervalsBuilt < 0:
+        raise RuntimeError("Unexpectedly required more than numIntervals intervals during downsample building from raw. numIntervals: "+str(numIntervals)+", timePerInterval: "+str(timePerInterval)+", numDataPoints: "+str(numDataPoints))
+
     # TODO(gus): TEMP
-    if cii >= origNumIntervals:
+    if numIntervalsBuilt - 1 >= origNumIntervals:
         # TODO(gus): I've made this an error because it's not relevant for users,
         # but this should be watched when next working on downsampling.
-        logging.info("Exceeded numIntervals! origNumIntervals: "+str(origNumIntervals)+", numIntervals: "+str(numIntervals)+", timePerInterval: "+str(timePerInterval)+", cii: "+str(cii)+", leftboundary: "+str(leftboundary)+", rightboundary: "+str(rightboundary)+", cdpi: "+str(cdpi)+", numDataPoints: "+str(numDataPoints)+", rawOffsets[cdpi]: "+str(rawOffsets[cdpi])+", rawValues[cdpi]: "+str(rawValues[cdpi]))
+        logging.info("Exceeded numIntervals! origNumIntervals: "+str(origNumIntervals)+", numIntervals: "+str(numIntervals)+", timePerInterval: "+str(timePerInterval)+", numIntervalsBuilt: "+str(numIntervalsBuilt)+", numDataPoints: "+str(numDataPoints))
+
+    # Slice off the unused intervals and return the downsampled intervals
+    return intervals[:numIntervalsBuilt]
+
+# Returns a new state array for use with buildDownsampleFromRawChunk. If
+# partition is set, the state is for a partition of the raw data which begins at
+# an interval boundary (see buildDownsampleFromRawPartitioned), so the
+# boundaries of the first interval are computed from the first data point
+# received. If aggregates is set, the intervals include aggregates.
+def newRawChunkState(double baseOffset, double timePerInterval, bint partition=False, bint aggregates=False):
+    state = np.zeros(RAW_STATE_SIZE)
+    state[RAW_STATE_NUMCOLUMNS] = NUM_COLUMNS_AGGREGATES if aggregates else NUM_COLUMNS
+    if partition:
+        state[RAW_STATE_LEFTBOUNDARY] = -np.inf
+        state[RAW_STATE_RIGHTBOUNDARY] = -np.inf
+    else:
+        state[RAW_STATE_LEFTBOUNDARY] = baseOffset
+        state[RAW_STATE_RIGHTBOUNDARY] = baseOffset + timePerInterval
+    return state
+
+# Returns whether the given chunk of raw data begins a new interval, with
+# boundaries computed from its first data point, when continuing from the state.
+# In this case, the chunk may be built independently of the preceding chunks
+# (see newRawChunkState).
+def rawChunkStartsNewInterval(double[:] state, const double[:] rawOffsets):
+    return rawOffsets.shape[0] == 0 or rawOffsets[0] >= state[RAW_STATE_RIGHTBOUNDARY]
+
+# Resumable variant of buildDownsampleFromRaw, which builds a downsample from
+# raw data delivered in consecutive chunks (e.g. when the raw data does not fit
+# in memory). The baseOffset is the time offset of the first data point of the
+# entire series and the timePerInterval is computed from the timespan of the
+# entire series, so that the resulting intervals are identical to those built by
+# buildDownsampleFromRaw. The state array (see newRawChunkState) holds the
+# interval currently being built across calls. Only the intervals completed by
+# this chunk are returned. Once all chunks have been provided, the final
+# interval may be retrieved with finishRawChunkState. If maxIntervals is
+# provided, no more than that many intervals are allocated for the chunk.
+def buildDownsampleFromRawChunk(const double[:] rawOffsets, const double[:] rawValues, double baseOffset, double timePerInterval, double[:] state, long maxIntervals=-1):
+
+    # Allocate the maximum number of completed intervals possible, which is one
+    # per data point plus the interval carried over from the previous chunk.
+    cdef long numIntervals = rawOffsets.shape[0] + 1
+    if 0 <= maxIntervals < numIntervals:
+        numIntervals = maxIntervals
+    intervals = np.zeros((numIntervals, <long>state[RAW_STATE_NUMCOLUMNS]))
+
+    cdef double[:, :] intervalsView = intervals
+    cdef long numIntervalsBuilt
+
+    with nogil:
+        numIntervalsBuilt = _buildDownsampleFromRaw(rawOffsets, rawValues, baseOffset, timePerInterval, state, intervalsView, False)
+
+    if numIntervalsBuilt < 0:
+        raise RuntimeError("Unexpectedly required more than maxIntervals intervals during downsample building from raw. maxIntervals: "+str(maxIntervals)+", timePerInterval: "+str(timePerInterval)+", numDataPoints: "+str(rawOffsets.shape[0]))
+
+    return intervals[:numIntervalsBuilt]
+
+# Returns the interval left open in the state array of a chunked raw downsample
+# build as a 1-row array (or 0-row if there is none) and closes it.
+def finishRawChunkState(double[:] state):
+    if state[RAW_STATE_OPEN] == 0:
+        return np.zeros((0, <long>state[RAW_STATE_NUMCOLUMNS]))
+    state[RAW_STATE_OPEN] = 0
+    interval = [state[RAW_STATE_TIME], state[RAW_STATE_MIN], state[RAW_STATE_MAX]]
+    if state[RAW_STATE_NUMCOLUMNS] >= NUM_COLUMNS_AGGREGATES:
+        interval.extend([state[RAW_STATE_COUNT], state[RAW_STATE_SUM], state[RAW_STATE_SUMSQ], state[RAW_STATE_FIRST], state[RAW_STATE_LAST]])
+    return np.array([interval])
+
+# Layout of the state array carried between calls to the M4 kernel. The state
+# holds the right boundary of the bucket currently being built and its first,
+# last, minimum & maximum data points (time offset & value of each).
+cdef enum:
+    M4_STATE_OPEN = 0
+    M4_STATE_RIGHTBOUNDARY = 1
+    M4_STATE_FIRSTTIME = 2
+    M4_STATE_FIRSTVALUE = 3
+    M4_STATE_LASTTIME = 4
+    M4_STATE_LASTVALUE = 5
+    M4_STATE_MINTIME = 6
+    M4_STATE_MINVALUE = 7
+    M4_STATE_MAXTIME = 8
+    M4_STATE_MAXVALUE = 9
+    M4_STATE_SIZE = 10
+
+# Writes the distinct first, minimum, maximum & last data points of the bucket
+# held in the state array to the points output array at index n, in order of
+# time, and returns the index following the last point written.
+cdef long _emitM4Bucket(double[:] state, double[:, :] points, long n) nogil:
+
+    cdef double times[4]
+    cdef double values[4]
+    cdef double t, v
+    cdef int i, j
+
+    times[0] = state[M4_STATE_FIRSTTIME]
+    values[0] = state[M4_STATE_FIRSTVALUE]
+    times[1] = state[M4_STATE_MINTIME]
+    values[1] = state[M4_STATE_MINVALUE]
+    times[2] = state[M4_STATE_MAXTIME]
+    values[2] = state[M4_STATE_MAXVALUE]
+    times[3] = state[M4_STATE_LASTTIME]
+    values[3] = state[M4_STATE_LASTVALUE]
+
+    # Stable insertion sort by time
+    for i in range(1, 4):
+        t = times[i]
+        v = values[i]
+        j = i - 1
+        while j >= 0 and times[j] > t:
+            times[j+1] = times[j]
+            values[j+1] = values[j]
+            j = j - 1
+        times[j+1] = t
+        values[j+1] = v
+
+    for i in range(4):
+        if i > 0 and times[i] == times[i-1] and values[i] == values[i-1]:
+            continue
+        points[n,0] = times[i]
+        points[n,1] = values[i]
+        n = n + 1
+
+    return n
+
+# Builds M4 points from a chunk of data points into the points output array,
+# continuing the bucket left open in the state array by the previous chunk.
+# The data points are divided into buckets of timePerInterval seconds starting
+# at baseOffset, and the first, minimum, maximum & last data points of each
+# bucket are kept with their actual time offsets. NaN values are skipped. The
+# points of buckets completed by this chunk are written to points, and the
+# number written is returned. The last bucket is left open in the state.
+cdef long _buildM4(const double[:] offsets, const double[:] values, double baseOffset, double timePerInterval, double[:] state, double[:, :] points) nogil:
+
+    cdef long numDataPoints = offsets.shape[0]
+    cdef long n = 0
+    cdef long i
+    cdef double t, v
+
+    for i in range(numDataPoints):
+
+        v = values[i]
+
+        # Skip NaN values
+        if v != v:
+            continue
+
+        t = offsets[i]
+
+        # Complete the open bucket if the data point is beyond it
+        if state[M4_STATE_OPEN] != 0 and t >= state[M4_STATE_RIGHTBOUNDARY]:
+            n = _emitM4Bucket(state, points, n)
+            state[M4_STATE_OPEN] = 0
+
+        if state[M4_STATE_OPEN] == 0:
+
+            # Open the bucket to which the data point belongs
+            state[M4_STATE_OPEN] = 1
+            state[M4_STATE_RIGHTBOUNDARY] = floor((t - baseOffset) / timePerInterval) * timePerInterval + baseOffset + timePerInterval
+            state[M4_STATE_FIRSTTIME] = t
+            state[M4_STATE_FIRSTVALUE] = v
+            state[M4_STATE_LASTTIME] = t
+            state[M4_STATE_LASTVALUE] = v
+            state[M4_STATE_MINTIME] = t
+            state[M4_STATE_MINVALUE] = v
+            state[M4_STATE_MAXTIME] = t
+            state[M4_STATE_MAXVALUE] = v
 
-    # Slice off the unused intervals
-    intervals = intervals[:cii+1]
+        else:
 
-    # Return the downsampled intervals
-    return intervals
+            state[M4_STATE_LASTTIME] = t
+            state[M4_STATE_LASTVALUE] = v
+            if v < state[M4_STATE_MINVALUE]:
+                state[M4_STATE_MINTIME] = t
+                state[M4_STATE_MINVALUE] = v
+            if v > state[M4_STATE_MAXVALUE]:
+                state[M4_STATE_MAXTIME] = t
+                state[M4_STATE_MAXVALUE] = v
+
+    return n
+
+# Returns a new state array for use with buildM4Chunk.
+def newM4ChunkState():
+    return np.zeros(M4_STATE_SIZE)
+
+# Builds M4 points (see _buildM4) from data points delivered in consecutive
+# chunks, returning a two-dimensional NumPy array of the points (time offset &
+# value) of the buckets completed by this chunk. The state array (see
+# newM4ChunkState) holds the bucket currently being built across calls. Once all
+# chunks have been provided, the points of the final bucket may be retrieved
+# with finishM4ChunkState. Since M4 points preserve the extremes of each bucket,
+# the M4 points of coarser buckets may be built from the M4 points of finer
+# ones rather than from the raw data.
+def buildM4Chunk(const double[:] offsets, const double[:] values, double baseOffset, double timePerInterval, double[:] state):
+
+    # Each data point completes at most one bucket of at most 4 points, and no
+    # more buckets may be completed than the chunk spans plus the bucket left
+    # open by the previous chunk.
+    cdef long numBuckets = offsets.shape[0]
+    if offsets.shape[0] > 0 and <double>numBuckets > (offsets[offsets.shape[0]-1] - offsets[0]) / timePerInterval + 2:
+        numBuckets = <long>((offsets[offsets.shape[0]-1] - offsets[0]) / timePerInterval) + 2
+    points = np.zeros((4 * numBuckets, 2))
+
+    cdef double[:, :] pointsView = points
+    cdef long numPoints
+
+    with nogil:
+        numPoints = _buildM4(offsets, values, baseOffset, timePerInterval, state, pointsView)
+
+    return points[:numPoints]
+
+# Returns the points of the bucket left open in the state array of a chunked M4
+# build as a two-dimensional array (with 0 rows if there is none) and closes it.
+def finishM4ChunkState(double[:] state):
+
+    points = np.zeros((4, 2))
+
+    cdef double[:, :] pointsView = points
+    cdef long numPoints = 0
+
+    if state[M4_STATE_OPEN] != 0:
+        numPoints = _emitM4Bucket(state, pointsView, 0)
+        state[M4_STATE_OPEN] = 0
+
+    return points[:numPoints]
+
+# Selects up to threshold of the given data points with the
+# largest-triangle-three-buckets algorithm, which divides the data points into
+# threshold - 2 buckets and keeps from each the data point forming the largest
+# triangle with the point kept from the previous bucket and the average of the
+# next bucket. The first & last data points are always kept. Returns a NumPy
+# array of the indices of the selected data points, in order.
+def largestTriangleThreeBuckets(const double[:] times, const double[:] values, long threshold):
+
+    cdef long numDataPoints = times.shape[0]
+
+    if threshold >= numDataPoints or threshold < 3:
+        return np.arange(numDataPoints)
+
+    indices = np.zeros(threshold, dtype=np.int64)
+    cdef np.int64_t[:] indicesView = indices
+
+    cdef double every = <double>(numDataPoints - 2) / (threshold - 2)
+    cdef long a = 0
+    cdef long i, j, rangeStart, rangeEnd, averageStart, averageEnd, selected
+    cdef double averageTime, averageValue, area, maxArea
+
+    with nogil:
+
+        indicesView[0] = 0
+
+        for i in range(threshold - 2):
+
+            # Average the data points of the next bucket (the last data point
+            # serves as the next bucket of the last bucket)
+            averageStart = <long>floor((i + 1) * every) + 1
+            averageEnd = <long>floor((i + 2) * every) + 1
+            if averageEnd > numDataPoints:
+                averageEnd = numDataPoints
+            averageTime = 0
+            averageValue = 0
+            for j in range(averageStart, averageEnd):
+                averageTime = averageTime + times[j]
+                averageValue = averageValue + values[j]
+            averageTime = averageTime / (averageEnd - averageStart)
+            averageValue = averageValue / (averageEnd - averageStart)
+
+            # Select the data point of this bucket forming the largest triangle
+            rangeStart = <long>floor(i * every) + 1
+            rangeEnd = <long>floor((i + 1) * every) + 1
+            maxArea = -1
+            selected = rangeStart
+            for j in range(rangeStart, rangeEnd):
+                area = fabs((times[a] - averageTime) * (values[j] - values[a]) - (times[a] - times[j]) * (averageValue - values[a]))
+                if area > maxArea:
+                    maxArea = area
+                    selected = j
+
+            indicesView[i + 1] = selected
+            a = selected
+
+        indicesView[threshold - 1] = numDataPoints - 1
+
+    return indices
 
 # Generates a two-dimensional Nx2 alerts array, with N alerts in the first
 # dimension and each alert having a start time in the first array element and a
@@ -444,22 +1021,22 @@ def getSliceParam(ds, timecol, unsigned short side, double target):
 # M=3000 and stepMultiplier=2, and assume the return value is 7. In this case,
 # the following downsamples should be built: 3000, 6000, 12000, 24000, 48000,
 # 96000, 192000.
-def numDownsamplesToBuild(np.ndarray[np.float64_t, ndim=1] rawOffsets, int M, int stepMultiplier):
+def numDownsamplesToBuild(const double[:] rawOffsets, int M, int stepMultiplier):
 
     # Grab the rawOffsets length
-    cdef int numDataPoints = rawOffsets.shape[0]
-
-    # Calculate the timespan of the entire dataset
-    cdef double timespan = rawOffsets[rawOffsets.shape[0]-1] - rawOffsets[0]
+    cdef long numDataPoints = rawOffsets.shape[0]
 
     # If we have fewer than or equal to 2M data points, no downsamples need to
     # be built and we can return immediately.
     if numDataPoints <= 2*M:
         return 0
 
+    # Calculate the timespan of the entire dataset
+    cdef double timespan = rawOffsets[numDataPoints-1] - rawOffsets[0]
+
     # The first & last variables track the sliding window of 2M data points.
-    cdef int first = 0
-    cdef int last = 2*M-1
+    cdef long first = 0
+    cdef long last = 2*M-1
 
     # The currentTimeWindow variable will track the time window of the current
     # sliding window of 2M data points. The smallestTimeWindow will, after
@@ -468,6 +1045,10 @@ def numDownsamplesToBuild(np.ndarray[np.float64_t, ndim=1] rawOffsets, int M, in
     cdef double currentTimeWindow
     cdef double smallestTimeWindow = rawOffsets[last] - rawOffsets[first]
 
+    # Tracks whether a violation of monotonically increasing time values was
+    # found in the while loop.
+    cdef bint nonMonotonic = False
+
     # If all values are at the same point in time and, having passed the if statement above, there are > 2*M data points,
     # we cannot downsample the file.
     if smallestTimeWindow == 0:
@@ -476,21 +1057,33 @@ def numDownsamplesToBuild(np.ndarray[np.float64_t, ndim=1] rawOffsets, int M, in
         raise Exception('Series violates assumption of monotonically increasing time values (i.e. series should be ordered in time).')
 
     # Determine the smallest time window of 2M data points
-    while last < numDataPoints:
+    with nogil:
+        while last < numDataPoints:
+
+            # Calculate the time window of the current window of 2M data points
+            currentTimeWindow = rawOffsets[last] - rawOffsets[first]
+
+            # Update smallest time window if applicable
+            if currentTimeWindow < smallestTimeWindow and currentTimeWindow > 0:
+                smallestTimeWindow = currentTimeWindow
 
-        # Calculate the time window of the current window of 2M data points
-        currentTimeWindow = rawOffsets[last] - rawOffsets[first]
+            if currentTimeWindow < 0:
+                nonMonotonic = True
+                break
 
-        # Update smallest time window if applicable
-        if currentTimeWindow < smallestTimeWindow and currentTimeWindow > 0:
-            smallestTimeWindow = currentTimeWindow
+            # Increment first & last pointers
+            first = first + 1
+            last = last + 1
+
+    if nonMonotonic:
+        raise Exception('Series violates assumption of monotonically increasing time values (i.e. series should be ordered in time).')
 
-        if currentTimeWindow < 0:
-            raise Exception('Series violates assumption of monotonically increasing time values (i.e. series should be ordered in time).')
+    return numDownsamplesForTimeWindow(timespan, smallestTimeWindow, M, stepMultiplier)
 
-        # Increment first & last pointers
-        first = first + 1
-        last = last + 1
+# Given the timespan of a series and the smallest timespan of any consecutive 2M
+# data points (see numDownsamplesToBuild), returns the number of downsample
+# levels to build.
+def numDownsamplesForTimeWindow(double timespan, double smallestTimeWindow, int M, int stepMultiplier):
 
     # Calculate the time-per-interval for a downsample to represeent the
     # smallest time window in the data set. This will represent the floor
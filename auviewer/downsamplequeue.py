@@ -0,0 +1,221 @@
+"""Persistent queue of downsample jobs, tracked in the database."""
+
+from datetime import datetime
+from pathlib import Path
+import logging
+
+from . import models
+from .scheduler import DownsampleScheduler, PRIORITY_DEFAULT, PRIORITY_REQUESTED
+
+# Job types (see models.DownsampleJob)
+JOB_DOWNSAMPLE = 'DOWNSAMPLE'
+JOB_UPDATE = 'UPDATE'
+
+# Job statuses (see models.DownsampleJob)
+STATUS_QUEUED = 'QUEUED'
+STATUS_RUNNING = 'RUNNING'
+STATUS_COMPLETED = 'COMPLETED'
+STATUS_FAILED = 'FAILED'
+
+# Number of most recent failed jobs reported in the queue status
+NUM_FAILURES_REPORTED = 20
+
+# Number of most recent completed jobs from which the throughput of the queue is
+# estimated for the queue status
+NUM_JOBS_FOR_THROUGHPUT = 50
+
+# Returns the key identifying the downsample job of a project file in the
+# scheduler
+def getJobKey(projFile):
+    return str(projFile.origFilePathObj.resolve())
+
+class DownsampleQueue:
+    """
+    Runs downsample jobs for project files in the background (see DownsampleScheduler), tracking each job and the
+    series it has completed in the database. This allows a job interrupted by a restart to be resumed at the first
+    incomplete series (see getInterruptedJob), and the queue status to be reported (see getStatus).
+    """
+
+    def __init__(self, app, concurrency=None, jobMemoryLimit=None):
+
+        # Flask app, whose context is needed to update jobs from the
+        # scheduler's listener thread
+        self.app = app
+
+        # Maps scheduler keys to the IDs of their jobs in the database
+        self.jobIDs = {}
+
+        self.scheduler = DownsampleScheduler(concurrency=concurrency, jobMemoryLimit=jobMemoryLimit, onEvent=self.handleEvent)
+
+    def submit(self, projFile, type, fn, args, priority=PRIORITY_DEFAULT, job=None, keepSeries=False):
+        """
+        Queues fn(*args) as a job of the given type for the project file. If job is provided (e.g. an interrupted job,
+        see getInterruptedJob), it is requeued rather than a new job being recorded, and its completed series are
+        cleared unless keepSeries is set (i.e. the job resumes after them). If a job for the file is already queued,
+        its priority is raised if necessary instead.
+        """
+
+        key = getJobKey(projFile)
+        if self.scheduler.isScheduled(key):
+            self.prioritize(projFile, priority)
+            return
+
+        if job is None:
+            job = models.DownsampleJob(file_id=projFile.id)
+            models.db.session.add(job)
+        elif not keepSeries:
+            job.series = []
+
+        job.type = type
+        job.status = STATUS_QUEUED
+        job.priority = priority
+        job.size = projFile.origFilePathObj.stat().st_size
+        job.error = None
+        job.started_at = None
+        job.finished_at = None
+        models.db.session.commit()
+
+        self.jobIDs[key] = job.id
+        self.scheduler.submit(key, fn, args, priority)
+
+    def prioritize(self, projFile, priority=PRIORITY_REQUESTED):
+        """
+        Raises the priority of the queued job for the project file, if any.
+        :return: True if a job for the file is queued, False otherwise
+        """
+
+        key = getJobKey(projFile)
+        if not self.scheduler.prioritize(key, priority):
+            return False
+
+        job = models.DownsampleJob.query.get(self.jobIDs[key])
+        if job is not None and priority < job.priority:
+            job.priority = priority
+            models.db.session.commit()
+
+        return True
+
+    def isScheduled(self, projFile):
+        """Returns whether a job for the project file is queued or running."""
+        return self.scheduler.isScheduled(getJobKey(projFile))
+
+    def getInterruptedJob(self, projFile):
+        """
+        Returns the most recent job for the project file which was queued or running when the queue was last stopped
+        (e.g. by a crash), or None if there is none. Should only be called for files not scheduled in this queue.
+        """
+        return models.DownsampleJob.query.filter(
+            models.DownsampleJob.file_id == projFile.id,
+            models.DownsampleJob.status.in_([STATUS_QUEUED, STATUS_RUNNING]),
+        ).order_by(models.DownsampleJob.id.desc()).first()
+
+    def getStatus(self):
+        """
+        Returns the status of the queue as a dict with the number of queued & running jobs, the queued & running jobs
+        themselves (with the fraction of series completed by each running job), the most recent failures, and an
+        estimate of the number of seconds until the queued downsampling completes. The estimate is based on the
+        throughput, in bytes of original file per second, of recently completed downsample jobs, and is None if no
+        jobs have completed yet.
+        """
+
+        active = models.DownsampleJob.query.filter(
+            models.DownsampleJob.status.in_([STATUS_QUEUED, STATUS_RUNNING]),
+            models.DownsampleJob.id.in_(list(self.jobIDs.values())),
+        ).order_by(models.DownsampleJob.priority, models.DownsampleJob.id).all()
+
+        failed = models.DownsampleJob.query.filter_by(status=STATUS_FAILED).order_by(models.DownsampleJob.finished_at.desc()).limit(NUM_FAILURES_REPORTED).all()
+
+        jobs = []
+        remainingBytes = 0
+        for job in active:
+            progress = 0
+            if job.status == STATUS_RUNNING and job.num_series:
+                progress = min(1, len(job.series) / job.num_series)
+            if job.type == JOB_DOWNSAMPLE:
+                remainingBytes += (job.size or 0) * (1 - progress)
+            jobs.append({
+                'id': job.id,
+                'file_id': job.file_id,
+                'project_id': job.file.project_id,
+                'filename': Path(job.file.path).name,
+                'type': job.type,
+                'status': job.status,
+                'priority': job.priority,
+                'progress': progress,
+                'started_at': job.started_at.isoformat() if job.started_at else None,
+            })
+
+        return {
+            'queued': sum(1 for job in active if job.status == STATUS_QUEUED),
+            'running': sum(1 for job in active if job.status == STATUS_RUNNING),
+            'concurrency': self.scheduler.concurrency,
+            'jobs': jobs,
+            'failed': [{
+                'id': job.id,
+                'file_id': job.file_id,
+                'project_id': job.file.project_id,
+                'filename': Path(job.file.path).name,
+                'type': job.type,
+                'error': job.error,
+                'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+            } for job in failed],
+            'eta': self.estimateSeconds(remainingBytes),
+        }
+
+    # Returns an estimate of the number of seconds the queue will take to
+    # downsample remainingBytes of original files, per the throughput of recently
+    # completed downsample jobs, or None if there are none.
+    def estimateSeconds(self, remainingBytes):
+
+        completed = models.DownsampleJob.query.filter(
+            models.DownsampleJob.type == JOB_DOWNSAMPLE,
+            models.DownsampleJob.status == STATUS_COMPLETED,
+            models.DownsampleJob.started_at.isnot(None),
+            models.DownsampleJob.finished_at.isnot(None),
+        ).order_by(models.DownsampleJob.finished_at.desc()).limit(NUM_JOBS_FOR_THROUGHPUT).all()
+
+        totalBytes = sum(job.size or 0 for job in completed)
+        totalSeconds = sum((job.finished_at - job.started_at).total_seconds() for job in completed)
+        if totalBytes == 0 or totalSeconds <= 0:
+            return None
+
+        return remainingBytes / (totalBytes / totalSeconds) / self.scheduler.concurrency
+
+    def shutdown(self, wait=True):
+        """Shuts down the scheduler (see DownsampleScheduler.shutdown)."""
+        self.scheduler.shutdown(wait=wait)
+
+    # Records a job event received from the scheduler (see DownsampleScheduler)
+    def handleEvent(self, key, event, data):
+
+        with self.app.app_context():
+
+            job = models.DownsampleJob.query.get(self.jobIDs.get(key, -1))
+            if job is None:
+                logging.warning(f"Received {event} event for unknown downsample job {key}.")
+                return
+
+            if event == 'started':
+                job.status = STATUS_RUNNING
+                job.started_at = datetime.utcnow()
+
+            elif event == 'series':
+                job.num_series = data['numSeries']
+                completed = {s.series for s in job.series}
+                for seriesID in data['series']:
+                    if seriesID not in completed:
+                        job.series.append(models.DownsampleJobSeries(series=seriesID))
+
+            elif event == 'restarted':
+                job.series = []
+
+            elif event == 'completed':
+                job.status = STATUS_COMPLETED
+                job.finished_at = datetime.utcnow()
+
+            elif event == 'failed':
+                job.status = STATUS_FAILED
+                job.error = data
+                job.finished_at = datetime.utcnow()
+
+            models.db.session.commit()
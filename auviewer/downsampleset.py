@@ -1,9 +1,266 @@
+from concurrent.futures import ThreadPoolExecutor
 import logging
+from math import ceil
+import numpy as np
+import pandas as pd
 import psutil
 import time
 
 from .config import config
-from .cylib import buildDownsampleFromRaw, buildNextDownsampleUp, getSliceParam, numDownsamplesToBuild
+from .layout import appendToDataset, createDataset, getLayout, getTimeBase, readIntervals
+from .rawdata import getColumns
+from .shared import getStatisticsFromAggregates
+from .tilecache import TILE_ROWS, getFileVersion, getTiledRange
+from .timeindex import TIME_INDEX_NAME, TIME_INDEX_STRIDE, TimeIndex, storeTimeIndex
+from .cylib import buildDownsampleFromRawChunk, buildM4Chunk, buildNextDownsampleUpChunk, finishM4ChunkState, finishRawChunkState, finishUpChunkState, largestTriangleThreeBuckets, newM4ChunkState, newRawChunkState, newUpChunkState, numDownsamplesForTimeWindow, numDownsamplesToBuild, rawChunkStartsNewInterval, upChunkStartsNewInterval
+
+# Approximate number of bytes of memory needed per raw data point while
+# downsampling (raw times & values and the HDF5 read buffer), in addition to the
+# worst-case downsample intervals allocated by the downsample kernels.
+BYTES_PER_RAW_DATA_POINT = 40
+
+# Number of columns of downsample intervals, without & with aggregates (see
+# cylib). The first three columns (time offset, min & max) are the ones output
+# for display.
+NUM_COLUMNS = 3
+NUM_COLUMNS_AGGREGATES = 8
+DISPLAY_COLUMNS = ['0', '1', '2']
+
+# Modes in which downsampled series may be output. In 'minmax' mode, the min &
+# max of each downsample interval are output. In 'm4' mode, the points of the M4
+# pyramid are output, and in 'lttb' mode, points of the M4 pyramid selected with
+# the largest-triangle-three-buckets algorithm.
+DOWNSAMPLE_MODES = ['minmax', 'm4', 'lttb']
+
+# Name of the group holding the M4 pyramid of a series, within the group of its
+# downsamples, and the columns of its points (time offset & value).
+M4_GROUP = 'm4'
+M4_COLUMNS = ['0', '1']
+
+# Minimum number of data points (or original intervals) per partition when
+# building a downsample in partitions.
+MIN_PARTITION_LENGTH = 100000
+
+# Number of data points past the nominal partition boundary to search for an
+# interval boundary at which to split.
+PARTITION_SEARCH_LENGTH = 4096
+
+# Minimum point budget for a plot (see getPointBudget).
+MIN_POINT_BUDGET = 100
+
+# Returns whether numDataPoints raw data points of numSeries series sharing the
+# same times can be pulled into memory for downsampling within the configured
+# memory budget.
+def fitsInMemoryBudget(numDataPoints, numSeries=1):
+    return numDataPoints * bytesPerRawDataPoint(numSeries) <= config['downsampleMemoryBudget'] * 1024 * 1024
+
+# Returns the number of raw data points to read per chunk when streaming the raw
+# data of numSeries series sharing the same times, in order to stay within the
+# configured downsample memory budget.
+def getRowsPerChunk(numSeries=1):
+
+    rowsPerChunk = config['downsampleMemoryBudget'] * 1024 * 1024 // bytesPerRawDataPoint(numSeries)
+
+    # A chunk must hold at least a few windows of 2M data points (see
+    # numDownsamplesToBuild) to make progress.
+    return max(rowsPerChunk, 4 * config['M'])
+
+# Returns the approximate number of bytes of memory needed per raw data point
+# while downsampling numSeries series sharing the same times. Each additional
+# series adds its values (in the read buffer and as float64).
+def bytesPerRawDataPoint(numSeries=1):
+    return BYTES_PER_RAW_DATA_POINT + 8 * getNumColumns() + 16 * (numSeries - 1)
+
+# Returns the maximum number of downsample intervals (or points) to output for a
+# plot, per the point budget or else the pixel width of the plot requested by
+# the client (see the intervalsPerPixel config setting), bounded by
+# MIN_POINT_BUDGET and the maxPointBudget config setting. Returns None if
+# neither is provided, in which case about M intervals are output.
+def getPointBudget(points=None, width=None):
+
+    if points is None and width is not None:
+        points = ceil(width * config['intervalsPerPixel'])
+
+    if points is None:
+        return None
+
+    return int(max(MIN_POINT_BUDGET, min(points, config['maxPointBudget'])))
+
+# Returns downsample intervals (as a DataFrame of DISPLAY_COLUMNS) merged in
+# groups of consecutive intervals so that there are no more than maxIntervals,
+# keeping the min & max of each group. Used when even the coarsest downsample
+# exceeds the point budget of a plot.
+def coarsenIntervals(intervals, maxIntervals):
+
+    k = ceil(intervals.shape[0] / maxIntervals)
+    if k <= 1:
+        return intervals
+
+    starts = np.arange(0, intervals.shape[0], k)
+
+    return pd.DataFrame({
+        '0': intervals['0'].values[starts],
+        '1': np.fmin.reduceat(intervals['1'].values, starts),
+        '2': np.fmax.reduceat(intervals['2'].values, starts),
+    }, columns=DISPLAY_COLUMNS)
+
+# Returns points of the M4 pyramid (as a DataFrame of M4_COLUMNS) reduced by M4
+# with coarser buckets so that there are no more than maxPoints. Used when even
+# the coarsest M4 level exceeds the point budget of a plot.
+def coarsenPoints(points, maxPoints):
+
+    if points.shape[0] <= maxPoints:
+        return points
+
+    times, values = points['0'].values, points['1'].values
+    timePerBucket = (times[-1] - times[0]) / max(1, maxPoints // 4 - 1)
+
+    state = newM4ChunkState()
+    coarsened = np.concatenate((buildM4Chunk(times, values, times[0], timePerBucket, state), finishM4ChunkState(state)))
+
+    return pd.DataFrame({'0': coarsened[:, 0], '1': coarsened[:, 1]}, columns=M4_COLUMNS)
+
+# Returns the number of columns of the downsample intervals to build, per the
+# downsampleAggregates config setting.
+def getNumColumns():
+    return NUM_COLUMNS_AGGREGATES if config['downsampleAggregates'] else NUM_COLUMNS
+
+# Returns the number of levels by which the buckets of the M4 pyramid are
+# coarser than the intervals of the downsample of the same index. Since each
+# bucket yields up to 4 points, buckets are made coarser by the smallest power of
+# stepMultiplier of at least 4, so that a view served from the M4 level of the
+# same index as the appropriate downsample has no more than M points.
+def getM4LevelShift():
+    shift = 0
+    while config['stepMultiplier'] ** shift < 4:
+        shift = shift + 1
+    return shift
+
+# Returns a new build of the M4 pyramid with ndtb levels (see
+# DownsampleSet.storeM4Points), with buckets starting at baseOffset, for
+# downsamples with the given time-per-interval by index. If states is provided,
+# the build continues from those kernel states, by index.
+def newM4Build(ndtb, baseOffset, timePerIntervals, states=None):
+    factor = config['stepMultiplier'] ** getM4LevelShift()
+    return {
+        'ndtb': ndtb,
+        'baseOffset': baseOffset,
+        'timePerIntervals': [t * factor for t in timePerIntervals],
+        'timespan': timePerIntervals[0] * config['M'],
+        'states': {i - ndtb: (newM4ChunkState() if states is None else np.array(states[i])) for i in range(ndtb)},
+    }
+
+# Returns the number of partitions to build a downsample from numDataPoints data
+# points (or original intervals) in, per the downsamplePartitions config setting.
+def getNumPartitions(numDataPoints):
+    return max(1, min(config['downsamplePartitions'], numDataPoints // MIN_PARTITION_LENGTH))
+
+# Returns the indices at which to split the given time offsets into up to
+# numPartitions partitions. Each split is placed at the first time offset at or
+# after the nominal split index which falls in a new interval, so that the
+# partition is likely to begin exactly at an interval boundary. Returned indices
+# include 0 and the number of time offsets.
+def getPartitionBoundaries(offsets, baseOffset, timePerInterval, numPartitions):
+
+    numDataPoints = offsets.shape[0]
+
+    boundaries = [0]
+    for p in range(1, numPartitions):
+
+        i = p * numDataPoints // numPartitions
+
+        # Find the first change of interval in the search window
+        intervalIndices = np.floor((offsets[i-1:i+PARTITION_SEARCH_LENGTH] - baseOffset) / timePerInterval)
+        changes = np.nonzero(intervalIndices[1:] > intervalIndices[:-1])[0]
+        if changes.shape[0] > 0:
+            i = i + changes[0]
+
+        if boundaries[-1] < i < numDataPoints:
+            boundaries.append(i)
+
+    boundaries.append(numDataPoints)
+
+    return boundaries
+
+# Builds the same downsample as buildDownsampleFromRaw, but does so in
+# partitions of the raw data which are built concurrently using the executor.
+# Like buildDownsampleFromRawChunk, the last interval is left open, and the
+# completed intervals are returned along with the state holding the open
+# interval (see finishRawChunkState). If aggregates is set, the intervals
+# include aggregates.
+# The raw data is split at interval boundaries (see getPartitionBoundaries), and
+# each partition is built independently from a fresh kernel state. The
+# partitions are then merged in order. Where a partition indeed begins a new
+# interval (see rawChunkStartsNewInterval), the interval left open by the
+# previous partition is completed and the partition's intervals are used as-is.
+# Otherwise, the partition is rebuilt continuing from the previous partition's
+# state. Either way, the result is identical to the sequential build.
+def buildDownsampleFromRawPartitioned(rawOffsets, rawValues, numIntervals, numPartitions, executor, aggregates=False):
+
+    baseOffset = rawOffsets[0]
+    timePerInterval = (rawOffsets[-1] - rawOffsets[0]) / numIntervals
+
+    boundaries = getPartitionBoundaries(rawOffsets, baseOffset, timePerInterval, numPartitions)
+
+    # Builds the partition at index p, returning its intervals and state.
+    def buildPartition(p):
+        offsets = rawOffsets[boundaries[p]:boundaries[p+1]]
+        values = rawValues[boundaries[p]:boundaries[p+1]]
+        state = newRawChunkState(baseOffset, timePerInterval, partition=p > 0, aggregates=aggregates)
+
+        # The partition cannot have more intervals than the intervals it spans
+        maxIntervals = int((offsets[-1] - offsets[0]) / timePerInterval) + 3
+
+        return buildDownsampleFromRawChunk(offsets, values, baseOffset, timePerInterval, state, maxIntervals), state
+
+    partitions = list(executor.map(buildPartition, range(len(boundaries) - 1)))
+
+    # Merge the partitions
+    intervals, state = partitions[0]
+    merged = [intervals]
+    for p in range(1, len(partitions)):
+        offsets = rawOffsets[boundaries[p]:boundaries[p+1]]
+        if rawChunkStartsNewInterval(state, offsets):
+            merged.append(finishRawChunkState(state))
+            intervals, state = partitions[p]
+            merged.append(intervals)
+        else:
+            logging.info(f"Partition {p} does not begin at an interval boundary. Rebuilding it sequentially.")
+            merged.append(buildDownsampleFromRawChunk(offsets, rawValues[boundaries[p]:boundaries[p+1]], baseOffset, timePerInterval, state))
+
+    return np.concatenate(merged), state
+
+# Builds the same downsample as buildNextDownsampleUp, but does so in partitions
+# of the original downsample which are built concurrently using the executor.
+# The last interval is left open in the returned state. See
+# buildDownsampleFromRawPartitioned for details.
+def buildNextDownsampleUpPartitioned(intervalsOrig, timePerIntervalOrig, stepMultiplier, numPartitions, executor):
+
+    baseOffset = intervalsOrig[0,0] - (timePerIntervalOrig / 2)
+
+    boundaries = getPartitionBoundaries(intervalsOrig[:,0], baseOffset, timePerIntervalOrig * stepMultiplier, numPartitions)
+
+    # Builds the partition at index p, returning its intervals and state.
+    def buildPartition(p):
+        state = newUpChunkState(baseOffset if p > 0 else None, aggregates=intervalsOrig.shape[1] >= NUM_COLUMNS_AGGREGATES)
+        return buildNextDownsampleUpChunk(intervalsOrig[boundaries[p]:boundaries[p+1]], timePerIntervalOrig, stepMultiplier, state), state
+
+    partitions = list(executor.map(buildPartition, range(len(boundaries) - 1)))
+
+    # Merge the partitions
+    intervals, state = partitions[0]
+    merged = [intervals]
+    for p in range(1, len(partitions)):
+        chunk = intervalsOrig[boundaries[p]:boundaries[p+1]]
+        if upChunkStartsNewInterval(state, chunk):
+            merged.append(finishUpChunkState(state))
+            intervals, state = partitions[p]
+            merged.append(intervals)
+        else:
+            logging.info(f"Partition {p} does not begin at an interval boundary. Rebuilding it sequentially.")
+            merged.append(buildNextDownsampleUpChunk(chunk, timePerIntervalOrig, stepMultiplier, state))
+
+    return np.concatenate(merged), state
 
 # Represents a set of downsamples for a series of data.
 class DownsampleSet:
@@ -16,6 +273,24 @@ class DownsampleSet:
         # Holds the number of downsamples available for the series
         self._numDownsamples = None
 
+        # Holds the time-per-interval of each downsample available for the
+        # series, as recorded in the processed file (see storeResumeRecord)
+        self._timePerIntervals = None
+
+        # Holds the number of levels of the M4 pyramid available for the series
+        self._numM4Levels = None
+
+        # Holds the time indexes of the downsamples (and levels of the M4
+        # pyramid) of the series, keyed by dataset path (see getTimeIndex)
+        self._timeIndexes = {}
+
+        # Holds the state of a streaming build, if one is in progress
+        self._streaming = None
+
+        # Holds the state of the build of the overview, if one is in progress
+        # (see beginOverview)
+        self._overview = None
+
     @property
     def numDownsamples(self):
         if self._numDownsamples is None:
@@ -30,22 +305,66 @@ class DownsampleSet:
             # Otherwise, we're able to access the processed file, so go ahead and set self._numDownsamples
             self._numDownsamples = self.getNumDownsamplesFromFile()
 
+            record = self.getResumeRecord()
+            self._timePerIntervals = record['timePerInterval'] if record is not None else None
+
         return self._numDownsamples
 
+    @property
+    def numM4Levels(self):
+        if self._numM4Levels is None:
+            if self.numDownsamples < 1:
+                return 0
+            self._numM4Levels = self.getNumDownsamplesFromFile(M4_GROUP)
+        return self._numM4Levels
+
     # Returns the full series output at the highest downsample level, or None
-    # if no downsample exists for the series.
-    def getFullOutput(self):
+    # if no downsample exists for the series. If maxIntervals is provided (see
+    # getPointBudget), the downsample which best meets it for the full timespan
+    # of the series is output instead, or None if raw data meets it.
+    def getFullOutput(self, maxIntervals=None):
 
         if self.numDownsamples < 1:
             return None
 
-        return self.seriesparent.fileparent.pf['/'.join(self.seriesparent.h5pathDownsample) + '/' + '0'][:]
+        dsi = 0
+        if maxIntervals is not None:
+            dsi = self.whichDownsampleIndexForTimespan(self.seriesparent.rd.timespan, maxIntervals)
+            if dsi == -1:
+                return None
+
+        ds = self.seriesparent.fileparent.pf['/'.join(self.seriesparent.h5pathDownsample) + '/' + str(dsi)]
+
+        intervals = readIntervals(ds.hdf, DISPLAY_COLUMNS)
+
+        return coarsenIntervals(intervals, maxIntervals) if maxIntervals is not None else intervals
+
+    # Returns the full series output at the highest downsample level (or per
+    # maxPoints, as with getFullOutput) as points of the M4 pyramid in the given
+    # mode (see getRangedPoints), or None if the series has no M4 pyramid.
+    def getFullPoints(self, mode, maxPoints=None):
+
+        if self.numDownsamples < 1 or self.numM4Levels < self.numDownsamples:
+            return None
+
+        dsi = 0
+        if maxPoints is not None:
+            dsi = self.whichDownsampleIndexForTimespan(self.seriesparent.rd.timespan, maxPoints)
+            if dsi == -1:
+                return None
+
+        return self.readM4Points(dsi, mode, maxPoints=maxPoints)
 
     # Returns the number of downsamples available for this series in the
-    # processed data file.
-    def getNumDownsamplesFromFile(self):
+    # processed data file (or of levels of the M4 pyramid, if group is
+    # M4_GROUP).
+    def getNumDownsamplesFromFile(self, group=None):
 
-        grp = self.seriesparent.fileparent.pf['/'.join(self.seriesparent.h5pathDownsample)]
+        path = '/'.join(self.seriesparent.h5pathDownsample)
+        if group is not None:
+            path = path + '/' + group
+
+        grp = self.seriesparent.fileparent.pf[path]
 
         # If no downsamples are available, return 0
         if grp is None:
@@ -82,8 +401,9 @@ class DownsampleSet:
     # Returns a slice of the appropriate downsample for the given time range, or
     # nothing if there is no appropriate downsample available (in this case, raw
     # data should be used). Expects starttime & stoptime to be time offsets
-    # floats in seconds.
-    def getRangedOutput(self, starttime, stoptime):
+    # floats in seconds. If maxIntervals is provided (see getPointBudget), the
+    # downsample is chosen to meet it rather than M intervals.
+    def getRangedOutput(self, starttime, stoptime, maxIntervals=None):
 
         # If there are no downsamples available, we cannot provide one
         if self.numDownsamples < 1:
@@ -93,7 +413,7 @@ class DownsampleSet:
         timespan = stoptime - starttime
 
         # Get index of the appropriate downsample to use
-        dsi = self.whichDownsampleIndexForTimespan(timespan)
+        dsi = self.whichDownsampleIndexForTimespan(timespan, maxIntervals)
 
         # If we should be using raw data, return nothing
         if dsi == -1:
@@ -102,16 +422,112 @@ class DownsampleSet:
         # Get reference to the downsample dataset in the processed file
         ds = self.seriesparent.fileparent.pf['/'.join(self.seriesparent.h5pathDownsample) + '/' + str(dsi)]
 
-        # Find the start & stop indices based on the start & stop times.
-        startIndex = getSliceParam(ds, '0', 0, starttime)
-        stopIndex = getSliceParam(ds, '0', 1, stoptime)
-
         # Return the downsample slice
-        return ds[startIndex:stopIndex]
+        intervals = self.readTiledRange(ds, DISPLAY_COLUMNS, starttime, stoptime, dsi)
+
+        return coarsenIntervals(intervals, maxIntervals) if maxIntervals is not None else intervals
+
+    # Returns points of the M4 pyramid for the given time range in the given
+    # mode ('m4' or 'lttb', see DOWNSAMPLE_MODES), or nothing if there is no
+    # appropriate downsample or M4 pyramid available (in this case, the
+    # downsample from getRangedOutput or raw data should be used). Expects
+    # starttime & stoptime to be time offsets floats in seconds. If maxPoints is
+    # provided (see getPointBudget), the points are chosen to meet it rather
+    # than M.
+    def getRangedPoints(self, starttime, stoptime, mode, maxPoints=None):
+
+        # If there is no M4 pyramid available, we cannot provide one
+        if self.numDownsamples < 1 or self.numM4Levels < self.numDownsamples:
+            return None
+
+        # Get index of the appropriate downsample to use
+        dsi = self.whichDownsampleIndexForTimespan(stoptime - starttime, maxPoints)
+
+        # If we should be using raw data, return nothing
+        if dsi == -1:
+            return None
+
+        return self.readM4Points(dsi, mode, starttime, stoptime, maxPoints)
+
+    # Returns the points of the M4 pyramid for the downsample at index dsi in
+    # the given mode, within the given time range if provided, as a DataFrame of
+    # time offsets & values. In 'm4' mode, the M4 level of the same index is
+    # used, which yields no more than M (or maxPoints) points (see
+    # getM4LevelShift). In 'lttb' mode, M (or maxPoints) points are selected from
+    # the up to 4M points of the M4 level whose buckets match the intervals of
+    # the downsample.
+    def readM4Points(self, dsi, mode, starttime=None, stoptime=None, maxPoints=None):
+
+        if mode == 'lttb':
+            dsi = min(dsi + getM4LevelShift(), self.numM4Levels - 1)
+
+        ds = self.seriesparent.fileparent.pf['{}/{}/{}'.format('/'.join(self.seriesparent.h5pathDownsample), M4_GROUP, dsi)]
+
+        if starttime is not None:
+            points = self.readTiledRange(ds, M4_COLUMNS, starttime, stoptime, dsi)
+        else:
+            points = readIntervals(ds.hdf, M4_COLUMNS)
+
+        if mode == 'lttb':
+            points = points.iloc[largestTriangleThreeBuckets(points['0'].values, points['1'].values, config['M'] if maxPoints is None else maxPoints)]
+        elif maxPoints is not None:
+            points = coarsenPoints(points, maxPoints)
+
+        return points
+
+    # Returns statistics over the given time range computed from the aggregates
+    # of the appropriate downsample for the range (see
+    # getStatisticsFromAggregates), or None if there is no appropriate
+    # downsample with aggregates available (in this case, raw data should be
+    # used). The intervals whose time offset falls within the range are
+    # included, so the statistics are approximate to within one interval at
+    # either end of the range. Expects starttime & stoptime to be time offsets
+    # floats in seconds.
+    def getRangeStatistics(self, starttime, stoptime):
+
+        # If there are no downsamples available, we cannot provide one
+        if self.numDownsamples < 1:
+            return None
+
+        # Get index of the appropriate downsample to use
+        dsi = self.whichDownsampleIndexForTimespan(stoptime - starttime)
+
+        # If we should be using raw data, return nothing
+        if dsi == -1:
+            return None
+
+        # Get reference to the downsample dataset in the processed file
+        ds = self.seriesparent.fileparent.pf['/'.join(self.seriesparent.h5pathDownsample) + '/' + str(dsi)]
+
+        # Downsamples built without aggregates cannot provide statistics
+        if ds.ncol < NUM_COLUMNS_AGGREGATES:
+            return None
+
+        # Find the start & stop indices based on the start & stop times, which
+        # are stored relative to the base time offset of the downsample.
+        timeBase = getTimeBase(ds.hdf)
+        startIndex, stopIndex = self.getTimeIndex(ds).getSlice(starttime - timeBase, stoptime - timeBase)
+
+        rec = readIntervals(ds.hdf, ['3', '4', '5', '6', '7'], startIndex, stopIndex)
+
+        return getStatisticsFromAggregates(
+            rec['3'].values.sum(),
+            rec['4'].values.sum(),
+            rec['5'].values.sum(),
+            rec['6'].values[0] if rec.shape[0] > 0 else None,
+            rec['7'].values[-1] if rec.shape[0] > 0 else None,
+            stoptime - starttime,
+        )
 
     # Returns the time-per-interval for the downsample at index i.
     def getTimePerIntervalByIndex(self, i, nds=-1):
 
+        # Once the stored downsamples have been extended with appended data
+        # (see processAndStoreAppended), their time-per-interval no longer
+        # follows from the timespan of the series, so use the recorded one.
+        if nds == -1 and self.numDownsamples > 0 and self._timePerIntervals is not None:
+            return self._timePerIntervals[i]
+
         if nds == -1:
             nds = self.numDownsamples
 
@@ -124,8 +540,6 @@ class DownsampleSet:
     # Build all necessary downsamples, and store in the processed file.
     def processAndStore(self):
 
-        p = psutil.Process()
-
         # We assume:
         #   - Datagroup has two non-empty datasets, "datetime" and "value";
         #   - The two datasets are of equal length;
@@ -141,9 +555,52 @@ class DownsampleSet:
         if ndtb < 1:
             return
 
+        # If the downsamples should be built in partitions, create a pool of
+        # threads to build the partitions with.
+        numPartitions = getNumPartitions(len(self.seriesparent.rawTimes))
+        executor = ThreadPoolExecutor(max_workers=numPartitions) if numPartitions > 1 else None
+
+        try:
+            self.buildAndStoreDownsamples(ndtb, executor)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        # Clear self._numDownsamples so that it updates the next time it's accessed
+        self._numDownsamples = None
+        self._numM4Levels = None
+        self._timeIndexes = {}
+
+    # Builds & stores ndtb downsamples from the raw data in memory (see
+    # processAndStore). If an executor is provided, each downsample is built in
+    # partitions using the executor.
+    def buildAndStoreDownsamples(self, ndtb, executor=None):
+
+        p = psutil.Process()
+
+        rawTimes = self.seriesparent.rawTimes
+        rawValues = self.seriesparent.rawValues
+
+        # Holds the time-per-interval of each downsample, by index
+        timePerIntervals = [self.getTimePerIntervalByIndex(i, ndtb) for i in range(ndtb)]
+
+        aggregates = config['downsampleAggregates']
+
+        # Holds the kernel state of each downsample prior to completing its last
+        # intervals, and the number of those intervals (see storeResumeRecord)
+        upStates = {}
+        numProvisional = {}
+
         # Begin by building the last downsample from the raw data first. Then
         # proceed by building the next downsample up from the previously-built
         # downsample until all downsamples have been created.
+        #
+        # Each downsample is built in two parts. First, the intervals which are
+        # complete regardless of any data which may later be appended to the
+        # series, leaving the last interval open in the kernel state. Then, the
+        # provisional intervals, which are completed only because the data ends.
+        # The kernel state between the two is recorded so that the downsamples
+        # may later be extended (see processAndStoreAppended).
         logging.info(f"MEM PRE-DSBLD: {p.memory_full_info().uss / 1024 / 1024} MB")
         for i in range(-1, -ndtb - 1, -1):
 
@@ -153,14 +610,34 @@ class DownsampleSet:
             # Build the downsample
             if i == -1:
                 logging.info("This pass from raw.")
-                downsample = buildDownsampleFromRaw(self.seriesparent.rawTimes, self.seriesparent.rawValues, self.getNumIntervalsByIndex(i, ndtb))
+                numIntervals = self.getNumIntervalsByIndex(i, ndtb)
+                numPartitions = getNumPartitions(len(rawTimes))
+                if executor is not None and numPartitions > 1:
+                    completed, state = buildDownsampleFromRawPartitioned(rawTimes, rawValues, numIntervals, numPartitions, executor, aggregates)
+                else:
+                    timePerInterval = (rawTimes[-1] - rawTimes[0]) / numIntervals
+                    state = newRawChunkState(rawTimes[0], timePerInterval, aggregates=aggregates)
+                    completed = buildDownsampleFromRawChunk(rawTimes, rawValues, rawTimes[0], timePerInterval, state, numIntervals + 1)
+                rawState = state.copy()
+                provisional = finishRawChunkState(state)
             else:
-                downsample = buildNextDownsampleUp(previousDownsample, self.getTimePerIntervalByIndex(i + 1, ndtb), config['stepMultiplier'])
+                numPartitions = getNumPartitions(previousCompleted.shape[0])
+                if executor is not None and numPartitions > 1:
+                    completed, state = buildNextDownsampleUpPartitioned(previousCompleted, timePerIntervals[i + 1], config['stepMultiplier'], numPartitions, executor)
+                else:
+                    state = newUpChunkState(aggregates=aggregates)
+                    completed = buildNextDownsampleUpChunk(previousCompleted, timePerIntervals[i + 1], config['stepMultiplier'], state)
+                upStates[i] = state.copy()
+                provisional = np.concatenate((buildNextDownsampleUpChunk(previousProvisional, timePerIntervals[i + 1], config['stepMultiplier'], state), finishUpChunkState(state)))
+
+            downsample = np.concatenate((completed, provisional))
+            numProvisional[i] = provisional.shape[0]
 
             logging.info(f"MEM AFT-DSBLD: {p.memory_full_info().uss / 1024 / 1024} MB")
 
             # Save the just-computed downsample for use on the next loop iteration
-            previousDownsample = downsample
+            previousCompleted = completed
+            previousProvisional = provisional
 
             logging.info(f"MEM AFT-REPLP: {p.memory_full_info().uss / 1024 / 1024} MB")
 
@@ -174,7 +651,7 @@ class DownsampleSet:
 
                 # Store the downsample
                 dds_name = '{}/{}'.format('/'.join(self.seriesparent.h5pathDownsample), i % ndtb)
-                self.seriesparent.fileparent.pf[dds_name] = downsample
+                createDataset(self.seriesparent.fileparent.pf.hdf, dds_name, downsample, getLayout(), timePerIntervals[i], timePerIntervals[0] * config['M'])
                 logging.info(f"MEM AFT-STRFL: {p.memory_full_info().uss / 1024 / 1024} MB")
 
             except:
@@ -185,15 +662,596 @@ class DownsampleSet:
             end = time.time()
             logging.info(f"Done storing to file. Took {round(end - start, 5)}s.")
 
+        # Build the M4 pyramid, if requested
+        m4States, m4NumProvisional = None, None
+        if config['downsampleVisualPyramid']:
+            logging.info("Creating & storing the M4 pyramid.")
+            start = time.time()
+            m4 = newM4Build(ndtb, rawTimes[0], timePerIntervals)
+            self.storeM4Points(m4, rawTimes, rawValues)
+            m4States, m4NumProvisional = self.finishM4(m4)
+            end = time.time()
+            logging.info(f"Done creating & storing the M4 pyramid. Took {round(end - start, 5)}s.")
+
+        self.storeResumeRecord(ndtb, len(rawTimes), rawTimes[0], rawTimes[-1], timePerIntervals, rawState, upStates, numProvisional, m4States, m4NumProvisional)
+
+        self.storeRawTimeIndex(rawTimes[::TIME_INDEX_STRIDE], len(rawTimes))
+
+    # Build all necessary downsamples in bounded memory, and store in the
+    # processed file. Rather than pulling the raw data into memory, the raw data
+    # is streamed from the original file in chunks sized to the configured
+    # memory budget. Each chunk is fed through the resumable downsample kernels
+    # for all levels at once, and completed intervals are appended to the
+    # processed file as they become available. The resulting downsamples are
+    # identical to those built by processAndStore().
+    def processAndStoreStreaming(self):
+
+        p = psutil.Process()
+
+        rd = self.seriesparent.rd
+
+        if rd.len < 1 or not hasattr(self.seriesparent.fileparent, 'pf'):
+            return
+
+        rowsPerChunk = getRowsPerChunk()
+
+        logging.info(f"Streaming raw data in chunks of {rowsPerChunk} data points.")
+
+        # Make a first pass over the raw times to determine the number of
+        # downsamples to build as well as the first & last time offsets.
+        ndtb, firstOffset, lastOffset = self.numDownsamplesToBuildStreaming(rowsPerChunk)
+
+        # If we do not need to build any downsamples, return now.
+        if ndtb < 1:
+            return
+
+        # Make a second pass over the raw data, building all downsamples.
+        logging.info(f"MEM PRE-DSBLD: {p.memory_full_info().uss / 1024 / 1024} MB")
+        start = time.time()
+        self.beginStreaming(ndtb, firstOffset, lastOffset)
+        for rawTimes, rawValues in rd.getChunks(rowsPerChunk):
+            self.streamChunk(rawTimes, rawValues)
+        self.finishStreaming()
+        logging.info(f"MEM AFT-DSBLD: {p.memory_full_info().uss / 1024 / 1024} MB")
+
+        end = time.time()
+        logging.info(f"Done creating & storing {ndtb} downsamples. Took {round(end - start, 5)}s.")
+
+    # Prepares a streaming build of ndtb downsamples (see
+    # processAndStoreStreaming) for a series spanning firstOffset to lastOffset.
+    # Raw data chunks should then be provided in order with streamChunk(),
+    # followed by a call to finishStreaming().
+    def beginStreaming(self, ndtb, firstOffset, lastOffset):
+
+        # Holds the number of downsamples being built, the base offset & the
+        # time-per-interval of the downsample built from raw data, the
+        # time-per-interval of each downsample by index, the kernel state for
+        # the downsample built from raw data and for each downsample built from
+        # the next downsample down, by index, the number & last time offset of
+        # the raw data points streamed so far, the build of the M4 pyramid, if
+        # requested, and the indexed raw times so far (see storeRawTimeIndex).
+        timePerInterval = (lastOffset - firstOffset) / self.getNumIntervalsByIndex(-1, ndtb)
+        timePerIntervals = [self.getTimePerIntervalByIndex(i, ndtb) for i in range(ndtb)]
+        self._streaming = {
+            'ndtb': ndtb,
+            'baseOffset': firstOffset,
+            'timePerInterval': timePerInterval,
+            'timePerIntervals': timePerIntervals,
+            'rawState': newRawChunkState(firstOffset, timePerInterval, aggregates=config['downsampleAggregates']),
+            'upStates': {i: newUpChunkState(aggregates=config['downsampleAggregates']) for i in range(-2, -ndtb - 1, -1)},
+            'numRows': 0,
+            'lastOffset': firstOffset,
+            'm4': newM4Build(ndtb, firstOffset, timePerIntervals) if config['downsampleVisualPyramid'] else None,
+            'timeIndex': [],
+        }
+
+    # Builds & stores the downsample intervals completed by the next chunk of
+    # raw data in a streaming build.
+    def streamChunk(self, rawTimes, rawValues):
+
+        st = self._streaming
+
+        if rawTimes.shape[0] < 1:
+            return
+
+        intervals = buildDownsampleFromRawChunk(rawTimes, rawValues, st['baseOffset'], st['timePerInterval'], st['rawState'])
+        self.storeStreamedIntervals(intervals)
+
+        if st['m4'] is not None:
+            self.storeM4Points(st['m4'], rawTimes, rawValues)
+
+        if st['timeIndex'] is not None:
+            st['timeIndex'].append(rawTimes[-st['numRows'] % TIME_INDEX_STRIDE::TIME_INDEX_STRIDE])
+
+        st['numRows'] = st['numRows'] + rawTimes.shape[0]
+        st['lastOffset'] = rawTimes[-1]
+
+    # Completes & stores the remaining downsample intervals of a streaming build.
+    def finishStreaming(self):
+
+        st = self._streaming
+        ndtb = st['ndtb']
+
+        # Record the kernel states before the open intervals are completed, as
+        # well as the number of intervals completed as a result (see
+        # storeResumeRecord).
+        rawState = st['rawState'].copy()
+        upStates = {i: state.copy() for i, state in st['upStates'].items()}
+        storedLengths = {i: self.getStoredDownsampleLength(i % ndtb) for i in range(-1, -ndtb - 1, -1)}
+
+        self.storeStreamedIntervals(finishRawChunkState(st['rawState']), finish=True)
+
+        numProvisional = {i: self.getStoredDownsampleLength(i % ndtb) - storedLengths[i] for i in storedLengths}
+
+        m4States, m4NumProvisional = None, None
+        if st['m4'] is not None:
+            m4States, m4NumProvisional = self.finishM4(st['m4'])
+
+        self.storeResumeRecord(ndtb, st['numRows'], st['baseOffset'], st['lastOffset'], st['timePerIntervals'], rawState, upStates, numProvisional, m4States, m4NumProvisional)
+
+        if st['timeIndex'] is not None:
+            self.storeRawTimeIndex(np.concatenate(st['timeIndex']), st['numRows'])
+
+        self._streaming = None
+
         # Clear self._numDownsamples so that it updates the next time it's accessed
         self._numDownsamples = None
+        self._numM4Levels = None
+        self._timeIndexes = {}
+
+    # Returns the number of the coarsest downsample levels to build for the
+    # overview of the series (see File.processOverview), per the
+    # downsampleOverviewLevels config setting. As with a full build, no level is
+    # built for a series of no more than 2M data points, which is served raw, and
+    # neither is a level of more intervals than half the data points.
+    def getNumOverviewLevels(self):
+        n = 0
+        while n < config['downsampleOverviewLevels'] and 2 * self.getNumIntervalsByIndex(n) < self.seriesparent.rd.len:
+            n = n + 1
+        return n
+
+    # Prepares the build of the overview of the series (see
+    # getNumOverviewLevels) for raw data beginning at firstOffset. Raw data
+    # chunks should then be provided in order with overviewChunk(), followed by
+    # a call to finishOverview(). The overview levels have the same
+    # time-per-interval as the downsamples of the same index in a full build.
+    def beginOverview(self, firstOffset):
+
+        # Holds the number of levels being built, the base offset & the
+        # time-per-interval of each level by index, the kernel state of the
+        # finest level, which is built from raw data, and its intervals
+        # completed so far, and the number of raw data points streamed so far
+        # along with their indexed times (see storeRawTimeIndex).
+        numLevels = self.getNumOverviewLevels()
+        timePerIntervals = [self.getTimePerIntervalByIndex(i, numLevels) for i in range(numLevels)]
+        self._overview = {
+            'numLevels': numLevels,
+            'baseOffset': firstOffset,
+            'timePerIntervals': timePerIntervals,
+            'rawState': newRawChunkState(firstOffset, timePerIntervals[-1], aggregates=config['downsampleAggregates']) if numLevels > 0 else None,
+            'intervals': [],
+            'numRows': 0,
+            'timeIndex': [],
+        }
+
+    # Builds the intervals of the finest overview level completed by the next
+    # chunk of raw data in the build of the overview.
+    def overviewChunk(self, rawTimes, rawValues):
+
+        ov = self._overview
+
+        if rawTimes.shape[0] < 1:
+            return
+
+        if ov['numLevels'] > 0:
+            ov['intervals'].append(buildDownsampleFromRawChunk(rawTimes, rawValues, ov['baseOffset'], ov['timePerIntervals'][-1], ov['rawState']))
+
+        ov['timeIndex'].append(rawTimes[-ov['numRows'] % TIME_INDEX_STRIDE::TIME_INDEX_STRIDE])
+        ov['numRows'] = ov['numRows'] + rawTimes.shape[0]
+
+    # Completes the build of the overview, storing its levels along with the
+    # time index of the raw data to the given HDF5 file (the overview file of
+    # the file being processed). The coarser levels are built from the finest
+    # one, and the levels are stored from the coarsest down.
+    def finishOverview(self, hdf):
+
+        ov = self._overview
+        path = '/'.join(self.seriesparent.h5pathDownsample)
+        timePerIntervals = ov['timePerIntervals']
+
+        levels = []
+        if ov['numLevels'] > 0:
+            intervals = np.concatenate(ov['intervals'] + [finishRawChunkState(ov['rawState'])])
+            levels.append(intervals)
+            for i in range(ov['numLevels'] - 1, 0, -1):
+                state = newUpChunkState(aggregates=config['downsampleAggregates'])
+                intervals = np.concatenate((buildNextDownsampleUpChunk(intervals, timePerIntervals[i], config['stepMultiplier'], state), finishUpChunkState(state)))
+                levels.append(intervals)
+
+        for i, intervals in enumerate(reversed(levels)):
+            createDataset(hdf, f'{path}/{i}', intervals, getLayout(), timePerIntervals[i], timePerIntervals[0] * config['M'])
+
+        if ov['numRows'] > 0:
+            storeTimeIndex(hdf, path + '/' + TIME_INDEX_NAME, np.concatenate(ov['timeIndex']), ov['numRows'])
+
+        self._overview = None
+
+    # Returns whether the raw data for the series can be pulled into memory for
+    # downsampling within the configured memory budget.
+    def rawDataFitsInMemoryBudget(self):
+        return fitsInMemoryBudget(self.seriesparent.rd.len)
+
+    # Streaming equivalent of the numDownsamplesToBuild kernel, which reads the
+    # raw times in chunks. Returns a tuple of the number of downsamples to
+    # build, the first time offset and the last time offset of the series.
+    def numDownsamplesToBuildStreaming(self, rowsPerChunk):
+
+        rd = self.seriesparent.rd
+
+        # Number of data points spanned by each sliding window of 2M points
+        windowLength = 2 * config['M'] - 1
+
+        # Holds the tail of the previous chunk, which forms the beginning of the
+        # windows straddling the chunk boundary.
+        tail = None
+
+        firstOffset = None
+        smallestTimeWindow = None
+
+        for rawTimes in rd.getChunks(rowsPerChunk, timesOnly=True):
+
+            if firstOffset is None:
+                firstOffset = rawTimes[0]
+
+            if tail is not None:
+                rawTimes = np.concatenate((tail, rawTimes))
+
+            if rawTimes.shape[0] > windowLength:
+
+                timeWindows = rawTimes[windowLength:] - rawTimes[:-windowLength]
+
+                # Prime the smallest time window with the first window
+                if smallestTimeWindow is None:
+                    smallestTimeWindow = timeWindows[0]
+                    if smallestTimeWindow == 0:
+                        raise Exception('All values are at the same point in time. Cannot downsample.')
+
+                if (timeWindows < 0).any():
+                    raise Exception('Series violates assumption of monotonically increasing time values (i.e. series should be ordered in time).')
+
+                positiveTimeWindows = timeWindows[timeWindows > 0]
+                if positiveTimeWindows.shape[0] > 0:
+                    smallestTimeWindow = min(smallestTimeWindow, positiveTimeWindows.min())
+
+            tail = rawTimes[-windowLength:]
+
+        lastOffset = tail[-1]
+
+        # If we have fewer than or equal to 2M data points, no downsamples need
+        # to be built.
+        if rd.len <= 2 * config['M']:
+            return 0, firstOffset, lastOffset
+
+        return numDownsamplesForTimeWindow(lastOffset - firstOffset, smallestTimeWindow, config['M'], config['stepMultiplier']), firstOffset, lastOffset
+
+    # Appends the given intervals, which were just completed for the finest
+    # downsample by the streaming build, to the processed file. The intervals
+    # are then fed to the build of the next downsample up, and so forth through
+    # all downsamples. If finish is set, the intervals left open by the build of
+    # each downsample are completed and stored as well.
+    def storeStreamedIntervals(self, intervals, finish=False):
+
+        st = self._streaming
+        ndtb = st['ndtb']
+        upStates = st['upStates']
+
+        for i in range(-1, -ndtb - 1, -1):
+
+            # Store the intervals completed for this downsample
+            self.appendToStoredDownsample(i % ndtb, intervals)
+
+            # Having reached the coarsest downsample, we're done.
+            if i == -ndtb:
+                break
+
+            # Build the intervals for the next downsample up
+            nextIntervals = buildNextDownsampleUpChunk(intervals, st['timePerIntervals'][i], config['stepMultiplier'], upStates[i - 1])
+            if finish:
+                nextIntervals = np.concatenate((nextIntervals, finishUpChunkState(upStates[i - 1])))
+            intervals = nextIntervals
+
+    # Appends downsample intervals to the downsample at index i in the processed
+    # file during a streaming build, creating the downsample dataset if
+    # necessary.
+    def appendToStoredDownsample(self, i, intervals):
+
+        if intervals.shape[0] < 1:
+            return
+
+        dds_name = '{}/{}'.format('/'.join(self.seriesparent.h5pathDownsample), i)
+
+        try:
+            pf = self.seriesparent.fileparent.pf
+            if dds_name in pf:
+                appendToDataset(pf[dds_name].hdf, intervals)
+            else:
+                timePerIntervals = self._streaming['timePerIntervals']
+                createDataset(pf.hdf, dds_name, intervals, getLayout(), timePerIntervals[i], timePerIntervals[0] * config['M'])
+        except:
+            logging.info(f"There was an exception while appending to the dataset in the processed data file at the path: {dds_name}.")
+            raise
+
+    # Builds the M4 points for the given data points, which follow any data
+    # points previously provided to the M4 build (see newM4Build), and stores
+    # them to the M4 pyramid in the processed file. The points built for each
+    # level are fed to the build of the next level up. If finish is set, the
+    # buckets left open by the build of each level are completed and stored as
+    # well.
+    def storeM4Points(self, m4, times, values, finish=False):
+
+        ndtb = m4['ndtb']
+
+        for i in range(-1, -ndtb - 1, -1):
+
+            points = buildM4Chunk(times, values, m4['baseOffset'], m4['timePerIntervals'][i], m4['states'][i])
+            if finish:
+                points = np.concatenate((points, finishM4ChunkState(m4['states'][i])))
+
+            self.appendToStoredM4(m4, i % ndtb, points)
+
+            times, values = points[:, 0], points[:, 1]
+
+    # Completes the M4 build, returning the kernel state of each level prior to
+    # completing its open bucket and the number of points completed as a
+    # result, by negative index (see storeResumeRecord).
+    def finishM4(self, m4):
+
+        ndtb = m4['ndtb']
+
+        states = {i: state.copy() for i, state in m4['states'].items()}
+        storedLengths = {i: self.getStoredDownsampleLength(i % ndtb, M4_GROUP) for i in states}
+
+        self.storeM4Points(m4, np.zeros(0), np.zeros(0), finish=True)
+
+        numProvisional = {i: self.getStoredDownsampleLength(i % ndtb, M4_GROUP) - storedLengths[i] for i in states}
+
+        return states, numProvisional
+
+    # Appends M4 points to the level at index i of the M4 pyramid in the
+    # processed file, creating the level's dataset if necessary.
+    def appendToStoredM4(self, m4, i, points):
+
+        if points.shape[0] < 1:
+            return
+
+        dds_name = '{}/{}/{}'.format('/'.join(self.seriesparent.h5pathDownsample), M4_GROUP, i)
+
+        try:
+            pf = self.seriesparent.fileparent.pf
+            if dds_name in pf:
+                appendToDataset(pf[dds_name].hdf, points)
+            else:
+                createDataset(pf.hdf, dds_name, points, getLayout(), m4['timePerIntervals'][i], m4['timespan'])
+        except:
+            logging.info(f"There was an exception while appending to the dataset in the processed data file at the path: {dds_name}.")
+            raise
+
+    # Reads the given columns of the rows of the downsample (or level of the M4
+    # pyramid) at index dsi, stored in the given audata dataset, with times
+    # within starttime and stoptime, as a DataFrame (see readIntervals). The
+    # rows are read through the tile cache, in tiles of TILE_ROWS intervals of
+    # the downsample at index dsi (see getTiledRange).
+    def readTiledRange(self, ds, columns, starttime, stoptime, dsi):
+
+        # Find the rows of a tile based on its start & stop times, which are
+        # stored relative to the base time offset of the downsample.
+        index = self.getTimeIndex(ds)
+        timeBase = getTimeBase(ds.hdf)
+        def loadRange(a, b):
+            return readIntervals(ds.hdf, columns, index.searchsorted(a - timeBase), index.searchsorted(b - timeBase)).values
+
+        # Tiles are keyed by the file holding the downsample, and its version,
+        # as the same downsample may be read from the overview of the file (see
+        # File.pf) and the processed file may be rebuilt.
+        filename = ds.hdf.file.filename
+        key = (filename, getFileVersion(filename), ds.hdf.name, ds.hdf.shape[0], tuple(columns))
+        rows = getTiledRange(key, TILE_ROWS * self.getTimePerIntervalByIndex(dsi), starttime, stoptime, loadRange)
+
+        return pd.DataFrame(rows, columns=columns)
+
+    # Returns the time index (see TimeIndex) of the downsample (or level of the
+    # M4 pyramid) stored in the given audata dataset, which is built when first
+    # needed and kept in memory.
+    def getTimeIndex(self, ds):
+        index = self._timeIndexes.get(ds.hdf.name)
+        if index is None or not index.isCurrent():
+            index = TimeIndex(ds.hdf, '0')
+            self._timeIndexes[ds.hdf.name] = index
+        return index
+
+    # Stores the time index of the raw data of the series (every
+    # TIME_INDEX_STRIDE-th raw time offset, of numRows raw data points) to the
+    # processed file, so that it need not be built when the series is served
+    # (see RawData.getTimeIndex).
+    def storeRawTimeIndex(self, times, numRows):
+        storeTimeIndex(self.seriesparent.fileparent.pf.hdf, '/'.join(self.seriesparent.h5pathDownsample) + '/' + TIME_INDEX_NAME, times, numRows)
+
+    # Returns the number of intervals stored for the downsample at index i in
+    # the processed file (or of points stored for the level at index i of the
+    # M4 pyramid, if group is M4_GROUP).
+    def getStoredDownsampleLength(self, i, group=None):
+        path = '/'.join(self.seriesparent.h5pathDownsample)
+        if group is not None:
+            path = path + '/' + group
+        ds = self.seriesparent.fileparent.pf['{}/{}'.format(path, i)]
+        return ds.nrow if ds is not None else 0
+
+    # Deletes all downsamples stored for the series in the processed file.
+    def deleteStored(self):
+
+        pf = self.seriesparent.fileparent.pf
+        path = '/'.join(self.seriesparent.h5pathDownsample)
+        if path in pf:
+            del pf[path]
+
+        self.clearCache()
+
+    # Clears what is cached from the processed file about the downsamples of the
+    # series, so that it is read again the next time it's accessed (e.g. once
+    # the overview of the file is replaced by its processed file, see File.pf).
+    def clearCache(self):
+        self._numDownsamples = None
+        self._numM4Levels = None
+        self._timeIndexes = {}
+        self._timePerIntervals = None
+
+    # Returns the resume record stored with the downsamples of the series (see
+    # storeResumeRecord), or None if there is none (e.g. the processed file was
+    # created by an earlier version).
+    def getResumeRecord(self):
+        grp = self.seriesparent.fileparent.pf['/'.join(self.seriesparent.h5pathDownsample)]
+        if grp is None:
+            return None
+        return grp.meta.get('resume')
+
+    # Stores the resume record for the ndtb downsamples just built from numRows
+    # raw data points spanning baseOffset to lastOffset. The record allows the
+    # downsamples to be extended with data appended to the series later on,
+    # exactly as if they had been built from all of the data at once (see
+    # processAndStoreAppended). Since the last intervals of each downsample are
+    # completed only because the data ends, the record holds the kernel state of
+    # each downsample prior to completing them (rawState for the downsample
+    # built from raw data, and upStates for the rest, by negative index), the
+    # number of such provisional intervals of each downsample (numProvisional,
+    # by negative index), the time-per-interval of each downsample, and whether
+    # the downsamples include aggregates. If the M4 pyramid was built, the
+    # record likewise holds the kernel state (m4States) & number of provisional
+    # points (m4NumProvisional) of each of its levels, by negative index.
+    def storeResumeRecord(self, ndtb, numRows, baseOffset, lastOffset, timePerIntervals, rawState, upStates, numProvisional, m4States=None, m4NumProvisional=None):
+
+        grp = self.seriesparent.fileparent.pf['/'.join(self.seriesparent.h5pathDownsample)]
+
+        meta = grp.meta
+        meta['resume'] = {
+            'numRows': int(numRows),
+            'baseOffset': float(baseOffset),
+            'lastOffset': float(lastOffset),
+            'timePerInterval': [float(t) for t in timePerIntervals],
+            'rawState': [float(v) for v in rawState],
+            'upStates': [[float(v) for v in upStates[i - ndtb]] for i in range(ndtb - 1)],
+            'numProvisional': [int(numProvisional[i - ndtb]) for i in range(ndtb)],
+            'aggregates': bool(config['downsampleAggregates']),
+            'm4': m4States is not None,
+        }
+        if m4States is not None:
+            meta['resume']['m4States'] = [[float(v) for v in m4States[i - ndtb]] for i in range(ndtb)]
+            meta['resume']['m4NumProvisional'] = [int(m4NumProvisional[i - ndtb]) for i in range(ndtb)]
+        grp.meta = meta
+
+    # Extends the stored downsamples with any raw data appended to the series
+    # since they were built, rather than rebuilding them from scratch. Using the
+    # resume record (see storeResumeRecord), the provisional intervals of each
+    # downsample are discarded and the kernel states are restored, after which
+    # only the appended raw data is streamed through the kernels. The result is
+    # identical to building the downsamples from all of the data at once with
+    # the recorded time-per-interval of each downsample. Returns whether the
+    # downsamples are up to date. If False is returned, the downsamples cannot
+    # be extended and should be rebuilt instead.
+    def processAndStoreAppended(self):
+
+        rd = self.seriesparent.rd
+
+        record = self.getResumeRecord()
+        if record is None:
+            logging.info(f"No resume record is available for the series {self.seriesparent.id}.")
+            return False
+
+        # The downsamples must be extended in the format they were built in.
+        # Records without this setting predate aggregates and hold states of a
+        # different layout.
+        if record.get('aggregates') != config['downsampleAggregates'] or record.get('m4', False) != config['downsampleVisualPyramid']:
+            logging.info(f"The downsamples for the series {self.seriesparent.id} were built in a different format.")
+            return False
+
+        numRows = record['numRows']
+
+        if rd.len == numRows:
+            logging.info(f"No data has been appended to the series {self.seriesparent.id}.")
+            return True
+
+        if rd.len < numRows:
+            logging.info(f"The series {self.seriesparent.id} has fewer data points than it was downsampled from.")
+            return False
+
+        # The appended data must follow the existing data in time
+        ds = rd.getDatasetReference()
+        timecol = self.seriesparent.timecol
+        firstAppendedOffset = getColumns(ds, [timecol], numRows, numRows + 1)[timecol][0]
+        lastOffset = getColumns(ds, [timecol], rd.len - 1)[timecol][0]
+        if firstAppendedOffset < record['lastOffset']:
+            logging.info(f"The data appended to the series {self.seriesparent.id} does not follow the existing data in time.")
+            return False
+
+        # Once the series spans more than the coarsest downsample can represent
+        # within stepMultiplier * M intervals, another level is warranted, so the
+        # downsamples are rebuilt. As the timespan grows geometrically between
+        # rebuilds, the cost of rebuilding is amortized over the appended data.
+        timePerIntervals = record['timePerInterval']
+        if lastOffset - record['baseOffset'] > timePerIntervals[0] * config['M'] * config['stepMultiplier']:
+            logging.info(f"The series {self.seriesparent.id} has outgrown its downsamples.")
+            return False
+
+        logging.info(f"Extending the downsamples for the series {self.seriesparent.id} with {rd.len - numRows} appended data points.")
+        start = time.time()
+
+        ndtb = len(timePerIntervals)
+
+        # Discard the provisional intervals of each downsample (and points of
+        # each level of the M4 pyramid)
+        for i in range(ndtb):
+            if record['numProvisional'][i] > 0:
+                dds = self.seriesparent.fileparent.pf['{}/{}'.format('/'.join(self.seriesparent.h5pathDownsample), i)]
+                dds.hdf.resize((dds.nrow - record['numProvisional'][i],))
+            if record['m4'] and record['m4NumProvisional'][i] > 0:
+                dds = self.seriesparent.fileparent.pf['{}/{}/{}'.format('/'.join(self.seriesparent.h5pathDownsample), M4_GROUP, i)]
+                dds.hdf.resize((dds.nrow - record['m4NumProvisional'][i],))
+
+        # The stored time index of the raw data is extended as well, if it is
+        # up to date
+        timeIndex = self.seriesparent.fileparent.pf.hdf.get('/'.join(self.seriesparent.h5pathDownsample) + '/' + TIME_INDEX_NAME)
+        timeIndex = [timeIndex[()]] if timeIndex is not None and timeIndex.attrs.get('stride') == TIME_INDEX_STRIDE and timeIndex.attrs.get('nrow') == numRows else None
+
+        # Restore the streaming build as it was before the provisional intervals
+        # were completed, and stream the appended data through it.
+        self._streaming = {
+            'ndtb': ndtb,
+            'baseOffset': record['baseOffset'],
+            'timePerInterval': timePerIntervals[-1],
+            'timePerIntervals': timePerIntervals,
+            'rawState': np.array(record['rawState']),
+            'upStates': {i - ndtb: np.array(state) for i, state in enumerate(record['upStates'])},
+            'numRows': numRows,
+            'lastOffset': record['lastOffset'],
+            'm4': newM4Build(ndtb, record['baseOffset'], timePerIntervals, record['m4States']) if record['m4'] else None,
+            'timeIndex': timeIndex,
+        }
+        for rawTimes, rawValues in rd.getChunks(getRowsPerChunk(), start=numRows):
+            self.streamChunk(rawTimes, rawValues)
+        self.finishStreaming()
+
+        end = time.time()
+        logging.info(f"Done extending the downsamples for the series {self.seriesparent.id}. Took {round(end - start, 5)}s.")
+
+        return True
 
     # Returns the index of the appropriate downsample which should be used for
-    # the given timespan, or -1 if raw data should be used instead.
-    def whichDownsampleIndexForTimespan(self, timespan):
+    # the given timespan, delivering no more than M (or maxIntervals) intervals,
+    # or -1 if raw data should be used instead.
+    def whichDownsampleIndexForTimespan(self, timespan, maxIntervals=None):
 
-        # Calculate the largest interval size to deliver <= M intervals, in seconds
-        maxTimePerInterval = timespan / config['M']
+        # Calculate the largest interval size to deliver <= M (or maxIntervals)
+        # intervals, in seconds
+        maxTimePerInterval = timespan / (config['M'] if maxIntervals is None else maxIntervals)
 
         # Determine which downsample to use. To do this, find the first
         # downsample, going from the largest interval downwards, which is too
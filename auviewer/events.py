@@ -0,0 +1,82 @@
+"""Extraction of event series (e.g. medications & clinical events) from original files."""
+
+import numpy as np
+import pandas as pd
+
+# Event series of a file, as (name, dataset path, time column)
+EVENT_TABLES = [
+    ('meds', 'ehr/medications', 'time'),
+    ('ce', 'low_rate', 'date'),
+]
+
+class EventSeries:
+    """
+    Holds an event series of a file as columns: the time of each event, and its text, which consists of the non-empty
+    values of the event's other columns, one per line. Events are kept in the order of their table.
+    """
+
+    def __init__(self, times, texts):
+
+        # Times of the events as float64, and their texts as an object array
+        self.times = times
+        self.texts = texts
+
+    @classmethod
+    def fromDataFrame(cls, df, timecol):
+        """
+        Returns the event series of an event table, read as a DataFrame (e.g. through audata). The texts are assembled
+        a column at a time rather than per row, with each distinct value of a column converted to a string only once.
+        Byte strings are decoded as UTF-8, and missing & empty values are omitted.
+        """
+
+        texts = np.full(df.shape[0], '', dtype=object)
+
+        for c in df.columns:
+
+            if c == timecol:
+                continue
+
+            # Codes of the values of the column, with -1 for missing values,
+            # and the distinct values as strings prefixed with the line
+            # separator (which is then dropped from the beginning of each
+            # text), or as empty strings if empty, followed by an empty string
+            # for missing values
+            codes, uniques = pd.factorize(df[c])
+            strings = [u.decode('utf-8', 'replace') if isinstance(u, bytes) else str(u) for u in uniques]
+            pieces = np.array([f'\n{u}' if u != '' else '' for u in strings] + [''], dtype=object)
+
+            texts = texts + pieces[codes]
+
+        return cls(df[timecol].to_numpy(dtype=np.float64), np.array([t[1:] for t in texts.tolist()], dtype=object))
+
+    def getOutput(self, starttime=None, stoptime=None):
+        """
+        Returns the events as JSON-ready rows of (time, text), limited to those within starttime to stoptime (inclusive)
+        if provided.
+        """
+
+        times = self.times
+        texts = self.texts
+
+        if starttime is not None or stoptime is not None:
+            include = np.ones(times.shape[0], dtype=bool)
+            if starttime is not None:
+                include &= times >= starttime
+            if stoptime is not None:
+                include &= times <= stoptime
+            times = times[include]
+            texts = texts[include]
+
+        return list(zip(times.tolist(), texts.tolist()))
+
+    def getSummary(self):
+        """
+        Returns the number of events and the times of the earliest & latest of them (or None if there are none) as a
+        dict, which the initial payload of a file holds in place of the events (see File.getEventSummaries).
+        """
+        n = self.times.shape[0]
+        return {
+            'count': n,
+            'start': float(np.nanmin(self.times)) if n > 0 else None,
+            'stop': float(np.nanmax(self.times)) if n > 0 else None,
+        }
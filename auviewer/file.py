@@ -1,6 +1,10 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 from sqlalchemy import distinct, or_
+from sqlalchemy.orm import lazyload
 import logging
+import os
+import shutil
 import time
 import traceback
 import pandas as pd
@@ -8,8 +12,14 @@ import pandas as pd
 import audata
 
 from . import models
+from .coalesce import rangedOutputFlights
+from .config import config
 from .cylib import generateThresholdAlerts
-from .series import Series, simpleSeriesName
+from .events import EVENT_TABLES, EventSeries
+from .layout import getLayout
+from .payloadcache import deleteBlobs, encodeRawJSON, getBlobPathObj, getPointBudgetBucket, readBlob, sharedPayloadCache, writeBlob
+from .rawdata import readRangedData
+from .series import Series, columnsToRows, processAndStoreOverviewGroup, processAndStoreSeriesGroup, simpleSeriesName
 from .shared import annotationOrPatternOutput
 
 class File:
@@ -35,6 +45,13 @@ class File:
         self._file = None
         self._processed_file = None
 
+        # Holds the modification time of the overview of the file, if it is
+        # open in place of the processed file (see pf)
+        self._overviewMTime = None
+
+        # Holds the event series of the file once read (see getEventSeries)
+        self._events = None
+
         # Filename
         self.name = Path(self.origFilePathObj).name
 
@@ -44,9 +61,8 @@ class File:
     @property
     def f(self):       
         if self._file is None:
-            # Open the original file only if the donwsampled version exists
-            # TODO(vedant) : does this behavior need to be changed? since current multiprocessing does not support prioritization,
-            # users may have to wait for a while to view their files
+            # Open the original file on first access, whether or not it has
+            # been downsampled yet
             self._file = audata.File.open(str(self.origFilePathObj), return_datetimes=False)
 
             # Load series data into memory
@@ -56,22 +72,60 @@ class File:
 
     @property
     def pf(self):
+
+        # While the file is being downsampled, its overview is open in place of
+        # the processed file (see isProgressive). The overview is reopened when
+        # it is republished, and gives way to the processed file once complete.
+        if self._overviewMTime is not None and (not Path(str(self.procFilePathObj)+'.tmp').exists() or getMTime(self.getOverviewFilePathObj()) != self._overviewMTime):
+            self.releaseOverview()
+
         if self._processed_file is None:
             if not self.procFilePathObj.exists():
                 # TODO(vedant/gus) : inform the front end instead of backend about the file being downsampled
                 raise IOError("Please wait, file being downsampled")
 
             else:
-                logging.info(f"Opening processed file {self.procFilePathObj}.")
                 tmp_file = Path(str(self.procFilePathObj)+'.tmp')
                 if tmp_file.exists():
-                    raise RuntimeError("Temp file for corresponding processed file does not exist. This indicates that the file is currently in the process of being downsampled, or the downsampled file is corrupted")
 
-                # Loads the processed file if no issues are detected
-                self._processed_file = audata.File.open(str(self.procFilePathObj), return_datetimes=False)
+                    # Serve the overview of the file, if published, while it is being downsampled
+                    overviewMTime = getMTime(self.getOverviewFilePathObj())
+                    if overviewMTime is None:
+                        raise RuntimeError("Temp file for corresponding processed file does not exist. This indicates that the file is currently in the process of being downsampled, or the downsampled file is corrupted")
+
+                    logging.info(f"Opening overview file {self.getOverviewFilePathObj()}.")
+                    self._processed_file = audata.File.open(str(self.getOverviewFilePathObj()), return_datetimes=False)
+                    self._overviewMTime = overviewMTime
+
+                else:
+
+                    # Loads the processed file if no issues are detected
+                    logging.info(f"Opening processed file {self.procFilePathObj}.")
+                    self._processed_file = audata.File.open(str(self.procFilePathObj), return_datetimes=False)
 
         return self._processed_file
 
+    def getOverviewFilePathObj(self):
+        """Returns the path of the overview of the file, published while it is being downsampled (see processOverview)."""
+        return Path(str(self.procFilePathObj)+'.overview')
+
+    # Drops the overview open in place of the processed file (see pf), along
+    # with what the series have cached from it. The overview is not closed, as
+    # other threads may still be reading from it, but once no longer
+    # referenced.
+    def releaseOverview(self):
+        logging.info(f"Releasing overview file {self.getOverviewFilePathObj()}.")
+        self._processed_file = None
+        self._overviewMTime = None
+        for s in self.series:
+            s.dss.clearCache()
+
+    def deleteOverview(self):
+        """Deletes the overview of the file (see processOverview), if any, along with any partially written one."""
+        overviewFilePathObj = self.getOverviewFilePathObj()
+        for p in [overviewFilePathObj, Path(str(overviewFilePathObj)+'.tmp'), Path(str(overviewFilePathObj)+'.copy')]:
+            p.unlink(missing_ok=True)
+
     def close(self):
         """ Use this for closing original and processed .h5 without removing File object from memory"""
 
@@ -90,6 +144,8 @@ class File:
             pass
 
         self._file, self._processed_file = None, None
+        self._overviewMTime = None
+        self._events = None
 
     def __del__(self):
         self.close()
@@ -286,116 +342,217 @@ class File:
         # Having reached this point, we were unable to generate the alerts.
         return []
 
-    def getEvents(self):
-        """Returns all event series"""
+    def getEvents(self, starttime=None, stoptime=None):
+        """
+        Returns all event series as JSON-ready rows of (time, text), limited to the events within starttime to stoptime
+        if provided. The event series are read from the original file once, then kept for as long as the file is open
+        (see getEventSeries).
+        """
 
-        logging.info(f"Assembling all event series for file {self.origFilePathObj}.")
-        start = time.time()
+        return {name: es.getOutput(starttime, stoptime) for name, es in self.getEventSeries().items()}
 
-        events = {}
+    def getEventSummaries(self):
+        """
+        Returns the number & time extent of the events of each event series (see EventSeries.getSummary), by name. The
+        initial payload holds these rather than the events, which the client requests for its view (see getEvents).
+        """
+        return {name: es.getSummary() for name, es in self.getEventSeries().items()}
+
+    def getEventSeries(self):
+        """Returns the event series of the file (see EventSeries) by name, reading them if not already read."""
 
         # If we're in realtime-mode, we have no events to return, so return now.
         if self.mode() == 'realtime':
-            return events
-
-        def catcols(row, idcol=None):
-            idx = row[idcol]
-            return (idx, '\n'.join(
-                [f'{row[c]}' for c in row.index \
-                    if (c is not idcol) and (row[c] is not None) and (row[c] != '')]))
-
-        try:
+            return {}
 
-            # Prepare references to HDF5 data
-            meds = self.f['ehr/medications'][:]
-            events['meds'] = meds.apply(catcols, 1, idcol='time').tolist()
+        if self._events is not None:
+            return self._events
 
-        except Exception:
-            print("Error retrieving meds.")
-            traceback.print_exc()
+        logging.info(f"Assembling all event series for file {self.origFilePathObj}.")
+        start = time.time()
 
-        try:
+        events = {}
 
-            # Prepare references to HDF5 data
-            ce = self.f['low_rate'][:]
-            events['ce'] = ce.apply(catcols, 1, idcol='date').tolist()
+        for name, h5path, timecol in EVENT_TABLES:
+            try:
+                events[name] = EventSeries.fromDataFrame(self.f[h5path][:], timecol)
+            except Exception:
+                logging.exception(f"Error retrieving {name}.")
 
-        except Exception:
-            print("Error retrieving ce.")
-            traceback.print_exc()
+        self._events = events
 
         end = time.time()
         logging.info(f"Completed assembly of all event series for file {self.origFilePathObj}. Took {str(round(end - start, 5))}s.")
 
         return events
 
-    def getInitialPayload(self, user_id):
-        """Produces JSON output for all series in the file at the maximum time range."""
+    def getInitialPayload(self, user_id, maxPoints=None, columnar=False):
+        """
+        Produces JSON output for all series in the file at the maximum time range, with no more than about maxPoints
+        points per series if provided (see getPointBudget). If columnar is set, the series data is output as columns of
+        NumPy arrays, e.g. for a binary response (see Series.getFullOutput). If the file has yet to be downsampled, the
+        output is a preview (see isPreview) or is served from the overview of the file (see isProgressive), and its
+        preview field is set so that the client refreshes it. Only the annotations & patterns are assembled for the
+        user, while the rest of the output is shared by all users (see getSharedPayload).
+        """
 
         logging.info(f"Assembling all series full output for file {self.origFilePathObj}.")
         start = time.time()
 
-        if self.mode() == 'file':
-            try:
-                _ = self.pf
-            except:
-                return {}
+        shared = self.getSharedPayload(maxPoints, columnar)
 
         # Assemble the output object.
         outputObject = {
             'filename': self.origFilePathObj.name,
+            **self.getUserPayload(user_id),
+            'baseTime': 0, # ATW: Not sure if this is still necessary.
+            **shared
+        }
+
+        end = time.time()
+        logging.info(f"Completed assembly of all series full output for file {self.origFilePathObj}. Took {str(round(end - start, 5))}s.")
+
+        # Return the output object
+        return outputObject
+
+    def getUserPayload(self, user_id):
+        """
+        Produces the portion of the initial payload of the file which is specific to the user (see getInitialPayload):
+        the annotation sets, i.e. the user's general annotations & their annotations in each pattern set visible to
+        them, and the pattern sets, i.e. the patterns of the file in each visible pattern set. A pattern set is visible
+        to the user if it is assigned to them or to no one. These are read with a fixed number of queries, regardless of
+        the number of pattern sets, and partitioned by pattern set.
+        """
+
+        projectID = self.projparent.id
+
+        # Pattern sets visible to the user
+        patternSets = models.PatternSet.query.filter(models.PatternSet.project_id==projectID, or_(
+            models.PatternSet.id.notin_(
+                models.db.session.query(distinct(models.patternSetAssignments.c.pattern_set_id)).scalar_subquery()
+            ),
+            models.PatternSet.id.in_(
+                models.db.session.query(models.patternSetAssignments.c.pattern_set_id).filter(models.patternSetAssignments.c.user_id==user_id).scalar_subquery()
+            )
+        )).order_by(models.PatternSet.id).all()
+        patternSetIDs = [ps.id for ps in patternSets]
+
+        # The annotations & patterns all belong to this file, whose name is
+        # therefore read once rather than joined to each of them
+        fileModel = models.File.query.get(self.id)
+        filename = Path(fileModel.path).name if fileModel is not None else self.origFilePathObj.name
+
+        # The user's annotations, by pattern set ID (None for general annotations)
+        annotations = {id: [] for id in [None] + patternSetIDs}
+        for a in models.Annotation.query.options(lazyload(models.Annotation.file)).filter(
+            models.Annotation.user_id==user_id,
+            models.Annotation.project_id==projectID,
+            models.Annotation.file_id==self.id,
+            or_(models.Annotation.pattern_set_id.is_(None), models.Annotation.pattern_set_id.in_(patternSetIDs)),
+        ).order_by(models.Annotation.id):
+            annotations[a.pattern_set_id].append(annotationOrPatternOutput(a, filename=filename))
+
+        # The patterns of the file, by pattern set ID
+        patterns = {id: [] for id in patternSetIDs}
+        for pattern in models.Pattern.query.options(lazyload(models.Pattern.file)).filter(
+            models.Pattern.file_id==self.id,
+            models.Pattern.pattern_set_id.in_(patternSetIDs),
+        ).order_by(models.Pattern.id):
+            patterns[pattern.pattern_set_id].append(annotationOrPatternOutput(pattern, filename=filename))
+
+        return {
             'annotationsets': [{
                 'id': 'general',
                 'name': 'General',
                 'description': None,
-                'annotations': [annotationOrPatternOutput(a) for a in models.Annotation.query.filter_by(user_id=user_id, project_id=self.projparent.id, file_id=self.id, pattern_set_id=None).all()],
+                'annotations': annotations[None],
                 'show': True,
             }] + [
                 {
                     'id': patternset.id,
                     'name': patternset.name,
                     'description': patternset.description,
-                    'annotations': [annotationOrPatternOutput(a) for a in models.Annotation.query.filter_by(user_id=user_id, project_id=self.projparent.id, file_id=self.id, pattern_set_id=patternset.id).all()],
+                    'annotations': annotations[patternset.id],
                     'show': patternset.show_by_default,
-                } for patternset in models.PatternSet.query.filter(models.PatternSet.project_id==self.projparent.id, or_(
-                    models.PatternSet.id.notin_(
-                        models.db.session.query(distinct(models.patternSetAssignments.c.pattern_set_id)).subquery()
-                    ),
-                    models.PatternSet.id.in_(
-                        models.db.session.query(models.patternSetAssignments.c.pattern_set_id).filter(models.patternSetAssignments.c.user_id==user_id).subquery()
-                    )
-                )).all()
+                } for patternset in patternSets
             ],
             'patternsets': [
                 {
                     'id': patternset.id,
                     'name': patternset.name,
                     'description': patternset.description,
-                    'patterns': [annotationOrPatternOutput(pattern) for pattern in models.Pattern.query.filter_by(pattern_set_id=patternset.id, file_id=self.id).all()],
+                    'patterns': patterns[patternset.id],
                     'show': patternset.show_by_default,
-                } for patternset in models.PatternSet.query.filter(models.PatternSet.project_id==self.projparent.id, or_(
-                    models.PatternSet.id.notin_(
-                        models.db.session.query(distinct(models.patternSetAssignments.c.pattern_set_id)).subquery()
-                    ),
-                    models.PatternSet.id.in_(
-                        models.db.session.query(models.patternSetAssignments.c.pattern_set_id).filter(models.patternSetAssignments.c.user_id==user_id).subquery()
-                    )
-                )).all()
+                } for patternset in patternSets
             ],
-            'baseTime': 0, # ATW: Not sure if this is still necessary.
-            'events': self.getEvents(),
+        }
+
+    def getSharedPayload(self, maxPoints=None, columnar=False):
+        """
+        Produces the portion of the initial payload of the file which is the same for all users (see
+        getInitialPayload): its event summaries, metadata, preview field & the full output of all series. Once the
+        file is downsampled, this is cached (see payloadcache.py) in memory and as a blob next to the processed file,
+        until the processed file changes (e.g. as the file is reprocessed). Cached payloads are produced for the point
+        budget rounded up to a power of two (see getPointBudgetBucket). A cached payload holds its event summaries &
+        metadata (and, unless columnar is set, its series output) pre-encoded as JSON, and should not be modified.
+        """
+
+        # While the file is being downsampled, its output changes as the
+        # downsamples become available, so it is not cached.
+        if self.mode() != 'file' or self.isPreview() or self.isProgressive():
+            return self.assembleSharedPayload(maxPoints, columnar)
+
+        # Payloads are cached for a few point budgets, to which the requested
+        # budget is rounded
+        maxPoints = getPointBudgetBucket(maxPoints)
+
+        # The processed file & downsample modes of the series the payload was
+        # produced from. The series are loaded first, as they are on first
+        # access of the original file.
+        _ = self.f
+        st = self.procFilePathObj.stat()
+        version = (st.st_mtime_ns, st.st_size, *[s.getDownsampleMode() for s in self.series])
+
+        key = (str(self.procFilePathObj), version, maxPoints, columnar)
+
+        if columnar:
+            return sharedPayloadCache.get(key, lambda: self.loadSharedPayload(maxPoints, version))
+
+        # The series output as rows is encoded from the columnar payload
+        def load():
+            payload = dict(self.getSharedPayload(maxPoints, columnar=True))
+            payload['series'] = encodeRawJSON({id: {**{k: v for k, v in output.items() if k != 'columns'}, 'data': columnsToRows(output['columns'])} for id, output in payload['series'].items()})
+            return payload
+
+        return sharedPayloadCache.get(key, load)
+
+    # Assembles the output of getSharedPayload
+    def assembleSharedPayload(self, maxPoints=None, columnar=False):
+        return {
+            'eventSeries': self.getEventSummaries(),
             'metadata': self.getMetadata(),
-            'series': {}
+            'preview': self.isPreview() or self.isProgressive(),
+            'series': {s.id: s.getFullOutput(maxPoints, columnar) for s in self.series},
         }
 
-        for s in self.series:
-            outputObject['series'][s.id] = s.getFullOutput()
+    # Returns the columnar output of getSharedPayload for the given version of
+    # the processed file, read from its blob if stored, or else assembled & then
+    # stored as a blob, with the event summaries & metadata pre-encoded as JSON.
+    def loadSharedPayload(self, maxPoints, version):
 
-        end = time.time()
-        logging.info(f"Completed assembly of all series full output for file {self.origFilePathObj}. Took {str(round(end - start, 5))}s.")
+        blobPathObj = getBlobPathObj(self.procFilePathObj, maxPoints)
 
-        # Return the output object
-        return outputObject
+        payload = readBlob(blobPathObj, version)
+        if payload is not None:
+            logging.info(f"Read shared payload from blob {blobPathObj}.")
+        else:
+            payload = self.assembleSharedPayload(maxPoints, columnar=True)
+            writeBlob(blobPathObj, version, payload)
+
+        payload['eventSeries'] = encodeRawJSON(payload['eventSeries'])
+        payload['metadata'] = encodeRawJSON(payload['metadata'])
+
+        return payload
 
     def getMetadata(self):
         """Returns a dict of file metadata."""
@@ -416,6 +573,14 @@ class File:
                 return s
         return None
 
+    def getSeriesByDataset(self):
+        """Returns a dict of lists of series keyed by the path of the dataset to which they belong, in file order."""
+
+        seriesByDataset = {}
+        for s in self.series:
+            seriesByDataset.setdefault('/'.join(s.h5path), []).append(s)
+        return seriesByDataset
+
     def getSeriesNames(self):
         """Returns a list of series names available in the file."""
 
@@ -441,19 +606,43 @@ class File:
 
         return series
 
-    def getSeriesRangedOutput(self, seriesids, start, stop):
-        """Produces JSON output for a given list of series in the file at a specified time range."""
+    def getSeriesRangedOutput(self, seriesids, start, stop, maxPoints=None, columnar=False):
+        """
+        Produces JSON output for a given list of series in the file at a specified time range, with no more than about
+        maxPoints points per series if provided (see getPointBudget). If columnar is set, the series data is output as
+        columns of NumPy arrays (see getInitialPayload). Series to be output as raw data which share a dataset (e.g. the
+        columns of a numerics dataset) are read together, with one lookup & read of the range for all of them.
+        Identical calls made concurrently (e.g. by several users viewing the same range, or by a user & the prefetcher)
+        are coalesced, sharing one output object, which should not be modified.
+        """
+        key = (str(self.procFilePathObj), tuple(seriesids), start, stop, maxPoints, columnar)
+        return rangedOutputFlights.do(key, lambda: self.assembleSeriesRangedOutput(seriesids, start, stop, maxPoints, columnar))
+
+    # Assembles the output of getSeriesRangedOutput
+    def assembleSeriesRangedOutput(self, seriesids, start, stop, maxPoints=None, columnar=False):
 
         logging.info(f"Assembling series ranged output for file {self.origFilePathObj}, series [{', '.join(seriesids)}].")
         st = time.time()
 
         outputObject = {
+            'preview': self.isPreview() or self.isProgressive(),
             'series': {}
         }
 
+        # Group the series to be output as raw data by dataset & time column
+        rawGroups = {}
         for s in self.series:
-            if s.id in seriesids:
-                outputObject['series'][s.id] = s.getRangedOutput(start, stop)
+            if s.id in seriesids and s.id not in outputObject['series']:
+                if self.mode() != 'realtime' and s.isRangedOutputRaw(start, stop, maxPoints):
+                    rawGroups.setdefault(('/'.join(s.h5path), s.timecol), []).append(s)
+                    outputObject['series'][s.id] = None
+                else:
+                    outputObject['series'][s.id] = s.getRangedOutput(start, stop, maxPoints, columnar)
+
+        for group in rawGroups.values():
+            rows = readRangedData([s.rd for s in group], start, stop)
+            for i, s in enumerate(group):
+                outputObject['series'][s.id] = s.makeOutput({'time': rows[:, 0], 'value': rows[:, i + 1]}, 'real', columnar)
 
         et = time.time()
         logging.info(f"Completed assembly of series ranged output for file {self.origFilePathObj}, series [{', '.join(seriesids)}]. Took {str(round(et - st, 5))}s.")
@@ -461,6 +650,26 @@ class File:
         # Return the output object
         return outputObject
 
+    def getSeriesStatistics(self, seriesids, start, stop):
+        """Produces JSON output of statistics for a given list of series in the file at a specified time range."""
+
+        logging.info(f"Assembling series statistics for file {self.origFilePathObj}, series [{', '.join(seriesids)}].")
+        st = time.time()
+
+        outputObject = {
+            'series': {}
+        }
+
+        for s in self.series:
+            if s.id in seriesids:
+                outputObject['series'][s.id] = s.getStatistics(start, stop)
+
+        et = time.time()
+        logging.info(f"Completed assembly of series statistics for file {self.origFilePathObj}, series [{', '.join(seriesids)}]. Took {str(round(et - st, 5))}s.")
+
+        # Return the output object
+        return outputObject
+
     def load(self):
         """
         Loads the necessary data into memory for an already-processed data file
@@ -511,13 +720,63 @@ class File:
             else:
                 logging.warning(f'  - Skipping unsupported {coltype} series: {valcol}')
 
+    def isPreview(self):
+        """
+        Returns whether the file is served as a preview, i.e. its processed file is not available yet (e.g. because
+        the file is being downsampled). Series output is then decimated from the raw data as it is requested (see
+        RawData.getPreviewColumns), until the downsamples become available.
+        """
+
+        if self.mode() != 'file':
+            return False
+
+        try:
+            _ = self.pf
+        except (IOError, RuntimeError):
+            return True
+
+        return False
+
+    def isProgressive(self):
+        """
+        Returns whether the file is served from its overview, i.e. the coarsest downsample levels of its series, while
+        it is being downsampled (see processOverview). Views which call for finer levels are previewed from the raw
+        data (see Series.isPreviewed) until the downsamples are complete.
+        """
+
+        if self.mode() != 'file':
+            return False
+
+        try:
+            _ = self.pf
+        except (IOError, RuntimeError):
+            return False
+
+        return self._overviewMTime is not None
+
     # TODO(gus): When reviving realtime functionality, revise this
     def mode(self):
         """Returns the mode in which File is operating, either "file" or "realtime"."""
         return 'file'
 
-    def process(self):
-        """Process and store all downsamples for all series for the file."""
+    def process(self, threads=None, resume=None, onSeriesComplete=None, visibleSeries=None):
+        """
+        Process and store all downsamples for all series for the file. If threads is greater than one, series belonging
+        to different datasets are downsampled concurrently by that many threads within this process. If threads is not
+        provided, the downsampleThreads config setting is used.
+
+        If resume is provided, it should hold the IDs of the series already completed in the existing processed file
+        (e.g. by a process which was interrupted). The processed file is then reopened and only the remaining series
+        are processed. If provided, onSeriesComplete is called with the IDs of the series whose downsamples have been
+        completed & flushed to the processed file, each time a dataset's series complete.
+
+        Before the downsamples are built, the overview of the file is published (see processOverview), from which the
+        file is served in the meantime. If visibleSeries is provided, it should hold the IDs of the series shown by
+        the project template (see Project.getVisibleSeriesIDs), which are then done first.
+        """
+
+        if threads is None:
+            threads = config['downsampleThreads']
 
         # Create a path name for temporary file
         tmp_file = self.procFilePathObj.with_suffix(self.procFilePathObj.suffix + '.tmp')
@@ -529,10 +788,28 @@ class File:
             # Print user message
             print(f"Downsampling file {self.name}...")
 
-            # Create the file for storing processed data.
-            self._processed_file = audata.File.new(str(self.procFilePathObj), overwrite=False, time_reference=self.f.time_reference, return_datetimes=False)
+            # Shared payloads stored for an earlier processed file are stale
+            deleteBlobs(self.procFilePathObj)
+
+            if resume is not None:
+
+                # Reopen the partially completed processed file
+                self._processed_file = audata.File.open(str(self.procFilePathObj), readonly=False, return_datetimes=False)
+                if self._processed_file.meta.get('downsampleLayout') != getLayout():
+                    raise ValueError("The partially completed processed file has a different downsample layout than the current settings.")
+
+                # Accessing the original file loads its series
+                _ = self.f
+
+            else:
+
+                # Create the file for storing processed data.
+                self._processed_file = audata.File.new(str(self.procFilePathObj), overwrite=False, time_reference=self.f.time_reference, return_datetimes=False)
+
+                # Record the storage layout of the downsamples
+                self._processed_file.meta = {**self._processed_file.meta, 'downsampleLayout': getLayout()}
             
-            # Create a tmp file to indicate a file that has in the process of getting donwsampled
+            # Create a tmp file to indicate a file that has in the process of getting downsampled
             # These tmp files will be deleted either after successful downsampling or after restarting
             # the viewer. 
             #
@@ -541,9 +818,34 @@ class File:
             with open(str(tmp_file), 'w') as fp:
                 pass
 
-            # Process & store numeric series
-            for s in self.series:
-                s.processAndStore()
+            seriesGroups = list(self.getSeriesByDataset().values())
+
+            # Series shown by the project template are done first
+            if visibleSeries:
+                seriesGroups.sort(key=lambda g: not any(s.id in visibleSeries for s in g))
+
+            # Publish the overview of the file, unless resuming with one
+            # already published
+            if resume is None or not self.getOverviewFilePathObj().exists():
+                self.processOverview(seriesGroups, visibleSeries)
+
+            # Skip the series already completed, and discard any partially
+            # stored downsamples of the rest.
+            if resume is not None:
+                seriesGroups = [g for g in seriesGroups if not all(s.id in resume for s in g)]
+                for seriesGroup in seriesGroups:
+                    for s in seriesGroup:
+                        s.dss.deleteStored()
+                logging.info(f"Resuming processing with {len(seriesGroups)} remaining series groups.")
+
+            # Process & store numeric series, one dataset at a time so that
+            # series sharing a dataset are built from a single read.
+            if threads > 1:
+                self.processSeriesGroupsThreaded(seriesGroups, threads, onSeriesComplete)
+            else:
+                for seriesGroup in seriesGroups:
+                    processAndStoreSeriesGroup(seriesGroup)
+                    self.checkpointSeriesGroup(seriesGroup, onSeriesComplete)
 
             self._processed_file.flush()
 
@@ -570,6 +872,7 @@ class File:
             # Delete the processed data file
             try:
                 self.procFilePathObj.unlink()
+                self.deleteOverview()
             except Exception as e:
                 logging.error(f"Unable to delete file successfully. \n{e}\n{traceback.format_exc()}")
             else:
@@ -592,6 +895,7 @@ class File:
             # Delete the processed data file
             try:
                 self.procFilePathObj.unlink(missing_ok=True)
+                self.deleteOverview()
             except Exception as e:
                 logging.error(f"Unable to delete file successfully. \n{e}\n{traceback.format_exc()}")
             else:
@@ -603,8 +907,158 @@ class File:
             raise
 
         else:
-            # Deletes temporary files if files are downsampled successfully
+            # Deletes temporary files if files are downsampled successfully.
+            # The overview is deleted after the temp file, so that readers
+            # switch from it to the complete processed file (see pf).
             tmp_file.unlink()
+            self.deleteOverview()
+
+    def processOverview(self, seriesGroups, visibleSeries=None):
+        """
+        Build & publish the overview of the file, which holds the coarsest downsample levels of each series (see
+        DownsampleSet.getNumOverviewLevels) along with the time index of its raw data, so that the file may be served
+        from the overview while its downsamples are built (see isProgressive). The series groups (see
+        getSeriesByDataset) are built in the order given. The overview is written to a temporary file, which is moved
+        into place once complete, so that readers never see a partial overview. If visibleSeries is provided, the
+        overview is also published as soon as the groups holding those series are built, ahead of the rest.
+        """
+
+        if config['downsampleOverviewLevels'] < 1:
+            return
+
+        logging.info(f"Building the overview for file {self.origFilePathObj}.")
+        start = time.time()
+
+        overviewFilePathObj = self.getOverviewFilePathObj()
+        overview_tmp_file = Path(str(overviewFilePathObj)+'.tmp')
+        overview_copy_file = Path(str(overviewFilePathObj)+'.copy')
+
+        isVisible = lambda g: visibleSeries is not None and any(s.id in visibleSeries for s in g)
+
+        overview = audata.File.new(str(overview_tmp_file), overwrite=True, time_reference=self.f.time_reference, return_datetimes=False)
+        try:
+
+            overview.meta = {**overview.meta, 'downsampleLayout': getLayout()}
+
+            for i, seriesGroup in enumerate(seriesGroups):
+
+                processAndStoreOverviewGroup(seriesGroup, overview.hdf)
+
+                # Publish a copy of the overview once the visible series are
+                # done, if others remain
+                if isVisible(seriesGroup) and i + 1 < len(seriesGroups) and not isVisible(seriesGroups[i + 1]):
+                    overview.flush()
+                    shutil.copyfile(overview_tmp_file, overview_copy_file)
+                    os.replace(overview_copy_file, overviewFilePathObj)
+                    logging.info(f"Published the overview of the visible series. Took {round(time.time() - start, 5)}s.")
+
+        finally:
+            overview.close()
+
+        os.replace(overview_tmp_file, overviewFilePathObj)
+
+        end = time.time()
+        logging.info(f"Published the overview for file {self.origFilePathObj}. Took {round(end - start, 5)}s.")
+
+    def processAppended(self):
+        """
+        Extend the downsamples in the existing processed file with any data appended to the original file since it
+        was processed, rather than processing the file from scratch. Only the appended data is downsampled, except
+        for series whose downsamples cannot be extended or fail to be, which are rebuilt (see
+        Series.processAndStoreAppended). If the processed file does not exist yet, the file is processed in full. The
+        processed file is deleted only if a series fails to be rebuilt as well.
+        """
+
+        if not self.procFilePathObj.exists():
+            self.process()
+            return
+
+        # Create a path name for temporary file
+        tmp_file = self.procFilePathObj.with_suffix(self.procFilePathObj.suffix + '.tmp')
+        try:
+
+            logging.info(f"Extending downsamples with appended data for file {self.origFilePathObj}.")
+            start = time.time()
+
+            # Open the processed file for writing
+            self._processed_file = audata.File.open(str(self.procFilePathObj), readonly=False, return_datetimes=False)
+
+            # Mark the processed file as being downsampled while it is updated
+            # (see process).
+            with open(str(tmp_file), 'w') as fp:
+                pass
+
+            # Accessing the original file loads its series
+            _ = self.f
+
+            for s in self.series:
+                s.processAndStoreAppended()
+
+            self._processed_file.flush()
+
+            end = time.time()
+            logging.info(f"Completed extending downsamples for file {self.origFilePathObj}. Took {str(round((end - start) / 60, 3))} minutes).")
+
+        except Exception as e:
+
+            logging.error(f"There was an exception while extending downsamples for {self.origFilePathObj}.\n{e}\n{traceback.format_exc()}\nDeleting partially updated processed file {self.procFilePathObj}.")
+
+            # Close the file
+            try:
+                self._processed_file.close()
+            except Exception as e:
+                logging.error(f"Unable to close the processed file.\n{e}\n{traceback.format_exc()}")
+
+            # Delete the processed data file, so that it is processed from
+            # scratch next time.
+            try:
+                self.procFilePathObj.unlink(missing_ok=True)
+            except Exception as e:
+                logging.error(f"Unable to delete file successfully. \n{e}\n{traceback.format_exc()}")
+            else:
+                tmp_file.unlink(missing_ok=True)
+
+            # Re-raise the exception
+            raise
+
+        else:
+            # Deletes temporary files if files are updated successfully
+            tmp_file.unlink()
+
+    def processSeriesGroupsThreaded(self, seriesGroups, threads, onSeriesComplete=None):
+        """
+        Process and store all downsamples for the given groups of series (see getSeriesByDataset) using a pool of
+        threads. The downsample kernels release the GIL, so the groups are downsampled concurrently. Each group is
+        checkpointed as it completes (see checkpointSeriesGroup).
+        """
+
+        logging.info(f"Processing {len(seriesGroups)} series groups using {threads} threads.")
+
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+
+            futures = {executor.submit(processAndStoreSeriesGroup, seriesGroup): seriesGroup for seriesGroup in seriesGroups}
+
+            # Wait for all groups to complete, and on the first exception, cancel
+            # the groups which have not yet started before re-raising it.
+            try:
+                for future in as_completed(futures):
+                    future.result()
+                    self.checkpointSeriesGroup(futures[future], onSeriesComplete)
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+
+    def checkpointSeriesGroup(self, seriesGroup, onSeriesComplete=None):
+        """
+        Flush the completed downsamples of a group of series to the processed file, and report the series as
+        completed to onSeriesComplete, if provided, so that processing may resume after them if interrupted.
+        """
+
+        self._processed_file.flush()
+
+        if onSeriesComplete is not None:
+            onSeriesComplete([s.id for s in seriesGroup])
 
     def updateAnnotation(self, user_id, id, left=None, right=None, top=None, bottom=None, seriesID='', label=''):
         """Update an annotation with new values"""
@@ -629,4 +1083,13 @@ class File:
         models.db.session.commit()
 
         # Return true to indicate success
-        return True
\ No newline at end of file
+        return True
+
+
+# Returns the modification time of the file at the given path, in nanoseconds,
+# or None if it does not exist
+def getMTime(pathObj):
+    try:
+        return pathObj.stat().st_mtime_ns
+    except FileNotFoundError:
+        return None
@@ -0,0 +1,129 @@
+"""Storage layout of downsample intervals in processed files."""
+
+import logging
+import numpy as np
+import pandas as pd
+
+from .config import config
+
+# The blosc compression filter is available only if hdf5plugin is installed.
+try:
+    import hdf5plugin
+except ImportError:
+    hdf5plugin = None
+
+# Columns of downsample intervals (see cylib) holding values, which are stored
+# as float32 if requested. The count, sum & sum of squares are always stored as
+# float64 so that statistics computed from them remain exact.
+VALUE_COLUMNS = ['1', '2', '6', '7']
+
+# Time offsets stored relative to the base of a downsample are stored as float32
+# only if float32 resolves them to within this fraction of the time-per-interval
+# of the downsample. Otherwise, they are stored as float64.
+TIME_OFFSET_RESOLUTION = 0.01
+
+# Name of the HDF5 attribute holding the base time offset of a downsample, which
+# is added to its stored time offsets when read. Downsamples without it store
+# absolute time offsets.
+TIME_BASE_ATTR = 'timeBase'
+
+# Returns the storage layout for downsamples, per the config settings, as a
+# JSON-ready dict. The layout is recorded in the processed file's metadata.
+def getLayout():
+    return {
+        'chunkRows': config['downsampleChunkRows'],
+        'compression': config['downsampleCompression'],
+        'compressionLevel': config['downsampleCompressionLevel'],
+        'float32': config['downsampleFloat32'],
+        'timeOffsets': config['downsampleTimeOffsets'],
+    }
+
+# Returns the keyword arguments for h5py's create_dataset which apply the
+# compression filter of the layout.
+def getCompressionArgs(layout):
+
+    compression = layout['compression']
+    level = layout['compressionLevel']
+
+    if compression == 'blosc' and hdf5plugin is None:
+        logging.warning("The blosc compression filter requires hdf5plugin, which is not installed. Using gzip instead.")
+        compression = 'gzip'
+
+    if compression is None:
+        return {}
+    elif compression == 'gzip':
+        return {'compression': 'gzip', 'compression_opts': level, 'shuffle': True}
+    elif compression == 'lzf':
+        return {'compression': 'lzf', 'shuffle': True}
+    elif compression == 'blosc':
+        return dict(hdf5plugin.Blosc(cname='zstd', clevel=5 if level is None else level, shuffle=hdf5plugin.Blosc.SHUFFLE))
+    else:
+        raise ValueError(f"Unsupported downsample compression filter: {compression}")
+
+# Returns the compound dtype for storing downsample intervals of numColumns
+# columns per the layout. The timePerInterval and timespan of the downsample
+# determine whether time offsets may be stored as float32.
+def getDtype(numColumns, layout, timePerInterval, timespan):
+
+    # Allow for the series to grow by appended data before the downsamples
+    # are rebuilt (see DownsampleSet.processAndStoreAppended).
+    timeDtype = np.float64
+    if layout['timeOffsets'] and timespan * config['stepMultiplier'] * 2.0**-24 <= timePerInterval * TIME_OFFSET_RESOLUTION:
+        timeDtype = np.float32
+
+    valueDtype = np.float32 if layout['float32'] else np.float64
+
+    return np.dtype([(str(j), timeDtype if j == 0 else valueDtype if str(j) in VALUE_COLUMNS else np.float64) for j in range(numColumns)])
+
+# Creates a dataset named name in the HDF5 group for storing the downsample
+# intervals, which has the given time-per-interval and spans timespan, per the
+# layout. The dataset may be appended to with appendToDataset.
+def createDataset(group, name, intervals, layout, timePerInterval, timespan):
+
+    timeBase = float(intervals[0,0]) if layout['timeOffsets'] and intervals.shape[0] > 0 else 0.0
+
+    dtype = getDtype(intervals.shape[1], layout, timePerInterval, timespan)
+
+    ds = group.create_dataset(
+        name,
+        data=encodeIntervals(intervals, dtype, timeBase),
+        chunks=(layout['chunkRows'],) if layout['chunkRows'] else True,
+        maxshape=(None,),
+        fletcher32=True,
+        **getCompressionArgs(layout)
+    )
+    ds.attrs[TIME_BASE_ATTR] = timeBase
+
+    return ds
+
+# Appends downsample intervals to an HDF5 dataset created with createDataset,
+# in the layout of the dataset.
+def appendToDataset(ds, intervals):
+    rec = encodeIntervals(intervals, ds.dtype, getTimeBase(ds))
+    ds.resize((ds.shape[0] + rec.shape[0],))
+    ds[-rec.shape[0]:] = rec
+
+# Returns the downsample intervals as a structured array of the given dtype,
+# with time offsets relative to timeBase.
+def encodeIntervals(intervals, dtype, timeBase):
+    rec = np.empty(intervals.shape[0], dtype=dtype)
+    for j, name in enumerate(dtype.names):
+        rec[name] = intervals[:,j] - timeBase if j == 0 else intervals[:,j]
+    return rec
+
+# Returns the base time offset of the downsample stored in the HDF5 dataset.
+def getTimeBase(ds):
+    return float(ds.attrs.get(TIME_BASE_ATTR, 0.0))
+
+# Reads rows start to stop of the given columns of the downsample stored in the
+# HDF5 dataset, decoded to a DataFrame of float64 columns with absolute time
+# offsets.
+def readIntervals(ds, columns, start=None, stop=None):
+
+    rec = ds.fields(columns)[start:stop]
+
+    data = {c: rec[c].astype(np.float64) for c in columns}
+    if '0' in data:
+        data['0'] = data['0'] + getTimeBase(ds)
+
+    return pd.DataFrame(data, columns=columns)
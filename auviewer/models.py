@@ -142,6 +142,36 @@ class PatternSet(db.Model):
     users = db.relationship('User', secondary=patternSetAssignments, lazy=True, backref=db.backref('pattern_sets', lazy=True))
 
 
+class DownsampleJob(db.Model):
+    __tablename__ = 'downsample_jobs'
+    id = db.Column(db.Integer, primary_key=True)
+    file_id = db.Column(db.Integer, db.ForeignKey('files.id', ondelete='CASCADE'), nullable=False)
+    type = db.Column(db.String(255), nullable=False) # DOWNSAMPLE | UPDATE
+    status = db.Column(db.String(255), nullable=False) # QUEUED | RUNNING | COMPLETED | FAILED
+    priority = db.Column(db.Integer, nullable=False)
+    size = db.Column(db.Integer, nullable=True) # size of the original file, in bytes, when queued
+    num_series = db.Column(db.Integer, nullable=True) # known once the job has completed a series
+    error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, server_default=func.now())
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    file = db.relationship('File', lazy='joined', backref=db.backref('downsample_jobs', lazy=True, cascade='all, delete-orphan'))
+    series = db.relationship('DownsampleJobSeries', lazy=True, cascade='all, delete-orphan', backref=db.backref('job', lazy=True))
+
+
+# Series whose downsamples a downsample job has completed & flushed to the
+# processed file, from which the job may resume if interrupted.
+class DownsampleJobSeries(db.Model):
+    __tablename__ = 'downsample_job_series'
+    id = db.Column(db.Integer, primary_key=True)
+    job_id = db.Column(db.Integer, db.ForeignKey('downsample_jobs.id', ondelete='CASCADE'), nullable=False)
+    series = db.Column(db.String(255), nullable=False)
+    completed_at = db.Column(db.DateTime, nullable=False, server_default=func.now())
+
+    __table_args__ = (db.UniqueConstraint('job_id', 'series'),)
+
+
 class File(db.Model):
     __tablename__ = 'files'
     id = db.Column(db.Integer, primary_key=True)
@@ -0,0 +1,206 @@
+"""Cache of the user-independent portion of initial file payloads, in memory & as blobs next to processed files."""
+
+from collections import OrderedDict
+import logging
+import os
+from pathlib import Path
+import tempfile
+import threading
+
+import simplejson
+
+from .coalesce import SingleFlight
+from .config import config
+from .wireformat import decodeBinaryPayload, encodeBinaryPayload
+
+# Version of the content of shared payload blobs, stored with the version of
+# their processed file so that blobs of a previous content are not read
+BLOB_CONTENT_VERSION = 2
+
+class SharedPayloadCache:
+    """
+    LRU cache of the user-independent portion of initial file payloads (see File.getSharedPayload), bounded by the
+    payloadCacheBudget config setting (in megabytes). Shared by all files & users served by the process, and safe to
+    use from multiple threads. Entries are keyed by the version of the processed file they were read from, so that
+    the entries of a reprocessed file are never served. Concurrent misses of the same key are coalesced, so that a
+    payload is loaded once however many users open its file at the same time.
+    """
+
+    def __init__(self):
+
+        # Guards the entries & counters
+        self.lock = threading.Lock()
+
+        # Cached entries by key, as (payload, size in bytes), from least to
+        # most recently used, and their total size in bytes
+        self.entries = OrderedDict()
+        self.numBytes = 0
+
+        # Coalesces concurrent loads of the same key
+        self.flights = SingleFlight()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, load):
+        """Returns the payload with the given key, loaded with load() and cached if it is not already cached."""
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits = self.hits + 1
+                return entry[0]
+            self.misses = self.misses + 1
+
+        def loadAndPut():
+            payload = load()
+            self.put(key, payload)
+            return payload
+
+        return self.flights.do(key, loadAndPut)
+
+    def put(self, key, payload):
+        """Caches the payload with the given key, evicting the least recently used entries to stay within the budget."""
+
+        budget = config['payloadCacheBudget'] * 1024 * 1024
+        size = getPayloadSize(payload)
+        if size > budget:
+            return
+
+        with self.lock:
+
+            if key in self.entries:
+                return
+
+            self.entries[key] = (payload, size)
+            self.numBytes = self.numBytes + size
+
+            while self.numBytes > budget:
+                _, (_, evictedSize) = self.entries.popitem(last=False)
+                self.numBytes = self.numBytes - evictedSize
+                self.evictions = self.evictions + 1
+
+    def clear(self):
+        """Removes all entries from the cache."""
+        with self.lock:
+            self.entries.clear()
+            self.numBytes = 0
+
+    def getStats(self):
+        """Returns the number & size of cached payloads, the budget, and the hit, miss & eviction counts as a dict."""
+        with self.lock:
+            return {
+                'payloads': len(self.entries),
+                'bytes': self.numBytes,
+                'budget': config['payloadCacheBudget'] * 1024 * 1024,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+# The shared payload cache of this process
+sharedPayloadCache = SharedPayloadCache()
+
+# Returns the approximate size in bytes of a shared payload: the size of its
+# pre-encoded JSON (see encodeRawJSON) and of its series data columns.
+def getPayloadSize(payload):
+    size = 0
+    for value in payload.values():
+        if isinstance(value, simplejson.RawJSON):
+            size = size + len(value.encoded_json)
+    if isinstance(payload.get('series'), dict):
+        for output in payload['series'].values():
+            size = size + sum(values.nbytes for values in output['columns'].values())
+    return size
+
+# Returns the JSON encoding of a value, with NaN values as null, to be embedded
+# as is when a payload holding it is encoded (see wireformat.py).
+def encodeRawJSON(value):
+    return simplejson.RawJSON(simplejson.dumps(value, ignore_nan=True))
+
+# Returns the point budget (see getPointBudget) of the shared payload cached
+# for the given point budget: the budget rounded up to a power of two, no more
+# than the maxPointBudget config setting, or None if None. Payloads are thus
+# shared by clients whose budgets differ only slightly (e.g. as the budget
+# follows the client's window width), at the cost of up to twice the points.
+def getPointBudgetBucket(maxPoints):
+    if maxPoints is None:
+        return None
+    return min(1 << (max(1, maxPoints) - 1).bit_length(), max(maxPoints, config['maxPointBudget']))
+
+# Returns the path of the blob of the shared payload of a processed file for
+# the point budget (see getPointBudget), or for no point budget if None
+def getBlobPathObj(procFilePathObj, maxPoints):
+    return Path(f"{procFilePathObj}.payload-{'full' if maxPoints is None else maxPoints}")
+
+# Returns the shared payload stored in the blob at the given path (see
+# writeBlob), with its series data as columns, or None if there is no such blob
+# or it is not of the given version (i.e. its processed file has been
+# reprocessed since) or cannot be read.
+def readBlob(pathObj, version):
+
+    if config['payloadBlobsPerFile'] < 1:
+        return None
+
+    try:
+        with pathObj.open('rb') as f:
+            payload = decodeBinaryPayload(f.read())
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logging.warning(f"Unable to read payload blob {pathObj}.\n{e}")
+        return None
+
+    if payload.pop('version', None) != [BLOB_CONTENT_VERSION, *version]:
+        return None
+
+    return payload
+
+# Stores the shared payload, with its series data as columns, as a blob of the
+# given version at the given path, in the binary wire format (see
+# encodeBinaryPayload). The blob is written to a temporary file of its own
+# (so that concurrent writers, e.g. in other processes, do not write the same
+# one) which is moved into place, and the least recently written blobs of the processed file
+# beyond the payloadBlobsPerFile config setting are deleted.
+def writeBlob(pathObj, version, payload):
+
+    if config['payloadBlobsPerFile'] < 1:
+        return
+
+    tmpPathObj = None
+    try:
+        with tempfile.NamedTemporaryFile(dir=pathObj.parent, prefix=pathObj.name + '.', suffix='.tmp', delete=False) as f:
+            tmpPathObj = Path(f.name)
+            f.write(encodeBinaryPayload({'version': [BLOB_CONTENT_VERSION, *version], **payload}))
+        os.replace(tmpPathObj, pathObj)
+    except Exception as e:
+        logging.warning(f"Unable to write payload blob {pathObj}.\n{e}")
+        if tmpPathObj is not None:
+            tmpPathObj.unlink(missing_ok=True)
+        return
+
+    # Blobs deleted meanwhile (e.g. by a concurrent writer in another process)
+    # are skipped
+    blobs = []
+    for p in getBlobPathObjs(pathObj.parent, pathObj.name.rsplit('-', 1)[0]):
+        try:
+            blobs.append((p.stat().st_mtime_ns, p))
+        except FileNotFoundError:
+            pass
+    blobs.sort(key=lambda b: b[0], reverse=True)
+    for _, p in blobs[config['payloadBlobsPerFile']:]:
+        p.unlink(missing_ok=True)
+
+# Returns the paths of the blobs in the given folder whose names begin with the
+# given prefix (see getBlobPathObj)
+def getBlobPathObjs(folderPathObj, prefix):
+    return [p for p in folderPathObj.iterdir() if p.name.startswith(prefix + '-') and not p.name.endswith('.tmp')]
+
+# Deletes the blobs of the shared payloads of a processed file (e.g. as it is
+# reprocessed)
+def deleteBlobs(procFilePathObj):
+    if procFilePathObj.parent.exists():
+        for p in getBlobPathObjs(procFilePathObj.parent, procFilePathObj.name + '.payload'):
+            p.unlink(missing_ok=True)
@@ -0,0 +1,170 @@
+"""Speculative prefetch of the ranged series output users are likely to request next."""
+
+import atexit
+from collections import deque
+from contextlib import contextmanager
+import logging
+import threading
+import traceback
+
+from .config import config
+
+class Prefetcher:
+    """
+    Warms the tile cache (see tilecache.py) in background threads with the ranged output of series for time ranges a
+    user is likely to request next, such as the windows adjacent to the one just viewed. Each user may have at most
+    prefetchBudget ranges pending, beyond which their oldest pending ranges are dropped, as they are superseded by the
+    user's more recent views. Prefetching yields to foreground requests: a pending range is only read while no
+    foreground request (see foreground) is being served.
+    """
+
+    def __init__(self):
+
+        # Guards the pending ranges & counters, and signals the worker threads
+        self.condition = threading.Condition()
+
+        # Pending ranges, in the order they are to be read, as [userID, fn,
+        # args, cancelled] entries, and the pending entries of each user, from
+        # oldest to newest
+        self.queue = deque()
+        self.pending = {}
+
+        # Number of foreground requests being served
+        self.numForeground = 0
+
+        self.threads = []
+        self.shuttingDown = False
+
+        self.completed = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def submit(self, userID, fn, args):
+        """
+        Queues fn(*args) to prefetch a range for the user, dropping the user's oldest pending ranges as necessary to
+        stay within the prefetchBudget config setting. Does nothing if prefetching is disabled (i.e. the budget is 0).
+        """
+
+        budget = config['prefetchBudget']
+        if budget < 1:
+            return
+
+        with self.condition:
+
+            if self.shuttingDown:
+                return
+
+            entry = [userID, fn, args, False]
+            self.queue.append(entry)
+            userPending = self.pending.setdefault(userID, deque())
+            userPending.append(entry)
+
+            while len(userPending) > budget:
+                userPending.popleft()[3] = True
+                self.dropped = self.dropped + 1
+
+            self.startThreads()
+            self.condition.notify()
+
+    @contextmanager
+    def foreground(self):
+        """Context manager within which a foreground request is served, during which prefetching is paused."""
+
+        with self.condition:
+            self.numForeground = self.numForeground + 1
+
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.numForeground = self.numForeground - 1
+                self.condition.notify_all()
+
+    def getStats(self):
+        """Returns the number of pending ranges, and the numbers of ranges prefetched, dropped & failed, as a dict."""
+        with self.condition:
+            return {
+                'pending': sum(len(p) for p in self.pending.values()),
+                'completed': self.completed,
+                'dropped': self.dropped,
+                'failed': self.failed,
+            }
+
+    def shutdown(self):
+        """Drops all pending ranges and stops the worker threads, waiting for any range being read to finish."""
+
+        with self.condition:
+            self.shuttingDown = True
+            self.queue.clear()
+            self.pending.clear()
+            self.condition.notify_all()
+
+        for thread in self.threads:
+            thread.join()
+
+    # Starts the worker threads, per the prefetchThreads config setting, if not
+    # already started. Expects the condition to be held.
+    def startThreads(self):
+        while len(self.threads) < max(1, config['prefetchThreads']):
+            thread = threading.Thread(target=self.run, name=f"prefetch-{len(self.threads)}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    # Runs in each worker thread, reading pending ranges while no foreground
+    # request is being served.
+    def run(self):
+
+        while True:
+
+            with self.condition:
+
+                while not self.shuttingDown and (len(self.queue) == 0 or self.numForeground > 0):
+                    self.condition.wait()
+
+                if self.shuttingDown:
+                    return
+
+                userID, fn, args, cancelled = entry = self.queue.popleft()
+                if cancelled:
+                    continue
+                userPending = self.pending[userID]
+                userPending.remove(entry)
+                if len(userPending) == 0:
+                    del self.pending[userID]
+
+            try:
+                fn(*args)
+                with self.condition:
+                    self.completed = self.completed + 1
+            except Exception as e:
+                logging.warning(f"Prefetch failed.\n{e}\n{traceback.format_exc()}")
+                with self.condition:
+                    self.failed = self.failed + 1
+
+# The prefetcher of this process, which is shut down at exit so that no range
+# is being read from a file as it is closed
+prefetcher = Prefetcher()
+atexit.register(prefetcher.shutdown)
+
+# Returns the time ranges to prefetch after a view of starttime to stoptime: the
+# windows of the same width to the left & right (i.e. panning by a viewport),
+# and the window of three times the width centered on it (i.e. the next zoom-out
+# level).
+def getAdjacentRanges(starttime, stoptime):
+    width = stoptime - starttime
+    return [
+        (stoptime, stoptime + width),
+        (starttime - width, starttime),
+        (starttime - width, stoptime + width),
+    ]
+
+# Queues the prefetch of the ranged output of the given series of the file for
+# the ranges adjacent to the view of starttime to stoptime (see
+# getAdjacentRanges) for the user, with the same point budget. Files being
+# downsampled (see File.isPreview & File.isProgressive) are not prefetched, as
+# their previews do not go through the tile cache.
+def prefetchAdjacentRanges(userID, file, seriesids, starttime, stoptime, maxPoints=None):
+    if stoptime is None or starttime is None or stoptime <= starttime or file.isPreview() or file.isProgressive():
+        return
+    for a, b in getAdjacentRanges(starttime, stoptime):
+        prefetcher.submit(userID, file.getSeriesRangedOutput, (seriesids, a, b, maxPoints, True))
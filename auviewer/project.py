@@ -1,5 +1,6 @@
 """Class and related functionality for projects."""
 import importlib
+import json
 import numpy as np
 
 import datetime as dt
@@ -54,6 +55,15 @@ class Project:
             with p.open() as f:
                 self.projectTemplate = f.read()
 
+        # Holds the series templates of the project template, parsed once as
+        # they are read for every series output (see getSeriesDownsampleMode),
+        # or None if the project template cannot be parsed
+        try:
+            self.projectTemplateSeries = json.loads(self.projectTemplate).get('series', {})
+        except (ValueError, AttributeError):
+            logging.warning(f"Unable to parse the project template of project {self.id}.")
+            self.projectTemplateSeries = None
+
         # Holds references to the files that belong to the project
         self.files = []
 
@@ -172,11 +182,14 @@ class Project:
         outputObject = {
             'files': [[f.id, f.origFilePathObj.name] for f in files],
             'series': [],
-            'events': [],#[f.getEvents() for f in self.files],
+            # Events are not shown in the project view, and file payloads
+            # carry only event summaries (see File.getEvents), so each file's
+            # events are left empty
+            'events': [{} for f in files],
             'metadata': [f.getMetadata() for f in files]
         }
 
-        #must populate outputObject with constituent files' series, events, and metadata
+        #must populate outputObject with constituent files' series
         for f in files:
             s = self.getSeriesToRender(f)
             if (s):
@@ -801,6 +814,34 @@ class Project:
         else:
             return file.series[0]
 
+    # Returns the mode in which the series with the given ID should be output
+    # (see DOWNSAMPLE_MODES), per the downsampleMode of the series in the project
+    # template, or of the project template's default series, or else the
+    # downsampleMode config setting.
+    def getSeriesDownsampleMode(self, seriesID):
+        series = self.projectTemplateSeries or {}
+        for name in [seriesID, '_default']:
+            if isinstance(series.get(name), dict) and 'downsampleMode' in series[name]:
+                return series[name]['downsampleMode']
+        return config['downsampleMode']
+
+    # Returns the IDs of the series shown by the project template (including the
+    # members of shown series groups), which are downsampled first (see
+    # File.process), or None if the template shows all series by default or
+    # cannot be parsed (in which case all series are shown).
+    def getVisibleSeriesIDs(self):
+        series = self.projectTemplateSeries
+        if series is None:
+            return None
+        if isinstance(series.get('_default'), dict) and series['_default'].get('show') is True:
+            return None
+        visible = []
+        for name, template in series.items():
+            if name != '_default' and isinstance(template, dict) and template.get('show') is True:
+                visible.append(name)
+                visible.extend(template.get('members', []))
+        return visible
+
     def getSeriesToRender(self, file):
         supervisorModule = models.SupervisorModule.query.filter_by(project_id=self.id).first()
         if (supervisorModule):
@@ -1,7 +1,21 @@
 import numpy as np
 import datetime as dt
 
-from .cylib import getSliceParam
+from .config import config
+from .shared import getStatisticsFromAggregates
+from .tilecache import TILE_ROWS, getFileVersion, getTiledRange
+from .timeindex import TIME_INDEX_NAME, TimeIndex, loadTimeIndex
+
+# Number of raw data points read at a time when decimating raw data for a
+# preview (see RawData.getPreviewColumns), which bounds the memory used
+PREVIEW_CHUNK_ROWS = 1 << 20
+
+# Maximum number of raw data points read for a preview. Beyond it, blocks of
+# PREVIEW_BLOCK_ROWS consecutive data points spread evenly over the range are
+# read instead, so that the time taken to preview a long series is bounded, at
+# the cost of missing the extremes between the blocks.
+PREVIEW_MAX_ROWS = 1 << 22
+PREVIEW_BLOCK_ROWS = 1024
 
 # Represents raw data for a single time series
 class RawData:
@@ -22,33 +36,239 @@ class RawData:
         if self.len < 2:
             self.timespan = 0
         else:
-            # self.timespan = np.abs(np.diff(dataset[[-1, 0]][self.seriesparent.timecol].values.astype(np.float64))[0])
-            self.timespan = dataset[[-1, 0]]
-            self.timespan = self.timespan[self.seriesparent.timecol]
-            self.timespan = self.timespan.values.astype(np.float64)
-            self.timespan = np.abs(np.diff(self.timespan)[0])
-
-    # Returns a slice of the appropriate downsample for the given time range, or
-    # nothing if there is no appropriate downsample available (in this case, raw
-    # data should be used). Expects starttime & stoptime to be time offsets
+            times = dataset.hdf.fields(self.seriesparent.timecol)[[0, self.len - 1]].astype(np.float64)
+            self.timespan = np.abs(times[1] - times[0])
+
+        # Holds the time index of the raw data (see getTimeIndex)
+        self.timeIndex = None
+
+        # Holds the preview of the full series, as (key, columns, output type),
+        # for as long as the series & budget are unchanged (see
+        # getPreviewColumns)
+        self.fullPreview = None
+
+    # Returns the raw data for the given time range as JSON-ready rows of
+    # [time, None, None, value]. Expects starttime & stoptime to be time offsets
     # floats in seconds.
     def getRangedOutput(self, starttime, stoptime):
 
+        rows = self.getRangedData(starttime, stoptime)
+
+        # Assemble the output data
+        nones = [None] * rows.shape[0]
+        return [list(i) for i in zip(rows[:, 0].tolist(), nones, nones, rows[:, 1].tolist())]
+
+    # Returns the raw data for the given time range as a 2D float64 array of
+    # times & values. Expects starttime & stoptime to be time offsets floats in
+    # seconds.
+    def getRangedData(self, starttime, stoptime):
+        return readRangedData([self], starttime, stoptime)
+
+    # Returns a preview of the raw data for the given time range (or of the
+    # whole series, if not provided), for use while the series has yet to be
+    # downsampled, as data columns (see Series.makeOutput) & output type. If the
+    # range holds no more than numIntervals (or M) data points, the preview is
+    # the raw data itself. Otherwise, the range is divided into numIntervals
+    # equal intervals, and the preview holds the min & max of the data points
+    # in each, computed from at most PREVIEW_MAX_ROWS data points (see
+    # decimateMinMax). Expects starttime & stoptime to be time offsets floats in
+    # seconds.
+    def getPreviewColumns(self, starttime=None, stoptime=None, numIntervals=None):
+
+        numIntervals = config['M'] if numIntervals is None else numIntervals
+
+        ds = self.getDatasetReference()
+        columns = [self.seriesparent.timecol, self.seriesparent.valcol]
+
+        # The preview of the full series is kept until the series grows
+        full = starttime is None
+        key = (ds.hdf.shape[0], numIntervals)
+        if full and self.fullPreview is not None and self.fullPreview[0] == key:
+            return self.fullPreview[1], self.fullPreview[2]
+
+        if full:
+            start, stop = 0, ds.hdf.shape[0]
+        else:
+            start, stop = self.getTimeIndex().getSlice(starttime, stoptime)
+
+        if stop - start <= numIntervals:
+            rows = readColumns(ds, columns, start, stop)
+            return {'time': rows[:, 0], 'value': rows[:, 1]}, 'real'
+
+        if full:
+            starttime, stoptime = readColumns(ds, columns[:1], start, start + 1)[0, 0], readColumns(ds, columns[:1], stop - 1, stop)[0, 0]
+        preview = decimateMinMax(ds, columns, start, stop, starttime, stoptime, numIntervals)
+
+        if full:
+            self.fullPreview = (key, preview, 'downsample')
+
+        return preview, 'downsample'
+
+    # Returns statistics over the given time range computed from the raw data
+    # (see getStatisticsFromAggregates). Expects starttime & stoptime to be time
+    # offsets floats in seconds.
+    def getRangeStatistics(self, starttime, stoptime):
+
         # Grab a reference to the dataset
         ds = self.getDatasetReference()
 
         # Find the start & stop indices based on the start & stop times.
-        # startIndex = np.searchsorted(self.rawTimeOffsets, starttime)
-        # stopIndex = np.searchsorted(self.rawTimeOffsets, stoptime, side='right')
-        startIndex = getSliceParam(ds, self.seriesparent.timecol, 0, starttime)
-        stopIndex = getSliceParam(ds, self.seriesparent.timecol, 1, stoptime)
+        startIndex, stopIndex = self.getTimeIndex().getSlice(starttime, stoptime)
 
-        # Assemble the output data
-        nones = [None] * (stopIndex - startIndex)
-        # data = [list(i) for i in zip(self.rawTimeOffsets[startIndex:stopIndex], nones, nones, self.rawValues[startIndex:stopIndex])]
-        ds_slice = ds[startIndex:stopIndex]
-        return [list(i) for i in zip(ds_slice[self.seriesparent.timecol].values.astype(np.float64), nones, nones, ds_slice[self.seriesparent.valcol].values.astype(np.float64))]
+        values = getColumns(ds, [self.seriesparent.valcol], startIndex, stopIndex)[self.seriesparent.valcol]
+        nonNaN = values[~np.isnan(values)]
+
+        return getStatisticsFromAggregates(
+            nonNaN.shape[0],
+            nonNaN.sum(),
+            np.dot(nonNaN, nonNaN),
+            values[0] if values.shape[0] > 0 else None,
+            values[-1] if values.shape[0] > 0 else None,
+            stoptime - starttime,
+        )
+
+    # Yields the raw data as consecutive (times, values) chunks of float64 NumPy
+    # arrays of at most rowsPerChunk data points each. Only the time & value
+    # columns are read from the file, so memory usage is bounded by the chunk
+    # size regardless of the length of the series. If timesOnly is set, only
+    # the times are yielded. If start is provided, the chunks begin at that
+    # data point.
+    def getChunks(self, rowsPerChunk, timesOnly=False, start=0):
+
+        timecol = self.seriesparent.timecol
+        valcol = self.seriesparent.valcol
+
+        for chunk in getColumnChunks(self.getDatasetReference(), [timecol] if timesOnly else [timecol, valcol], rowsPerChunk, start):
+            if timesOnly:
+                yield chunk[timecol]
+            else:
+                yield chunk[timecol], chunk[valcol]
+
+    # Returns the time index of the raw data (see TimeIndex), which is loaded
+    # from the processed file if stored there when the series was downsampled,
+    # or else built when first needed. Either way, it is kept in memory until
+    # data is appended to the series.
+    def getTimeIndex(self):
+
+        if self.timeIndex is not None and self.timeIndex.isCurrent():
+            return self.timeIndex
+
+        ds = self.getDatasetReference().hdf
+        timecol = self.seriesparent.timecol
+
+        try:
+            stored = self.seriesparent.fileparent.pf.hdf.get('/'.join(self.seriesparent.h5pathDownsample) + '/' + TIME_INDEX_NAME)
+        except (IOError, RuntimeError):
+            stored = None
+
+        self.timeIndex = loadTimeIndex(stored, ds, timecol) or TimeIndex(ds, timecol)
+
+        return self.timeIndex
 
     def getDatasetReference(self, loading=False):
         
         return self.seriesparent.fileparent.f['/'.join(self.seriesparent.h5path)]
+
+# Returns the raw data of the given series (RawData objects), which must all be
+# columns of the same dataset with the same time column, for the given time
+# range as a 2D float64 array of times followed by the values of each series.
+# The rows of the range are located & read once for all of the series. Expects
+# starttime & stoptime to be time offsets floats in seconds.
+def readRangedData(rawDatas, starttime, stoptime):
+
+    # Grab a reference to the dataset
+    first = rawDatas[0]
+    ds = first.getDatasetReference()
+
+    columns = [first.seriesparent.timecol] + [rd.seriesparent.valcol for rd in rawDatas]
+
+    # Read the data through the tile cache, in tiles of about TILE_ROWS data
+    # points (see getTiledRange), finding the rows of a tile based on its start
+    # & stop times.
+    index = first.getTimeIndex()
+    def loadRange(a, b):
+        return readColumns(ds, columns, index.searchsorted(a), index.searchsorted(b))
+
+    path = str(first.seriesparent.fileparent.origFilePathObj)
+    key = (path, getFileVersion(path), ds.hdf.name, ds.hdf.shape[0], *columns)
+    tileWidth = TILE_ROWS * first.timespan / first.len if first.len > 1 else 0
+
+    return getTiledRange(key, tileWidth, starttime, stoptime, loadRange)
+
+# Returns the min & max value of the data points in rows start to stop of an
+# audata dataset, by each of numIntervals equal intervals spanning starttime to
+# stoptime, as columns of interval times, mins & maxes (see
+# Series.makeOutput). Intervals without data points are omitted. columns are
+# the names of the time & value columns. The rows are read PREVIEW_CHUNK_ROWS
+# at a time, or if there are more than PREVIEW_MAX_ROWS of them, only the blocks
+# of rows sampled by getPreviewBlocks are read.
+def decimateMinMax(ds, columns, start, stop, starttime, stoptime, numIntervals):
+
+    width = (stoptime - starttime) / numIntervals if stoptime > starttime else 1
+    mins = np.full(numIntervals, np.nan)
+    maxs = np.full(numIntervals, np.nan)
+    present = np.zeros(numIntervals, dtype=bool)
+
+    for blockStart, blockStop in getPreviewBlocks(start, stop):
+
+        rows = readColumns(ds, columns, blockStart, blockStop)
+
+        # Intervals of the data points, which are sorted by time, and the first
+        # data point of each interval present in the chunk
+        intervals = np.clip(((rows[:, 0] - starttime) // width).astype(np.int64), 0, numIntervals - 1)
+        firsts = np.flatnonzero(np.r_[True, intervals[1:] != intervals[:-1]])
+        ids = intervals[firsts]
+
+        mins[ids] = np.fmin(mins[ids], np.fmin.reduceat(rows[:, 1], firsts))
+        maxs[ids] = np.fmax(maxs[ids], np.fmax.reduceat(rows[:, 1], firsts))
+        present[ids] = True
+
+    ids = np.flatnonzero(present)
+
+    return {'time': starttime + ids * width, 'min': mins[ids], 'max': maxs[ids]}
+
+# Returns the ranges of rows, as (start, stop) tuples, to read of rows start to
+# stop for a preview (see decimateMinMax): all of the rows in chunks of
+# PREVIEW_CHUNK_ROWS, or if there are more than PREVIEW_MAX_ROWS, blocks of
+# PREVIEW_BLOCK_ROWS rows spaced evenly from the first row to the last, which
+# total no more than PREVIEW_MAX_ROWS.
+def getPreviewBlocks(start, stop):
+
+    if stop - start <= PREVIEW_MAX_ROWS:
+        return [(chunkStart, min(stop, chunkStart + PREVIEW_CHUNK_ROWS)) for chunkStart in range(start, stop, PREVIEW_CHUNK_ROWS)]
+
+    numBlocks = PREVIEW_MAX_ROWS // PREVIEW_BLOCK_ROWS
+    blockStarts = start + np.arange(numBlocks) * (stop - start - PREVIEW_BLOCK_ROWS) // max(1, numBlocks - 1)
+    return [(int(blockStart), int(blockStart) + PREVIEW_BLOCK_ROWS) for blockStart in blockStarts]
+
+# Returns the given columns of an audata dataset as a dict of float64 NumPy
+# arrays keyed by column name. Only the requested columns are read from the
+# file, and the read bypasses DataFrame construction.
+def getColumns(ds, columns, start=None, stop=None):
+    rec = ds.hdf.fields(columns)[start:stop]
+    return {c: rec[c].astype(np.float64) for c in columns}
+
+# Returns rows start to stop of the given columns of an audata dataset as a 2D
+# float64 NumPy array with one column per requested column. This is the hot
+# path for ranged reads: only the requested fields are read, in their stored
+# types, straight from the underlying HDF5 dataset into a preallocated buffer,
+# and then copied into the output, so that no DataFrame is built.
+def readColumns(ds, columns, start=None, stop=None):
+
+    start, stop, _ = slice(start, stop).indices(ds.hdf.shape[0])
+    out = np.empty((max(0, stop - start), len(columns)), dtype=np.float64)
+    if out.shape[0] == 0:
+        return out
+
+    rec = np.empty(out.shape[0], dtype=[(c, ds.hdf.dtype[c]) for c in columns])
+    ds.hdf.read_direct(rec, np.s_[start:stop])
+    for i, c in enumerate(columns):
+        out[:, i] = rec[c]
+
+    return out
+
+# Yields consecutive chunks of at most rowsPerChunk rows of the given columns of
+# an audata dataset (see getColumns), beginning at row start.
+def getColumnChunks(ds, columns, rowsPerChunk, start=0):
+    for chunkStart in range(start, ds.nrow, rowsPerChunk):
+        yield getColumns(ds, columns, chunkStart, chunkStart + rowsPerChunk)
@@ -0,0 +1,317 @@
+"""Priority-aware scheduling of downsample jobs."""
+
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import heapq
+import itertools
+import logging
+import multiprocessing as mp
+import threading
+import traceback
+
+import psutil
+
+from .config import config
+
+# Job priorities, from most to least urgent. Lower values are run first, and
+# jobs of equal priority are run in the order they were submitted.
+PRIORITY_REQUESTED = 0
+PRIORITY_ASSIGNED = 1
+PRIORITY_DEFAULT = 2
+
+# In a worker process, holds the queue through which progress events are sent
+# to the scheduler, the key of the job being run, and the memory limit of each
+# job in megabytes (or None)
+workerEvents = None
+workerJobKey = None
+workerJobMemoryLimit = None
+
+# Returns the number of downsample jobs to run concurrently, per the
+# downsampleConcurrency config setting (or half the CPU count if it is None).
+def getConcurrency():
+    if config['downsampleConcurrency'] is not None:
+        return max(1, config['downsampleConcurrency'])
+    return max(1, mp.cpu_count() // 2)
+
+# Initializes a downsample worker process, which sends progress events to the
+# scheduler through the events queue, limiting the memory used by each job the
+# worker runs to jobMemoryLimit megabytes (if not None). Memory is capped by
+# bounding the memory budget for downsampling series and, where the platform
+# supports it, the data segment size of the worker process as each job starts
+# (see limitJobMemory), so that a job exceeding its limit fails with a
+# MemoryError rather than exhausting memory.
+def initializeWorker(jobMemoryLimit, events):
+
+    global workerEvents, workerJobMemoryLimit
+    workerEvents = events
+    workerJobMemoryLimit = jobMemoryLimit
+
+    if jobMemoryLimit is None:
+        return
+
+    # Each downsample thread may use up to the memory budget
+    threads = max(1, config['downsampleThreads'])
+    config['downsampleMemoryBudget'] = max(1, min(config['downsampleMemoryBudget'], jobMemoryLimit // threads))
+
+# Limits the data segment size of this worker process to its current size plus
+# the job memory limit, so that memory kept by the jobs run before (e.g. as the
+# heap is fragmented) does not count against the job about to run. Returns the
+# previous limits, to be restored once the job has finished, or None if no limit
+# was set.
+def limitJobMemory():
+
+    if workerJobMemoryLimit is None:
+        return None
+
+    try:
+        import resource
+        limits = resource.getrlimit(resource.RLIMIT_DATA)
+        limit = psutil.Process().memory_info().data + workerJobMemoryLimit * 1024 * 1024
+        if limits[1] != resource.RLIM_INFINITY:
+            limit = min(limit, limits[1])
+        resource.setrlimit(resource.RLIMIT_DATA, (limit, limits[1]))
+        return limits
+    except (ImportError, AttributeError, ValueError, OSError) as e:
+        logging.warning(f"Unable to enforce the downsample job memory limit in this process: {e}")
+        return None
+
+# Runs fn(*args) as the job with the given key in a worker process, within the
+# job memory limit
+def runJob(key, fn, args):
+    global workerJobKey
+    workerJobKey = key
+    limits = limitJobMemory()
+    try:
+        return fn(*args)
+    finally:
+        workerJobKey = None
+        if limits is not None:
+            import resource
+            resource.setrlimit(resource.RLIMIT_DATA, limits)
+
+# Reports that the downsamples of the given series, out of numSeries series in
+# the file, have been completed by the job running in this worker process. Does
+# nothing outside of a worker process.
+def reportSeriesComplete(seriesIDs, numSeries):
+    if workerEvents is not None and workerJobKey is not None:
+        workerEvents.put((workerJobKey, 'series', {'series': seriesIDs, 'numSeries': numSeries}))
+
+# Reports that the job running in this worker process has restarted from
+# scratch (e.g. because it could not be resumed), so that the series it reported
+# completed before no longer are. Does nothing outside of a worker process.
+def reportJobRestarted():
+    if workerEvents is not None and workerJobKey is not None:
+        workerEvents.put((workerJobKey, 'restarted', None))
+
+class DownsampleScheduler:
+    """
+    Runs downsample jobs in a pool of worker processes, in order of priority. Each job is identified by a key (e.g.
+    the path of the file it downsamples), and a queued job may be moved ahead by raising its priority, such as when a
+    user opens its file. Jobs are only handed to the pool when a worker is free, so that priorities apply to every job
+    that has not yet started.
+
+    If provided, onEvent is called in the scheduler's listener thread as onEvent(key, event, data) when a job is
+    'started', reports completed 'series' (see reportSeriesComplete), has 'restarted' from scratch (see
+    reportJobRestarted), is 'completed', or has 'failed' (in which case data holds the error message).
+
+    If a worker process dies abruptly (e.g. killed for running out of memory), the pool is replaced, failing the jobs
+    that were running in it. Queued jobs are run in the new pool.
+    """
+
+    def __init__(self, concurrency=None, jobMemoryLimit=None, onEvent=None):
+
+        # Number of jobs to run concurrently
+        self.concurrency = getConcurrency() if concurrency is None else concurrency
+
+        # Job events, sent by the workers & the scheduler itself
+        self.onEvent = onEvent
+        context = mp.get_context()
+        self.events = context.Queue()
+
+        # Pool of worker processes, replaced if it breaks (see replaceExecutor)
+        self.context = context
+        self.jobMemoryLimit = jobMemoryLimit
+        self.executor = self.newExecutor()
+
+        # Guards the queue & job bookkeeping, and signals the dispatcher
+        self.condition = threading.Condition()
+
+        # Heap of (priority, sequence number, key) entries for queued jobs.
+        # Entries superseded by a priority change are skipped when popped.
+        self.queue = []
+        self.sequence = itertools.count()
+
+        # Queued jobs, mapped from key to [priority, fn, args], and running
+        # jobs, mapped from key to future
+        self.queued = {}
+        self.running = {}
+
+        self.shuttingDown = False
+
+        # Hands queued jobs to the pool as workers free up
+        self.dispatcher = threading.Thread(target=self.dispatch, name='downsample-scheduler', daemon=True)
+        self.dispatcher.start()
+
+        # Passes job events to onEvent in the order they are received
+        self.listener = threading.Thread(target=self.listen, name='downsample-scheduler-events', daemon=True)
+        self.listener.start()
+
+    def submit(self, key, fn, args=(), priority=PRIORITY_DEFAULT):
+        """
+        Queues fn(*args) to run with the given priority. If a job with the same key is already queued, it is kept and
+        its priority raised if necessary. If one is already running, the job is not queued.
+        :return: True if the job was queued, False otherwise
+        """
+
+        with self.condition:
+
+            if key in self.running:
+                logging.info(f"Downsample job {key} is already running.")
+                return False
+
+            if key in self.queued:
+                self.prioritize(key, priority)
+                return False
+
+            self.queued[key] = [priority, fn, args]
+            heapq.heappush(self.queue, (priority, next(self.sequence), key))
+            self.condition.notify()
+
+        return True
+
+    def prioritize(self, key, priority=PRIORITY_REQUESTED):
+        """
+        Raises the priority of the queued job with the given key to priority, if it is more urgent than its current
+        priority.
+        :return: True if the job is queued, False otherwise
+        """
+
+        with self.condition:
+
+            job = self.queued.get(key)
+            if job is None:
+                return False
+
+            if priority < job[0]:
+                logging.info(f"Raising priority of downsample job {key} to {priority}.")
+                job[0] = priority
+                heapq.heappush(self.queue, (priority, next(self.sequence), key))
+                self.condition.notify()
+
+        return True
+
+    def isScheduled(self, key):
+        """Returns whether the job with the given key is queued or running."""
+        with self.condition:
+            return key in self.queued or key in self.running
+
+    def shutdown(self, wait=True):
+        """Stops dispatching queued jobs and shuts down the pool, waiting for running jobs to finish if wait is set."""
+        with self.condition:
+            self.shuttingDown = True
+            self.queued.clear()
+            self.queue.clear()
+            self.condition.notify()
+            executor = self.executor
+        executor.shutdown(wait=wait)
+        self.events.put(None)
+
+    # Returns a new pool of worker processes
+    def newExecutor(self):
+        return ProcessPoolExecutor(max_workers=self.concurrency, mp_context=self.context, initializer=initializeWorker, initargs=(self.jobMemoryLimit, self.events))
+
+    # Replaces the given pool with a new one, if it is still in use, after it
+    # has broken (i.e. a worker process has died abruptly). Expects the
+    # condition to be held.
+    def replaceExecutor(self, executor):
+        if executor is not self.executor or self.shuttingDown:
+            return
+        logging.warning("A downsample worker process died abruptly. Replacing the pool of worker processes.")
+        self.executor = self.newExecutor()
+        executor.shutdown(wait=False)
+
+    # Runs in the dispatcher thread, handing the most urgent queued job to the
+    # pool each time a worker is free.
+    def dispatch(self):
+
+        while True:
+
+            with self.condition:
+
+                while not self.shuttingDown and (len(self.queued) == 0 or len(self.running) >= self.concurrency):
+                    self.condition.wait()
+
+                if self.shuttingDown:
+                    return
+
+                # Pop the most urgent entry that has not been superseded
+                priority, _, key = heapq.heappop(self.queue)
+                job = self.queued.get(key)
+                if job is None or job[0] != priority:
+                    continue
+                del self.queued[key]
+
+                _, fn, args = job
+                logging.info(f"Starting downsample job {key} (priority {priority}).")
+                self.events.put((key, 'started', None))
+                try:
+                    future, executor = self.submitJob(key, fn, args)
+                except RuntimeError as e:
+                    logging.error(f"Unable to start downsample job {key}.\n{e}\n{traceback.format_exc()}")
+                    self.events.put((key, 'failed', f"{type(e).__name__}: {e}"))
+                    continue
+                self.running[key] = future
+
+            future.add_done_callback(lambda f, key=key, executor=executor: self.finished(key, f, executor))
+
+    # Hands the job with the given key to the pool, replacing the pool first if
+    # it has broken since the last job finished. Returns the job's future and
+    # the pool it was handed to. Expects the condition to be held.
+    def submitJob(self, key, fn, args):
+        executor = self.executor
+        try:
+            return executor.submit(runJob, key, fn, args), executor
+        except BrokenProcessPool:
+            self.replaceExecutor(executor)
+        executor = self.executor
+        return executor.submit(runJob, key, fn, args), executor
+
+    # Called when the job with the given key, run in the given pool, has
+    # finished
+    def finished(self, key, future, executor):
+
+        with self.condition:
+            if not future.cancelled() and isinstance(future.exception(), BrokenProcessPool):
+                self.replaceExecutor(executor)
+            self.running.pop(key, None)
+            self.condition.notify()
+
+        if future.cancelled():
+            logging.info(f"Downsample job {key} was cancelled.")
+            self.events.put((key, 'failed', 'Cancelled'))
+        elif future.exception() is not None:
+            e = future.exception()
+            logging.error(f"Downsample job {key} failed.\n{e}\n{''.join(traceback.format_exception(type(e), e, e.__traceback__))}")
+            self.events.put((key, 'failed', f"{type(e).__name__}: {e}"))
+        else:
+            logging.info(f"Finished downsample job {key}.")
+            self.events.put((key, 'completed', None))
+
+    # Runs in the listener thread, passing job events to onEvent until the
+    # scheduler is shut down
+    def listen(self):
+
+        while True:
+
+            item = self.events.get()
+            if item is None:
+                return
+
+            if self.onEvent is None:
+                continue
+
+            key, event, data = item
+            try:
+                self.onEvent(key, event, data)
+            except Exception as e:
+                logging.error(f"There was an exception while handling the {event} event of downsample job {key}.\n{e}\n{traceback.format_exc()}")
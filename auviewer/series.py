@@ -6,11 +6,12 @@ import logging
 import numpy as np
 import pandas as pd
 import time
+import traceback
 import psutil
 
 from .config import config
-from .rawdata import RawData
-from .downsampleset import DownsampleSet
+from .rawdata import RawData, getColumnChunks, getColumns
+from .downsampleset import DOWNSAMPLE_MODES, DownsampleSet, fitsInMemoryBudget, getRowsPerChunk
 
 from .cylib import generateThresholdAlerts
 
@@ -112,35 +113,61 @@ class Series:
         """
         return self.fileparent.f['/'.join(self.h5path)].get(datetimes=True)[[self.timecol, self.valcol]].rename(columns={self.timecol: 'time', self.valcol: 'value'})
 
-    # Produces JSON output for the series at the maximum time range.
-    def getFullOutput(self):
+    # Returns the mode in which the series is output when downsampled (see
+    # DOWNSAMPLE_MODES), per the project template or config (see
+    # Project.getSeriesDownsampleMode).
+    def getDownsampleMode(self):
+        projparent = self.fileparent.projparent
+        mode = projparent.getSeriesDownsampleMode(self.id) if projparent is not None else config['downsampleMode']
+        if mode not in DOWNSAMPLE_MODES:
+            logging.warning(f"Invalid downsample mode {mode} for series {self.id}. Using minmax.")
+            mode = 'minmax'
+        return mode
+
+    # Produces JSON output for the series at the maximum time range. If
+    # maxPoints is provided (see getPointBudget), the downsample (or raw data)
+    # is chosen to meet it rather than M intervals. If columnar is set, the
+    # output holds the data as float64 NumPy arrays (see getColumnarData) rather
+    # than JSON-ready rows, e.g. for a binary response (see wireformat.py).
+    def getFullOutput(self, maxPoints=None, columnar=False):
 
         logging.info("Assembling full output for " + self.id + ".")
 
         if self.fileparent.mode() == 'realtime':
 
             with self.dequeLock:
-                nones = [None] * len(self.rawTimes)
-                data = [list(i) for i in zip(self.rawTimes, nones, nones, self.rawValues)]
+                columns = {'time': np.array(self.rawTimes, dtype=np.float64), 'value': np.array(self.rawValues, dtype=np.float64)}
             output_type = 'real'
 
+        elif self.isPreviewed(self.rd.timespan, maxPoints):
+
+            # The series has yet to be downsampled, so preview the raw data
+            columns, output_type = self.rd.getPreviewColumns(numIntervals=maxPoints)
+
         elif self.fileparent.mode() == 'file':
 
-            # Attempt to retrieve the full downsample output
-            downsampleFullOutput = self.dss.getFullOutput()
+            # Attempt to retrieve the full downsample output, as points of the
+            # M4 pyramid if requested & available
+            mode = self.getDownsampleMode()
+            points = self.dss.getFullPoints(mode, maxPoints) if mode != 'minmax' else None
+            downsampleFullOutput = self.dss.getFullOutput(maxPoints) if points is None else None
 
             # Set data either to the retrieved downsample or to the raw data
-            if downsampleFullOutput is not None:
+            if points is not None:
+
+                columns = {'time': points['0'].values, 'value': points['1'].values}
+                output_type = 'downsample'
+
+            elif downsampleFullOutput is not None:
 
-                data = downsampleFullOutput.to_records(index=False).tolist()
+                columns = {'time': downsampleFullOutput['0'].values, 'min': downsampleFullOutput['1'].values, 'max': downsampleFullOutput['2'].values}
                 output_type = 'downsample'
 
             else:
 
-                # Get reference to the series datastream from the HDF5 file
-                dataset = self.fileparent.f['/'.join(self.h5path)][()]
-                nones = [None] * self.rd.len
-                data = [list(i) for i in zip(dataset[self.timecol].values.astype(np.float64), nones, nones, dataset[self.valcol].values.astype(np.float64))]
+                # Read the series datastream from the HDF5 file
+                raw = getColumns(self.fileparent.f['/'.join(self.h5path)], [self.timecol, self.valcol])
+                columns = {'time': raw[self.timecol], 'value': raw[self.valcol]}
                 output_type = 'real'
 
         else:
@@ -151,17 +178,14 @@ class Series:
         logging.info(f"Completed assembly of full ({'downsampled' if output_type=='downsample' else 'raw'}) output for {self.id}.")
 
         # Return the JSON-ready output object
-        return {
-            "id": self.id,
-            "labels": ['Date/Offset', 'Min', 'Max', simpleSeriesName(self.id)],
-            "data": data,
-            "output_type": output_type,
-            "units": self.units
-        }
+        return self.makeOutput(columns, output_type, columnar)
 
     # Produces JSON output for the series over a specified time range, with
-    # starttime and stoptime being time offset floats in seconds.
-    def getRangedOutput(self, starttime, stoptime):
+    # starttime and stoptime being time offset floats in seconds. If maxPoints
+    # is provided (see getPointBudget), the downsample (or raw data) is chosen
+    # to meet it rather than M intervals. If columnar is set, the output holds
+    # the data as arrays (see getFullOutput).
+    def getRangedOutput(self, starttime, stoptime, maxPoints=None, columnar=False):
 
         logging.info(f"Assembling ranged output for {self.id}.")
 
@@ -169,25 +193,96 @@ class Series:
         if self.fileparent.mode() == 'realtime':
             raise Exception('series.getRangedOutput() is not available in realtime-mode.')
 
-        # Get the appropriate downsample for this time range
-        ds = self.dss.getRangedOutput(starttime, stoptime)
-        if isinstance(ds, pd.DataFrame):
-            data = ds.to_records(index=False).tolist()
+        # If the series has yet to be downsampled (at least to the level the
+        # range calls for), preview the raw data
+        if self.isPreviewed(stoptime - starttime, maxPoints):
+            columns, output_type = self.rd.getPreviewColumns(starttime, stoptime, maxPoints)
+            return self.makeOutput(columns, output_type, columnar)
+
+        # Get the appropriate downsample for this time range, as points of the
+        # M4 pyramid if requested & available
+        mode = self.getDownsampleMode()
+        points = self.dss.getRangedPoints(starttime, stoptime, mode, maxPoints) if mode != 'minmax' else None
+        ds = self.dss.getRangedOutput(starttime, stoptime, maxPoints) if points is None else None
+        if points is not None:
+            columns = {'time': points['0'].values, 'value': points['1'].values}
+            output_type = 'downsample'
+        elif isinstance(ds, pd.DataFrame):
+            columns = {'time': ds['0'].values, 'min': ds['1'].values, 'max': ds['2'].values}
             output_type = 'downsample'
-
-        
-        # if (not isinstance(ds, pd.DataFrame) or pd.DataFrame.empty):
         else:
-            data = self.rd.getRangedOutput(starttime, stoptime)
+            rows = self.rd.getRangedData(starttime, stoptime)
+            columns = {'time': rows[:, 0], 'value': rows[:, 1]}
             output_type = 'real'
-        # print(data)
+
         logging.info(f"Completed assembly of ranged ({'downsampled' if output_type=='downsample' else 'raw'}) output for {self.id}.")
 
         # Return the JSON-ready output object
-        return {
+        return self.makeOutput(columns, output_type, columnar)
+
+    # Returns whether the ranged output of the series for the given time range
+    # (see getRangedOutput) is of raw data rather than a downsample.
+    def isRangedOutputRaw(self, starttime, stoptime, maxPoints=None):
+        if self.isPreviewed(stoptime - starttime, maxPoints):
+            return False
+        return self.dss.numDownsamples < 1 or self.dss.whichDownsampleIndexForTimespan(stoptime - starttime, maxPoints) == -1
+
+    # Returns whether the output of the series for a view of the given timespan
+    # is previewed from the raw data (see RawData.getPreviewColumns): while the
+    # file has yet to be downsampled (see File.isPreview), or while it is served
+    # from its overview (see File.isProgressive) and the view calls for a finer
+    # level than the overview holds for the series, if any.
+    def isPreviewed(self, timespan, maxPoints=None):
+        if self.fileparent.isPreview():
+            return True
+        if not self.fileparent.isProgressive():
+            return False
+        return self.dss.numDownsamples < 1 or self.dss.whichDownsampleIndexForTimespan(timespan, maxPoints) == -1
+
+    # Returns the output object for the series (see getFullOutput) holding the
+    # given data columns, either as is if columnar is set, or as JSON-ready rows
+    # (see columnsToRows).
+    def makeOutput(self, columns, output_type, columnar=False):
+
+        output = {
             "id": self.id,
             "labels": ['Date/Offset', 'Min', 'Max', simpleSeriesName(self.id)],
-            "data": data,
+            "output_type": output_type,
+            "units": self.units
+        }
+
+        if columnar:
+            output["columns"] = columns
+        else:
+            output["data"] = columnsToRows(columns)
+
+        return output
+
+    # Produces JSON output of statistics for the series over a specified time
+    # range, with starttime and stoptime being time offset floats in seconds.
+    # The statistics are computed from the aggregates of a downsample where
+    # appropriate, and otherwise from the raw data.
+    def getStatistics(self, starttime, stoptime):
+
+        logging.info(f"Assembling statistics for {self.id}.")
+
+        # Getting statistics is not supported in realtime-mode.
+        if self.fileparent.mode() == 'realtime':
+            raise Exception('series.getStatistics() is not available in realtime-mode.')
+
+        statistics = self.dss.getRangeStatistics(starttime, stoptime)
+        if statistics is not None:
+            output_type = 'downsample'
+        else:
+            statistics = self.rd.getRangeStatistics(starttime, stoptime)
+            output_type = 'real'
+
+        logging.info(f"Completed assembly of ({'downsampled' if output_type=='downsample' else 'raw'}) statistics for {self.id}.")
+
+        # Return the JSON-ready output object
+        return {
+            "id": self.id,
+            "statistics": statistics,
             "output_type": output_type,
             "units": self.units
         }
@@ -202,24 +297,50 @@ class Series:
 
         logging.info(f"MEM PRE-PULLD: {p.memory_full_info().uss / 1024 / 1024} MB")
 
-        # Pull raw data for the series into memory
-        self.pullRawDataIntoMemory()
+        # If the raw data would not fit within the memory budget, build & store
+        # the downsamples by streaming the raw data from the file in chunks.
+        if not self.dss.rawDataFitsInMemoryBudget():
+
+            self.dss.processAndStoreStreaming()
 
-        logging.info(f"MEM AFT-PULLD: {p.memory_full_info().uss/1024/1024} MB")
+            logging.info(f"MEM AFT-DSPRC: {p.memory_full_info().uss / 1024 / 1024} MB")
 
-        # Build & store to file all downsamples for the series
-        self.dss.processAndStore()
+        else:
 
-        logging.info(f"MEM AFT-DSPRC: {p.memory_full_info().uss / 1024 / 1024} MB")
+            # Pull raw data for the series into memory
+            self.pullRawDataIntoMemory()
 
-        # Remove raw data for the series fromm memory
-        self.initializeRawDataInMemory()
+            logging.info(f"MEM AFT-PULLD: {p.memory_full_info().uss/1024/1024} MB")
+
+            # Build & store to file all downsamples for the series
+            self.dss.processAndStore()
 
-        logging.info(f"MEM AFT-REMVD: {p.memory_full_info().uss / 1024 / 1024} MB")
+            logging.info(f"MEM AFT-DSPRC: {p.memory_full_info().uss / 1024 / 1024} MB")
+
+            # Remove raw data for the series fromm memory
+            self.initializeRawDataInMemory()
+
+            logging.info(f"MEM AFT-REMVD: {p.memory_full_info().uss / 1024 / 1024} MB")
 
         end = time.time()
         logging.info(f"Completed processing & storing all downsamples for the series {self.id}. Took {round((end - start) / 60, 3)} minutes.")
 
+    # Extends the stored downsamples for the series with any data appended to
+    # the original file since they were built (see
+    # DownsampleSet.processAndStoreAppended). If they cannot be extended, or
+    # extending them fails part way, they are rebuilt instead.
+    def processAndStoreAppended(self):
+
+        try:
+            if self.dss.processAndStoreAppended():
+                return
+        except Exception as e:
+            logging.error(f"Unable to extend the downsamples for the series {self.id}.\n{e}\n{traceback.format_exc()}")
+
+        logging.info(f"Rebuilding all downsamples for the series {self.id}.")
+        self.dss.deleteStored()
+        self.processAndStore()
+
     def pullRawDataIntoMemory(self, returnValuesOnly=False):
         """
         Pulls the raw data for the series from the file into memory (self.rawTimeOffsets and self.rawValues).
@@ -235,11 +356,11 @@ class Series:
             logging.info("Reading raw series n/a since we're in mem mode. Returning.")
             return
 
-        # Get reference to the series datastream from the HDF5 file
-        dataset = self.fileparent.f['/'.join(self.h5path)][()]
+        # Read only the time & value columns from the HDF5 file
+        columns = getColumns(self.rd.getDatasetReference(), [self.timecol, self.valcol])
 
-        rawTimes = dataset[self.timecol].values.astype(np.float64)
-        rawValues = dataset[self.valcol].values.astype(np.float64)
+        rawTimes = columns[self.timecol]
+        rawValues = columns[self.valcol]
 
         # Return the values if requested, otherwise attach them to the class instance.
         if returnValuesOnly:
@@ -261,9 +382,121 @@ class Series:
         self.rawTimes = deque(maxlen=config['M'])
         self.rawValues = deque(maxlen=config['M'])
 
+def processAndStoreSeriesGroup(seriesGroup):
+    """
+    Process and store all downsamples for a group of series which belong to the
+    same dataset (and therefore share the same time column). The dataset is read
+    once, projecting only the time column and the value columns of the series,
+    and the downsamples of all series are built from that one read.
+    """
+
+    # A single series needs no coordination with its siblings
+    if len(seriesGroup) == 1:
+        seriesGroup[0].processAndStore()
+        return
+
+    p = psutil.Process()
+
+    first = seriesGroup[0]
+    ds = first.rd.getDatasetReference()
+    columns = [first.timecol] + [s.valcol for s in seriesGroup]
+
+    logging.info(f"Processing & storing all downsamples for the {len(seriesGroup)} series of dataset {ds.name}")
+    start = time.time()
+
+    logging.info(f"MEM PRE-PULLD: {p.memory_full_info().uss / 1024 / 1024} MB")
+
+    if fitsInMemoryBudget(first.rd.len, len(seriesGroup)):
+
+        # Pull the raw data for all series into memory at once. The series
+        # share the time array.
+        data = getColumns(ds, columns)
+
+        logging.info(f"MEM AFT-PULLD: {p.memory_full_info().uss / 1024 / 1024} MB")
+
+        for s in seriesGroup:
+
+            logging.info(f"Processing & storing all downsamples for the series {s.id}")
+
+            s.rawTimes = data[first.timecol]
+            s.rawValues = data[s.valcol]
+
+            # Build & store to file all downsamples for the series
+            s.dss.processAndStore()
+
+            # Remove raw data for the series from memory
+            s.initializeRawDataInMemory()
+
+        del data
+
+    else:
+
+        # Since the series share the same times, the number of downsamples to
+        # build is the same for all of them.
+        rowsPerChunk = getRowsPerChunk(len(seriesGroup))
+        ndtb, firstOffset, lastOffset = first.dss.numDownsamplesToBuildStreaming(rowsPerChunk)
+
+        if ndtb > 0:
+
+            # Stream the raw data for all series at once
+            for s in seriesGroup:
+                s.dss.beginStreaming(ndtb, firstOffset, lastOffset)
+            for chunk in getColumnChunks(ds, columns, rowsPerChunk):
+                for s in seriesGroup:
+                    s.dss.streamChunk(chunk[first.timecol], chunk[s.valcol])
+            for s in seriesGroup:
+                s.dss.finishStreaming()
+
+    logging.info(f"MEM AFT-DSPRC: {p.memory_full_info().uss / 1024 / 1024} MB")
+
+    end = time.time()
+    logging.info(f"Completed processing & storing all downsamples for the series of dataset {ds.name}. Took {round((end - start) / 60, 3)} minutes.")
+
+def processAndStoreOverviewGroup(seriesGroup, hdf):
+    """
+    Build the overview (the coarsest downsample levels, see
+    DownsampleSet.getNumOverviewLevels) of a group of series which belong to the
+    same dataset, and store it to the given HDF5 file. As with
+    processAndStoreSeriesGroup, the dataset is read once for all of the series,
+    in chunks sized to the configured memory budget.
+    """
+
+    first = seriesGroup[0]
+    ds = first.rd.getDatasetReference()
+    columns = [first.timecol] + [s.valcol for s in seriesGroup]
+
+    logging.info(f"Building the overview of the {len(seriesGroup)} series of dataset {ds.name}")
+    start = time.time()
+
+    building = False
+    for chunk in getColumnChunks(ds, columns, getRowsPerChunk(len(seriesGroup))):
+        times = chunk[first.timecol]
+        if not building:
+            for s in seriesGroup:
+                s.dss.beginOverview(times[0])
+            building = True
+        for s in seriesGroup:
+            s.dss.overviewChunk(times, chunk[s.valcol])
+
+    if building:
+        for s in seriesGroup:
+            s.dss.finishOverview(hdf)
+
+    end = time.time()
+    logging.info(f"Completed the overview of the series of dataset {ds.name}. Took {round(end - start, 5)}s.")
+
 def simpleSeriesName(s):
     simpleNameComponents = s.split('/')[-1].split(':')
     if simpleNameComponents[1] == 'value':
         return simpleNameComponents[0]
     else:
         return ':'.join(simpleNameComponents)
+
+# Returns JSON-ready rows of series data columns (see Series.getFullOutput):
+# [time, min, max] for downsample intervals, or [time, None, None, value] for
+# data points.
+def columnsToRows(columns):
+    if 'min' in columns:
+        return [list(i) for i in zip(columns['time'].tolist(), columns['min'].tolist(), columns['max'].tolist())]
+    nones = [None] * columns['time'].shape[0]
+    return [list(i) for i in zip(columns['time'].tolist(), nones, nones, columns['value'].tolist())]
@@ -19,11 +19,16 @@ import json
 import simplejson
 
 from . import models
-from .api import downsampleFile, getProject, getProjectsPayload, loadProjects
+from .api import downsampleFile, getDownsampleStatus, getProject, getProjectsPayload, getTileCacheStatus, loadProjects, prioritizeDownsample
 from .patternset import getAssignmentsPayload
+from .prefetch import prefetchAdjacentRanges, prefetcher
+from .coalesce import rangedRequestGenerations
 from .config import set_data_path, config, FlaskConfigClass
+from .downsampleset import getPointBudget
+from .compression import streamResponseBody
+from .wireformat import getMimetype, iterPayload, negotiateFormat
 
-from .flask_user import current_user, login_required, UserManager, SQLAlchemyAdapter
+from .flask_user import current_user, login_required, roles_required, UserManager, SQLAlchemyAdapter
 from .flask_user.signals import user_sent_invitation, user_registered
 
 
@@ -494,6 +499,12 @@ def createApp():
 
             # TODO: Might make label side configurable
 
+            # Featurizers are applied to the raw data of each window rather
+            # than to the aggregates of the downsamples (see
+            # Series.getStatistics), as these are taken over whole intervals
+            # (so a window's statistics would be off by up to an interval at
+            # either end), skip NaN values regardless of the skipna parameter,
+            # and cannot serve featurizers other than counts, means & variances.
             featurization = df.resample(window_size, label='right').agg(featurizerFunction).replace(np.inf, np.nan).replace(-np.inf, np.nan).dropna().reset_index()
             print(featurization)
 
@@ -536,6 +547,32 @@ def createApp():
                 mimetype='application/json',
             )
 
+    # The downsample status covers the files of all projects, so it is only
+    # available to admins
+    @app.route(config['rootWebPath']+'/downsample_status')
+    @roles_required('admin')
+    def downsample_status():
+
+        # Output response
+        return app.response_class(
+            response=simplejson.dumps(getDownsampleStatus(), ignore_nan=True),
+            status=200,
+            mimetype='application/json'
+        )
+
+    # The tile cache status covers the files of all projects, so it is only
+    # available to admins
+    @app.route(config['rootWebPath']+'/tile_cache_status')
+    @roles_required('admin')
+    def tile_cache_status():
+
+        # Output response
+        return app.response_class(
+            response=simplejson.dumps(getTileCacheStatus(), ignore_nan=True),
+            status=200,
+            mimetype='application/json'
+        )
+
     @app.route(config['rootWebPath']+'/get_project_annotations')
     @login_required
     def get_project_annotations():
@@ -566,12 +603,46 @@ def createApp():
     def index():
         return render_template('index.html', projects=getProjectsPayload(current_user.id), assignments=getAssignmentsPayload(current_user.id))
 
+    # Returns the format in which to respond to a series data request ('json',
+    # 'columnar' or 'binary', see wireformat.py), per the format parameter if
+    # provided, or else the Accept header. Clients which do not ask for a
+    # columnar format get the original JSON rows.
+    def getSeriesDataFormat():
+        return negotiateFormat(request.accept_mimetypes, request.args.get('format'))
+
+    # Returns the response for a series data payload in the given format (see
+    # getSeriesDataFormat). The payload should hold columns of series data
+    # unless the format is 'json'. Large responses are compressed per the
+    # Accept-Encoding header and streamed as they are encoded (see
+    # compression.py).
+    def seriesDataResponse(payload, dataFormat='json'):
+
+        body, encoding = streamResponseBody(iterPayload(payload, dataFormat), request.accept_encodings)
+
+        response = app.response_class(
+            response=body,
+            status=200,
+            mimetype=getMimetype(dataFormat)
+        )
+        response.vary.add('Accept-Encoding')
+        if encoding is not None:
+            response.headers['Content-Encoding'] = encoding
+
+        return response
+
+    # Returns the response to a request which has been superseded by a later one
+    # (see RequestGenerations)
+    def supersededResponse():
+        return app.response_class(status=204)
+
     @app.route(config['rootWebPath']+'/initial_file_payload')
     @login_required
     def initial_file_payload():
         # Parse parameters
         project_id = request.args.get('project_id', type=int)
         file_id = request.args.get('file_id', type=int)
+        maxPoints = getPointBudget(request.args.get('points', type=int), request.args.get('width', type=float))
+        dataFormat = getSeriesDataFormat()
 
         # Get the project
         project = getProject(project_id)
@@ -587,16 +658,17 @@ def createApp():
             abort(404, description="File not found.")
             return
 
+        # If the file is still waiting to be downsampled, move it to the front
+        # of the queue
+        prioritizeDownsample(file)
+
         # Assemble the initial file payload (full zoomed-out & downsampled, if
         # necessary, datasets for all data series.
-        initialFilePayload = file.getInitialPayload(current_user.id)
+        with prefetcher.foreground():
+            initialFilePayload = file.getInitialPayload(current_user.id, maxPoints, columnar=dataFormat != 'json')
 
         # Output response
-        return app.response_class(
-            response=simplejson.dumps(initialFilePayload, ignore_nan=True),
-            status=200,
-            mimetype='application/json'
-        )
+        return seriesDataResponse(initialFilePayload, dataFormat)
 
     # @app.route(config['rootWebPath']+'/initial_evaluator_payload')
     # @login_required
@@ -972,6 +1044,18 @@ def createApp():
         series = request.args.getlist('s[]')
         start = request.args.get('start', type=float)
         stop = request.args.get('stop', type=float)
+        maxPoints = getPointBudget(request.args.get('points', type=int), request.args.get('width', type=float))
+        dataFormat = getSeriesDataFormat()
+
+        # If the client provides a channel & generation, the request is dropped
+        # once superseded by a later one on the same channel (see
+        # RequestGenerations), in which case no content is returned.
+        channel = request.args.get('channel')
+        generation = request.args.get('gen', type=int)
+        if channel is not None and generation is not None:
+            channel = (current_user.id, project_id, file_id, channel)
+            if not rangedRequestGenerations.begin(channel, generation):
+                return supersededResponse()
 
         # Get the project
         project = getProject(project_id)
@@ -988,11 +1072,84 @@ def createApp():
             return
 
         # Assemble the series ranged data
-        seriesRangedData = file.getSeriesRangedOutput(series, start, stop)
+        with prefetcher.foreground():
+            seriesRangedData = file.getSeriesRangedOutput(series, start, stop, maxPoints, columnar=dataFormat != 'json')
+
+        # Skip encoding the response if the request has been superseded
+        if generation is not None and not rangedRequestGenerations.isCurrent(channel, generation):
+            return supersededResponse()
+
+        # Warm the tile cache with the ranges the user is likely to view next
+        prefetchAdjacentRanges(current_user.id, file, series, start, stop, maxPoints)
+
+        # Output response
+        return seriesDataResponse(seriesRangedData, dataFormat)
+
+    @app.route(config['rootWebPath']+'/events_ranged_data', methods=['GET'])
+    @login_required
+    def events_ranged_data():
+
+        # Parse parameters
+        project_id = request.args.get('project_id', type=int)
+        file_id = request.args.get('file_id', type=int)
+        start = request.args.get('start', type=float)
+        stop = request.args.get('stop', type=float)
+
+        # Get the project
+        project = getProject(project_id)
+        if project is None:
+            logging.error(f"Project ID {project_id} not found.")
+            abort(404, description="Project not found.")
+            return
+
+        # Get the file
+        file = project.getFile(file_id)
+        if file is None:
+            logging.error(f"File ID {file_id} not found.")
+            abort(404, description="File not found.")
+            return
+
+        # Assemble the events within the time range
+        events = file.getEvents(start, stop)
+
+        # Output response
+        return app.response_class(
+            response=simplejson.dumps({'events': events}, ignore_nan=True),
+            status=200,
+            mimetype='application/json'
+        )
+
+    @app.route(config['rootWebPath']+'/series_statistics', methods=['GET'])
+    @login_required
+    def series_statistics():
+
+        # Parse parameters
+        project_id = request.args.get('project_id', type=int)
+        file_id = request.args.get('file_id', type=int)
+        series = request.args.getlist('s[]')
+        start = request.args.get('start', type=float)
+        stop = request.args.get('stop', type=float)
+
+        # Get the project
+        project = getProject(project_id)
+        if project is None:
+            logging.error(f"Project ID {project_id} not found.")
+            abort(404, description="Project not found.")
+            return
+
+        # Get the file
+        file = project.getFile(file_id)
+        if file is None:
+            logging.error(f"File ID {file_id} not found.")
+            abort(404, description="File not found.")
+            return
+
+        # Assemble the series statistics
+        seriesStatistics = file.getSeriesStatistics(series, start, stop)
 
         # Output response
         return app.response_class(
-            response=simplejson.dumps(seriesRangedData, ignore_nan=True),
+            response=simplejson.dumps(seriesStatistics, ignore_nan=True),
             status=200,
             mimetype='application/json'
         )
@@ -38,16 +38,17 @@ def annotationDataFrame(annotationModels):
 # A second parameter, related, may be provided in which case the function will
 # output a representation for both items in a single list. For example, you may
 # provide an annotation and the pattern it annotates, or a pattern and the
-# annotation that annotates it.
+# annotation that annotates it. If filename is provided, it is output as the
+# name of the file of both items rather than loading their file.
 # TODO: Review whether both cases will be used.
-def annotationOrPatternOutput(primary, related=None):
+def annotationOrPatternOutput(primary, related=None, filename=None):
     output = []
     for a in [primary, related]:
         if a is not None:
             output = output + [
                 a.id,
                 a.file_id,
-                Path(a.file.path).name,
+                Path(a.file.path).name if filename is None else filename,
                 a.series,
                 a.left,
                 a.right,
@@ -62,6 +63,22 @@ def getProcFNFromOrigFN(fp):
     """Returns the processed filename (as Path object, which can be treated as string) from origina filename (as string or Path object)"""
     return Path(Path(fp).stem + '_processed.h5')
 
+def getStatisticsFromAggregates(count, total, sumOfSquares, first, last, timespan):
+    """
+    Returns a dict of statistics over a time range (count, mean, population variance, density in data points per second,
+    and first & last value) given aggregates of the values in the range: the count, sum & sum of squares of the
+    non-NaN values, the first & last value, and the timespan of the range in seconds.
+    """
+    mean = total / count if count > 0 else None
+    return {
+        'count': int(count),
+        'mean': mean,
+        'variance': max(sumOfSquares / count - mean * mean, 0) if count > 0 else None,
+        'density': count / timespan if timespan > 0 else None,
+        'first': first,
+        'last': last,
+    }
+
 def patternDataFrame(patternModels):
     """Given a list of pattern models, returns a DataFrame in our standard format."""
     return pd.DataFrame(
@@ -53,6 +53,16 @@ function File(parentProject, id, callback=null) {
 	// Holds the reference to the graph synchronization object
 	this.sync = null;
 
+	// Holds the timer of a pending (debounced) request for the data of the
+	// current view (see updateCurrentViewData)
+	this.updateViewDataTimer = null;
+
+	// Indicates whether the file's data is a preview, decimated from the raw
+	// data while the file is being downsampled, and holds the timer of the next
+	// refresh of the preview (see schedulePreviewRefresh)
+	this.preview = false;
+	this.previewRefreshTimer = null;
+
 	// Holds the parameters of executed pattern detection jobs whose results are
 	// still being displayed (avoids duplication of jobs).
 	this.alreadyExecutedPatternDetectionJobs = [];
@@ -129,7 +139,8 @@ function File(parentProject, id, callback=null) {
 	};
 
 	// If we're not in realtime-mode, request the initial file payload, and
-	// handle the response when it comes.
+	// handle the response when it comes. The graphs span at most the width of
+	// the window, to which the amount of data returned is scaled.
 	requestHandler.requestInitialFilePayload(this.parentProject.id, this.id, function (data) {
 
 		// If the payload is empty, something has gone wrong. Clear the file,
@@ -142,6 +153,13 @@ function File(parentProject, id, callback=null) {
 		// Set the name
 		this.name = data.filename;
 
+		// If the file has yet to be downsampled, its data is a preview, which is
+		// refreshed until the downsampled data is available
+		this.preview = data.preview === true;
+		if (this.preview) {
+			this.schedulePreviewRefresh();
+		}
+
 		// Prepare data received from the backend and attach to class instance
 		this.fileData = this.prepareData(data, data.baseTime);
 
@@ -296,7 +314,7 @@ function File(parentProject, id, callback=null) {
 
 		}.bind(this));
 
-	}.bind(this));
+	}.bind(this), window.innerWidth);
 
 }
 
@@ -478,6 +496,7 @@ File.prototype.destroy = function() {
 
 			// Clear state management data
 			this.graphs = {};
+			delete this.eventDygraphInstances;
 			this.fileData = {};
 			this.globalXExtremes = [];
 
@@ -671,6 +690,14 @@ File.prototype.getPostloadDataUpdateHandler = function() {
 			return;
 		}
 
+		// Keep refreshing the data while it is a preview
+		if (data.hasOwnProperty('preview')) {
+			file.preview = data.preview === true;
+			if (file.preview) {
+				file.schedulePreviewRefresh();
+			}
+		}
+
 		// Go through all series received in the response, and pad if necessary.
 		// We do this before iterating through and attaching the data to the
 		// graphs because there is not always a 1:1 relationship between series
@@ -802,35 +829,28 @@ File.prototype.prepareData = function(data, baseTime) {
 
 	}
 
-	// Process event data
-	if (data.hasOwnProperty('events')) {
-
-		// Get array of event series
-		let events = Object.keys(data.events);
+	// Extend the global x-extremes to the event series, whose events are
+	// requested for the current view (see requestCurrentViewEvents)
+	if (data.hasOwnProperty('eventSeries')) {
 
-		// Process event data
-		for (let s of events) {
+		for (let s of Object.keys(data.eventSeries)) {
 
-			// If this series has no data, continue
-			if (data.events[s].length < 1) {
+			// If this series has no events, continue
+			if (data.eventSeries[s].count < 1) {
 				continue;
 			}
 
-			for (let i in data.events[s]) {
-
-				// Convert the ISO8601-format string into a Date object.
-				data.events[s][i][0] = new Date((data.events[s][i][0] + baseTime) * 1000);
-
-			}
+			const start = new Date((data.eventSeries[s].start + baseTime) * 1000);
+			const stop = new Date((data.eventSeries[s].stop + baseTime) * 1000);
 
 			// Update global x-minimum if warranted
-			if (data.events[s][0][0] < this.globalXExtremes[0]) {
-				this.globalXExtremes[0] = data.events[s][0][0];
+			if (this.globalXExtremes.length === 0 || start < this.globalXExtremes[0]) {
+				this.globalXExtremes[0] = start;
 			}
 
 			// Update global x-maximumm if warranted
-			if (data.events[s][data.events[s].length - 1][0] > this.globalXExtremes[1]) {
-				this.globalXExtremes[1] = data.events[s][data.events[s].length - 1][0];
+			if (this.globalXExtremes.length < 2 || stop > this.globalXExtremes[1]) {
+				this.globalXExtremes[1] = stop;
 			}
 
 		}
@@ -1084,32 +1104,20 @@ File.prototype.renderBufferedRealtimeData = function() {
 
 };
 
-// Render event graph
+// Render event graph. The graphs are created empty, and their events are
+// requested for the current view (see requestCurrentViewEvents).
 File.prototype.renderEventGraphs = function() {
 
-	// Check that we have the relevant event data
-	if ( !('events' in this.fileData) || !('meds' in this.fileData.events) ) {
+	// Check that we have the relevant event series
+	if ( !('eventSeries' in this.fileData) || !('meds' in this.fileData.eventSeries) ) {
 		return;
 	}
 
 	for (let eventtype of ['ce', 'meds']) {
 
-		let eventdata = undefined;
-		if (eventtype === 'ce') {
-			eventdata = this.fileData.events.ce;
-		} else if (eventtype === 'meds') {
-			eventdata = this.fileData.events.meds;
-		}
-
-		if (eventdata === undefined)
+		if (!(eventtype in this.fileData.eventSeries))
 			continue;
 
-		// Create our data
-		let graphData = [];
-		for (let e of eventdata) {
-			graphData.push([e[0], 1]);
-		}
-
 		// Create the graph wrapper dom element
 		let graphWrapperDomElement = document.createElement('DIV');
 		graphWrapperDomElement.className = 'graph_wrapper';
@@ -1118,7 +1126,7 @@ File.prototype.renderEventGraphs = function() {
 			'<table>' +
 				'<tbody>' +
 					'<tr>' +
-						'<td class="graph_title">' + (eventtype === 'meds' ? 'Medications' : (eventtype === 'ce' ? 'Clinical Events' : '')) +'</td>' +
+						'<td class="graph_title">' + getEventSeriesLabel(eventtype) +'</td>' +
 						'<td rowspan="2">' +
 							'<div class="graph"></div>' +
 						'</td>' +
@@ -1140,7 +1148,7 @@ File.prototype.renderEventGraphs = function() {
 			this.eventDygraphInstances = {};
 		}
 
-		this.eventDygraphInstances[eventtype] = new Dygraph(graphDomElement, graphData, {
+		this.eventDygraphInstances[eventtype] = new Dygraph(graphDomElement, getEventGraphData([], this.globalXExtremes), {
 			axes: {
 				y: {
 					pixelsPerLabel: 300
@@ -1156,31 +1164,61 @@ File.prototype.renderEventGraphs = function() {
 				'dblclick': handleDoubleClick.bind(this),
 				'mousewheel': handleMouseWheel.bind(this)
 			},
-			labels: ['Time', (eventtype === 'meds' ? 'Medications' : (eventtype === 'ce' ? 'Clinical Events' : ''))],
+			labels: ['Time', getEventSeriesLabel(eventtype)],
 			labelsDiv: legendDomElement,
 			valueRange: [0, 2]
 		});
 
-		let annotations = [];
-		for (let e of eventdata) {
-			annotations.push({
-				series: (eventtype === 'meds' ? 'Medications' : (eventtype === 'ce' ? 'Clinical Events' : '')),
-				x: e[0].valueOf(),
-				shortText: 'M',
-				text: e[1]
-			});
-		}
+	}
 
-		// Persist this for the callback
-		let file = this;
-		let et = eventtype;
+	// Request the events of the initial view
+	if ('eventDygraphInstances' in this) {
+		this.requestCurrentViewEvents(this.globalXExtremes[0], this.globalXExtremes[1]);
+	}
 
-		this.eventDygraphInstances[eventtype].ready(function () {
-			file.eventDygraphInstances[et].setAnnotations(annotations);
-		});
+};
+
+// Requests the events within left to right (milliseconds since epoch) for the
+// event graphs, replacing the events plotted once received. Responses to
+// requests superseded by a later one are ignored.
+File.prototype.requestCurrentViewEvents = function(left, right) {
 
+	if (!('eventDygraphInstances' in this)) {
+		return;
 	}
 
+	const generation = this.eventsRequestGeneration = (this.eventsRequestGeneration || 0) + 1;
+
+	const file = this;
+	requestHandler.requestEventsRangedData(this.parentProject.id, this.id, left / 1000 - this.fileData.baseTime, right / 1000 - this.fileData.baseTime, function(data) {
+
+		if (generation !== file.eventsRequestGeneration || !('eventDygraphInstances' in file) || !data.hasOwnProperty('events')) {
+			return;
+		}
+
+		for (let eventtype of Object.keys(file.eventDygraphInstances)) {
+
+			const eventdata = data.events[eventtype] || [];
+			convertFirstColumnToDate(eventdata, file.fileData.baseTime);
+
+			let annotations = [];
+			for (let e of eventdata) {
+				annotations.push({
+					series: getEventSeriesLabel(eventtype),
+					x: e[0].valueOf(),
+					shortText: 'M',
+					text: e[1]
+				});
+			}
+
+			const dygraphInstance = file.eventDygraphInstances[eventtype];
+			dygraphInstance.updateOptions({ file: getEventGraphData(eventdata, [left, right]) }, true);
+			dygraphInstance.setAnnotations(annotations);
+
+		}
+
+	});
+
 };
 
 // Render the file metadata
@@ -1310,10 +1348,27 @@ File.prototype.triggerResizeAllGraphs = function() {
 };
 
 // Request and update data for the current view of all graphs for current file.
-// Optionally, specify left & right to override load window.
+// Optionally, specify left & right to override load window. Calls in quick
+// succession are debounced (see the viewDataDebounce config setting), so that
+// data is only requested for the view the user settles on.
 // NOTE: There is an identically-named function on both File and Graph classes.
 File.prototype.updateCurrentViewData = function(left=false, right=false) {
 
+	if (this.updateViewDataTimer != null) {
+		clearTimeout(this.updateViewDataTimer);
+	}
+
+	this.updateViewDataTimer = setTimeout(function() {
+		this.updateViewDataTimer = null;
+		this.requestCurrentViewData(left, right);
+	}.bind(this), globalAppConfig.viewDataDebounce);
+
+};
+
+// Request and update data for the current view of all graphs for current file
+// immediately (see updateCurrentViewData). Each request supersedes the last.
+File.prototype.requestCurrentViewData = function(left=false, right=false) {
+
 	// Holds the array of series IDs for which we will request updated data.
 	let series = [];
 
@@ -1347,9 +1402,9 @@ File.prototype.updateCurrentViewData = function(left=false, right=false) {
 
 	// Grab the x-axis range from the last showing graph (all graphs should be
 	// showing the same range since they are synchronized).
+	const xRange = lastGraphShowing.dygraphInstance.xAxisRange();
 	if (left === false || right === false) {
 
-		const xRange = lastGraphShowing.dygraphInstance.xAxisRange();
 		left = xRange[0]
 		right = xRange[1]
 
@@ -1368,8 +1423,34 @@ File.prototype.updateCurrentViewData = function(left=false, right=false) {
 	const leftForBE = left / 1000 - this.fileData.baseTime;
 	const rightForBE = right / 1000 - this.fileData.baseTime;
 
+	// Pixel width the load window would span on the graphs, to which the
+	// amount of data returned is scaled
+	const width = Math.ceil(lastGraphShowing.dygraphInstance.getArea().w * (right - left) / (xRange[1] - xRange[0]));
+
+	// Request the events of the view for the event graphs
+	this.requestCurrentViewEvents(left, right);
+
 	// Request the updated view data from the backend.
-	requestHandler.requestSeriesRangedData(this.parentProject.id, this.id, series, leftForBE, rightForBE, this.getPostloadDataUpdateHandler());
+	requestHandler.requestSeriesRangedData(this.parentProject.id, this.id, series, leftForBE, rightForBE, this.getPostloadDataUpdateHandler(), width, 'view');
+
+};
+
+// While the file's data is a preview (i.e. the file has yet to be downsampled),
+// re-requests the data for the current view after the previewRefreshInterval
+// config setting, so that the preview is replaced by downsampled data once
+// available.
+File.prototype.schedulePreviewRefresh = function() {
+
+	if (this.previewRefreshTimer != null) {
+		clearTimeout(this.previewRefreshTimer);
+	}
+
+	this.previewRefreshTimer = setTimeout(function() {
+		this.previewRefreshTimer = null;
+		if (this.preview) {
+			this.requestCurrentViewData();
+		}
+	}.bind(this), globalAppConfig.previewRefreshInterval);
 
 };
 
@@ -1495,7 +1576,7 @@ File.prototype.pan = function(by) {
 	const loadThisMuchAhead = presumedDataLoadTime*this.playback_speed*2 // load ahead this many milliseconds
 	if (this.playback_currently_loaded_ds_right < right + presumedDataLoadTime * this.playback_speed) {
 		console.log('Loading data.')
-		this.updateCurrentViewData(left, right + loadThisMuchAhead)
+		this.requestCurrentViewData(left, right + loadThisMuchAhead)
 	}
 
 };
@@ -406,7 +406,8 @@ Graph.prototype.updateCurrentViewData = function() {
 	// Assemble the series ID(s) for which we will request updated data.
 	let series = this.isGroup ? this.members : [this.fullName];
 
-	// Request the updated view data from the backend.
-	requestHandler.requestSeriesRangedData(this.file.parentProject.id, this.file.id, series, xRange[0]/1000-this.file.fileData.baseTime, xRange[1]/1000-this.file.fileData.baseTime, this.file.getPostloadDataUpdateHandler());
+	// Request the updated view data from the backend, scaled to the width of
+	// the plot area.
+	requestHandler.requestSeriesRangedData(this.file.parentProject.id, this.file.id, series, xRange[0]/1000-this.file.fileData.baseTime, xRange[1]/1000-this.file.fileData.baseTime, this.file.getPostloadDataUpdateHandler(), this.dygraphInstance.getArea().w);
 
 };
@@ -5,7 +5,18 @@ The RequestHandler is a global singleton that handles asynchronous API requests.
  */
 
 // Class declaration
-function RequestHandler() {}
+function RequestHandler() {
+
+	// Identifies this client's request channels to the backend (see
+	// requestSeriesRangedData)
+	this.clientID = Math.random().toString(36).slice(2);
+
+	// Generation of the latest request made on any channel, and the request in
+	// flight on each channel
+	this.generation = 0;
+	this.inFlight = {};
+
+}
 
 RequestHandler.prototype.createAnnotation = function(project_id, file_id, left, right, seriesID, label, pattern_id, callback) {
 
@@ -87,11 +98,14 @@ RequestHandler.prototype.requestPatternDetection = function(project_id, file_id,
 
 };
 
-RequestHandler.prototype.requestInitialFilePayload = function(project_id, file_id, callback) {
+// If provided, width is the pixel width of the plots, to which the amount of
+// data returned for each series is scaled.
+RequestHandler.prototype.requestInitialFilePayload = function(project_id, file_id, callback, width) {
 	this._newRequest(callback, globalAppConfig.initialFilePayloadURL, {
 		project_id: project_id,
-		file_id: file_id
-	});
+		file_id: file_id,
+		width: width
+	}, true);
 };
 
 RequestHandler.prototype.requestInitialEvaluatorPayload = function(project_id, callback) {
@@ -173,14 +187,59 @@ RequestHandler.prototype.requestProjectAnnotations = function(project_id, callba
 	})
 };
 
-RequestHandler.prototype.requestSeriesRangedData = function(project_id, file_id, series, startTime, stopTime, callback) {
-	this._newRequest(callback, globalAppConfig.seriesRangedDataURL, {
+// If provided, width is the pixel width spanned by the requested time range on
+// the plots, to which the amount of data returned for each series is scaled.
+// If channel is provided, the request supersedes any earlier request made on
+// the same channel (e.g. for the view of a file): the earlier request is
+// aborted if still in flight, and the backend drops it if it has yet to answer.
+RequestHandler.prototype.requestSeriesRangedData = function(project_id, file_id, series, startTime, stopTime, callback, width, channel) {
+
+	let params = {
 		project_id: project_id,
 		file_id: file_id,
 		s: series,
 		start: startTime,
+		stop: stopTime,
+		width: width
+	};
+
+	if (channel === undefined) {
+		this._newRequest(callback, globalAppConfig.seriesRangedDataURL, params, true);
+		return;
+	}
+
+	channel = this.clientID + ':' + file_id + ':' + channel;
+	if (this.inFlight.hasOwnProperty(channel)) {
+		this.inFlight[channel].abort();
+	}
+
+	params.channel = channel;
+	params.gen = ++this.generation;
+
+	const inFlight = this.inFlight;
+	const req = this._newRequest(callback, globalAppConfig.seriesRangedDataURL, params, true);
+
+	inFlight[channel] = req;
+	req.addEventListener('loadend', function() {
+		if (inFlight[channel] === req) {
+			delete inFlight[channel];
+		}
+	});
+
+};
+
+// Requests the events of the file (e.g. medications & clinical events) within
+// the time range, as rows of [time, text] by event series, so that only the
+// events of the visible window need be fetched.
+RequestHandler.prototype.requestEventsRangedData = function(project_id, file_id, startTime, stopTime, callback) {
+
+	this._newRequest(callback, globalAppConfig.eventsRangedDataURL, {
+		project_id: project_id,
+		file_id: file_id,
+		start: startTime,
 		stop: stopTime
 	});
+
 };
 
 RequestHandler.prototype.updateAnnotation = function(id, project_id, file_id, left, right, seriesID, label, callback) {
@@ -199,15 +258,30 @@ RequestHandler.prototype.updateAnnotation = function(id, project_id, file_id, le
 
 };
 
+// MIME types of the columnar series data formats (see wireformat.py on the
+// backend), requested for series data in place of JSON rows
+const BINARY_SERIES_MIMETYPE = 'application/vnd.auviewer.series';
+const COLUMNAR_JSON_SERIES_MIMETYPE = 'application/vnd.auviewer.columnar+json';
+
 const callbackCaller = function(callback, path) {
 	return function() {
 
 		if (this.readyState === 4 && this.status === 200) {
 
-			// JSON-decode the response
+			// Decode the response per its content type, either binary (see
+			// decodeBinaryPayload), columnar JSON (see expandColumnarPayload) or JSON
+			const contentType = this.getResponseHeader('Content-Type') || '';
 			let data = {};
-			if (this.responseText.length > 0) {
-				data = JSON.parse(this.responseText);
+			if (contentType.startsWith(BINARY_SERIES_MIMETYPE)) {
+				data = decodeBinaryPayload(this.response);
+			} else {
+				const text = this.responseType === 'arraybuffer' ? new TextDecoder().decode(this.response) : this.responseText;
+				if (text.length > 0) {
+					data = JSON.parse(text);
+				}
+				if (contentType.startsWith(COLUMNAR_JSON_SERIES_MIMETYPE)) {
+					data = expandColumnarPayload(data);
+				}
 			}
 
 			globalAppConfig.verbose && console.log("Response received to " + path, deepCopy(data));
@@ -227,6 +301,90 @@ const callbackCaller = function(callback, path) {
 	}
 };
 
+// Returns the rows of series data, [time, min, max] or [time, null, null,
+// value], for the given columns of times & either mins & maxs or values. NaN
+// values are output as null, as in the JSON response.
+const columnsToRows = function(time, min, max, value) {
+
+	const v = x => (x === null || isNaN(x)) ? null : x;
+
+	const data = new Array(time.length);
+	if (value === undefined) {
+		for (let i = 0; i < time.length; i++) {
+			data[i] = [time[i], v(min[i]), v(max[i])];
+		}
+	} else {
+		for (let i = 0; i < time.length; i++) {
+			data[i] = [time[i], null, null, v(value[i])];
+		}
+	}
+
+	return data;
+
+};
+
+// Decodes a binary series data response (see wireformat.py on the backend) into
+// the same payload as the JSON response, with the data of each series as rows
+// (see columnsToRows). The response holds a prefix (magic, version & header
+// length), a JSON header with the payload & the location of each series' data
+// columns, and the columns as little-endian float64 arrays (read directly, as
+// browser platforms are little-endian).
+const decodeBinaryPayload = function(buffer) {
+
+	const view = new DataView(buffer);
+	const magic = String.fromCharCode(view.getUint8(0), view.getUint8(1), view.getUint8(2), view.getUint8(3));
+	if (magic !== 'AUVB' || view.getUint16(4, true) !== 1) {
+		throw new Error('Unsupported binary series data response.');
+	}
+
+	const headerLength = view.getUint32(8, true);
+	const payload = JSON.parse(new TextDecoder().decode(new Uint8Array(buffer, 12, headerLength)));
+	const dataOffset = 12 + headerLength;
+
+	for (const id of Object.keys(payload.series || {})) {
+
+		const output = payload.series[id];
+
+		const columns = {};
+		for (const c of output.columns) {
+			columns[c.name] = new Float64Array(buffer, dataOffset + c.offset, c.length);
+		}
+		delete output.columns;
+
+		output.data = columnsToRows(columns['time'], columns['min'], columns['max'], columns['value']);
+
+	}
+
+	return payload;
+
+};
+
+// Expands a columnar JSON series data response (see wireformat.py on the
+// backend) into the same payload as the JSON response. The response holds the
+// data of each series as arrays of times & either mins & maxs or values rather
+// than rows.
+const expandColumnarPayload = function(payload) {
+
+	if (payload.hasOwnProperty('version') && payload.version !== 2) {
+		throw new Error('Unsupported columnar series data response.');
+	}
+	delete payload.version;
+
+	for (const id of Object.keys(payload.series || {})) {
+
+		const output = payload.series[id];
+		output.data = columnsToRows(output.times, output.mins, output.maxs, output.values);
+		delete output.times;
+		delete output.mins;
+		delete output.maxs;
+		delete output.values;
+
+	}
+
+	return payload;
+
+};
+
 const buildPathWithParams = function(path, params) {
 	// Assemble the parameters on the path
 	let keys = Object.keys(params);
@@ -274,8 +432,11 @@ RequestHandler.prototype._customRequest = function(callback, path, pathParams, o
 // Executes a backend request. Takes an object params with name/value pairs.
 // The value may be either a string/string-convertible value or an array of
 // such values. In the latter case, the array will be passed in as a GET
-// parameter array of values.
-RequestHandler.prototype._newRequest = function(callback, path, params) {
+// parameter array of values. If seriesData is set, the response is requested in
+// a columnar series data format, either binary or columnar JSON per the
+// binarySeriesData config setting, and expanded into rows (see callbackCaller).
+// Returns the request object.
+RequestHandler.prototype._newRequest = function(callback, path, params, seriesData=false) {
 
 	globalAppConfig.verbose && console.log("Sending request to " + path, params);
 
@@ -287,6 +448,14 @@ RequestHandler.prototype._newRequest = function(callback, path, params) {
 	path = buildPathWithParams(path, params);
 	console.log(path);
 	req.open("GET", path, true);
+	if (seriesData && globalAppConfig.binarySeriesData) {
+		req.setRequestHeader('Accept', BINARY_SERIES_MIMETYPE);
+		req.responseType = 'arraybuffer';
+	} else if (seriesData) {
+		req.setRequestHeader('Accept', COLUMNAR_JSON_SERIES_MIMETYPE);
+	}
 	req.send();
 
+	return req;
+
 };
\ No newline at end of file
@@ -9,6 +9,18 @@ let globalAppConfig = {
 	// Maximum data points to hold per data series for realtime mode
 	M: 3000,
 
+	// Request series data in the binary columnar format rather than columnar JSON
+	binarySeriesData: true,
+
+	// Delay, in milliseconds, for which requests for the data of the current
+	// view are held back, so that only the last of a burst (e.g. while panning
+	// or zooming) is sent.
+	viewDataDebounce: 150,
+
+	// Interval, in milliseconds, at which the data of a file which is being
+	// downsampled (and so previewed) is refreshed
+	previewRefreshInterval: 10000,
+
 	// Performance reporting thresholds, in milliseconds.
 	performanceReportingThresholdGeneral: 100,
 	performanceReportingThresholdTemplateSystem: 5,
@@ -32,6 +44,7 @@ let globalAppConfig = {
 	getSegmentsURL: 'get_segments',
 	getProjectAnnotationsURL: 'get_project_annotations',
 	seriesRangedDataURL: 'series_ranged_data',
+	eventsRangedDataURL: 'events_ranged_data',
 	updateAnnotationURL: 'update_annotation',
 	getLabelersURL: 'get_labelers',
 	getLabelsURL: 'get_labels',
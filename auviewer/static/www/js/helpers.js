@@ -244,6 +244,22 @@ function getCurrentTargetAssignmentID() {
 	return null;
 }
 
+// Returns the data of an event graph for the given events (rows of [date,
+// text]): a point at each event. If there are no events, the window (an array
+// of two times in milliseconds since epoch) is spanned by empty points instead,
+// as dygraphs cannot plot an empty data set.
+function getEventGraphData(events, window) {
+	if (events.length === 0) {
+		return [[new Date(window[0]), null], [new Date(window[1]), null]];
+	}
+	return events.map(e => [e[0], 1]);
+}
+
+// Returns the label of an event series (see File.renderEventGraphs)
+function getEventSeriesLabel(eventtype) {
+	return eventtype === 'meds' ? 'Medications' : (eventtype === 'ce' ? 'Clinical Events' : '');
+}
+
 // Returns a 2-member array with date & time strings that can be provided to an
 // HTML5 input form field of type date & time respectively. Format will be
 // ['2020-12-15', '01:27:36'].
@@ -0,0 +1,88 @@
+from pathlib import Path
+
+import audata
+import h5py
+import numpy as np
+import pandas as pd
+import pytest
+from flask import Flask
+
+from auviewer import models
+from auviewer.file import File
+
+# Writes an original file to path, holding a waveform series of n irregularly
+# spaced data points with a gap, and a numerics dataset of three series.
+def writeOriginalFile(path, n=200000, seed=0):
+    rng = np.random.default_rng(seed)
+    t = np.cumsum(rng.exponential(1 / 500., n))
+    t[n // 3:] += 100
+    f = audata.File.new(str(path), overwrite=True, return_datetimes=False)
+    f['data/waveforms/II'] = pd.DataFrame({'time': t, 'value': rng.standard_normal(n)})
+    m = n // 100
+    f['data/numerics/HR'] = pd.DataFrame({'time': np.sort(rng.random(m)) * t[-1], 'HR': rng.random(m) * 100, 'SPO2': rng.random(m), 'RR': rng.integers(0, 30, m)})
+    f.close()
+
+# Returns the datasets of an HDF5 file by path
+def readDatasets(path):
+    datasets = {}
+    with h5py.File(str(path), 'r') as h:
+        h.visititems(lambda name, o: datasets.__setitem__(name, o[()]) if isinstance(o, h5py.Dataset) else None)
+    return datasets
+
+# Asserts that the HDF5 files at paths a & b hold identical datasets, limited to
+# those under the given group path if provided
+def assertSameDatasets(a, b, group=None):
+    da = readDatasets(a)
+    db = readDatasets(b)
+    if group is not None:
+        da = {name: d for name, d in da.items() if name.startswith(group + '/')}
+        db = {name: d for name, d in db.items() if name.startswith(group + '/')}
+        assert len(da) > 0
+    assert sorted(da) == sorted(db)
+    for name in da:
+        assert da[name].dtype == db[name].dtype, name
+        if da[name].dtype.names:
+            for field in da[name].dtype.names:
+                np.testing.assert_array_equal(da[name][field], db[name][field], err_msg=f"{name}:{field}")
+        else:
+            np.testing.assert_array_equal(da[name], db[name], err_msg=name)
+
+@pytest.fixture
+def origFile(tmp_path):
+    path = tmp_path / 'orig.h5'
+    writeOriginalFile(path)
+    return path
+
+# Returns a function which processes the original file into the processed file
+# of the given name in the temporary directory, and returns its path
+@pytest.fixture
+def processFile(tmp_path, origFile):
+    def process(name, **kwargs):
+        procPath = tmp_path / name
+        f = File(None, -1, Path(origFile), procPath)
+        try:
+            f.process(**kwargs)
+        finally:
+            f.close()
+        return procPath
+    return process
+
+# Returns the original file, processed, and open for reading its series
+@pytest.fixture
+def processedFile(tmp_path, origFile):
+    f = File(None, -1, Path(origFile), tmp_path / 'orig_processed.h5')
+    f.process()
+    yield f
+    f.close()
+
+# Returns a Flask app with an in-memory database, within its app context
+@pytest.fixture
+def app():
+    app = Flask(__name__)
+    app.config.update(SQLALCHEMY_DATABASE_URI='sqlite:///:memory:', SQLALCHEMY_TRACK_MODIFICATIONS=False)
+    models.db.init_app(app)
+    with app.app_context():
+        models.db.create_all()
+        yield app
+        models.db.session.remove()
+        models.db.drop_all()
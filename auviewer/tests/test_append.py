@@ -0,0 +1,135 @@
+import json
+
+import h5py
+
+from auviewer import downsampleset, series
+from auviewer.downsampleset import DownsampleSet
+from auviewer.file import File
+from auviewer.tests.conftest import assertSameDatasets, readDatasets, writeOriginalFile
+
+# Downsample group of the series which fails to be extended
+FAILING_SERIES = 'data/waveforms/II/value'
+
+# Fraction of the data points of each dataset processed before the rest is appended
+PREFIX_FRACTION = 0.8
+
+# Writes the original file with the first PREFIX_FRACTION of its data points,
+# processes it, then appends the rest to the original file. Returns the paths of
+# the original & processed files.
+def processPrefixThenAppend(tmp_path):
+
+    fullPath = tmp_path / 'full.h5'
+    writeOriginalFile(fullPath)
+    full = readDatasets(fullPath)
+
+    origPath = tmp_path / 'orig.h5'
+    writeOriginalFile(origPath)
+    with h5py.File(str(origPath), 'a') as h:
+        for name, a in full.items():
+            h[name].resize((int(a.shape[0] * PREFIX_FRACTION),))
+
+    procPath = tmp_path / 'orig_processed.h5'
+    f = File(None, -1, origPath, procPath)
+    f.process()
+    f.close()
+
+    with h5py.File(str(origPath), 'a') as h:
+        for name, a in full.items():
+            h[name].resize((a.shape[0],))
+            h[name][...] = a
+
+    return origPath, procPath
+
+# Returns the path of the downsample group of a downsample set, as named when
+# visiting the processed file
+def getGroupPath(dss):
+    return '/'.join(dss.seriesparent.h5pathDownsample).lstrip('/')
+
+# Returns the resume records of the processed file by downsample group path
+def getResumeRecords(procPath):
+    records = {}
+    def visit(name, o):
+        if isinstance(o, h5py.Group) and '.meta' in o.attrs:
+            meta = json.loads(o.attrs['.meta'])
+            if 'resume' in meta:
+                records[name] = meta['resume']
+    with h5py.File(str(procPath), 'r') as h:
+        h.visititems(visit)
+    return records
+
+# Processes the original file from scratch, streaming the raw data with the
+# downsample layout (number of downsamples & time-per-interval of each) pinned
+# to that of the resume records, as extending the downsamples keeps it. Series
+# without downsamples have no resume record, and are processed as usual.
+def processWithLayout(origPath, procPath, records, monkeypatch):
+
+    layout = lambda dss: records.get(getGroupPath(dss))
+
+    numDownsamplesToBuildStreaming = DownsampleSet.numDownsamplesToBuildStreaming
+    def pinnedNumDownsamplesToBuildStreaming(self, rowsPerChunk):
+        ndtb, firstOffset, lastOffset = numDownsamplesToBuildStreaming(self, rowsPerChunk)
+        if layout(self) is None:
+            return ndtb, firstOffset, lastOffset
+        return len(layout(self)['timePerInterval']), firstOffset, lastOffset
+
+    beginStreaming = DownsampleSet.beginStreaming
+    def pinnedBeginStreaming(self, ndtb, firstOffset, lastOffset):
+        if layout(self) is None:
+            beginStreaming(self, ndtb, firstOffset, lastOffset)
+            return
+        timePerIntervals = layout(self)['timePerInterval']
+        beginStreaming(self, ndtb, firstOffset, timePerIntervals[-1] * self.getNumIntervalsByIndex(-1, ndtb) + firstOffset)
+        self._streaming['timePerIntervals'] = timePerIntervals
+        if self._streaming['m4'] is not None:
+            self._streaming['m4'] = downsampleset.newM4Build(ndtb, firstOffset, timePerIntervals)
+
+    monkeypatch.setattr(DownsampleSet, 'numDownsamplesToBuildStreaming', pinnedNumDownsamplesToBuildStreaming)
+    monkeypatch.setattr(DownsampleSet, 'beginStreaming', pinnedBeginStreaming)
+    monkeypatch.setattr(DownsampleSet, 'rawDataFitsInMemoryBudget', lambda self: False)
+    monkeypatch.setattr(series, 'fitsInMemoryBudget', lambda *args: False)
+
+    f = File(None, -1, origPath, procPath)
+    f.process()
+    f.close()
+
+def test_extending_downsamples_equals_building_them_from_all_of_the_data(tmp_path, monkeypatch):
+
+    origPath, procPath = processPrefixThenAppend(tmp_path)
+
+    f = File(None, -1, origPath, procPath)
+    f.processAppended()
+    f.close()
+
+    records = getResumeRecords(procPath)
+    assert len(records) > 0
+
+    refPath = tmp_path / 'ref_processed.h5'
+    processWithLayout(origPath, refPath, records, monkeypatch)
+
+    assertSameDatasets(procPath, refPath)
+
+def test_series_failing_to_be_extended_are_rebuilt(tmp_path, monkeypatch):
+
+    origPath, procPath = processPrefixThenAppend(tmp_path)
+
+    processAndStoreAppended = DownsampleSet.processAndStoreAppended
+    def failingProcessAndStoreAppended(self):
+        if getGroupPath(self) == FAILING_SERIES:
+            raise RuntimeError('Failure while extending the downsamples.')
+        return processAndStoreAppended(self)
+    monkeypatch.setattr(DownsampleSet, 'processAndStoreAppended', failingProcessAndStoreAppended)
+
+    f = File(None, -1, origPath, procPath)
+    f.processAppended()
+    f.close()
+
+    assert procPath.exists()
+    assert not procPath.with_suffix(procPath.suffix + '.tmp').exists()
+
+    # The failing series is rebuilt as if processed from scratch
+    refPath = tmp_path / 'ref_processed.h5'
+    f = File(None, -1, origPath, refPath)
+    f.process()
+    f.close()
+
+    assertSameDatasets(procPath, refPath, group=FAILING_SERIES)
@@ -0,0 +1,118 @@
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+
+import pytest
+
+from auviewer import coalesce
+from auviewer.coalesce import RequestGenerations, SingleFlight
+
+# Number of identical calls made concurrently
+NUM_CALLERS = 8
+
+# Makes NUM_CALLERS concurrent calls of flight.do with the key, each of which
+# waits until all have been made before fn is run, and returns their futures
+# along with the number of times fn was run.
+def callConcurrently(flight, key, fn):
+
+    calls = []
+    released = threading.Event()
+
+    def slowFn():
+        calls.append(1)
+        released.wait(5)
+        return fn()
+
+    executor = ThreadPoolExecutor(max_workers=NUM_CALLERS)
+    futures = [executor.submit(flight.do, key, slowFn) for _ in range(NUM_CALLERS)]
+
+    # Wait for the followers to join the leader's call before releasing it
+    for _ in range(500):
+        if flight.coalesced == NUM_CALLERS - 1:
+            break
+        time.sleep(0.01)
+    released.set()
+
+    executor.shutdown(wait=True)
+    return futures, len(calls)
+
+def test_concurrent_identical_calls_share_one_result():
+
+    flight = SingleFlight()
+    result = object()
+
+    futures, numCalls = callConcurrently(flight, 'key', lambda: result)
+
+    assert numCalls == 1
+    assert flight.coalesced == NUM_CALLERS - 1
+    assert all(f.result() is result for f in futures)
+    assert flight.calls == {}
+
+def test_concurrent_identical_calls_share_one_exception():
+
+    flight = SingleFlight()
+
+    def fail():
+        raise ValueError('failed')
+
+    futures, numCalls = callConcurrently(flight, 'key', fail)
+
+    assert numCalls == 1
+    for f in futures:
+        with pytest.raises(ValueError):
+            f.result()
+    assert flight.calls == {}
+
+def test_calls_with_different_keys_are_not_coalesced():
+
+    flight = SingleFlight()
+
+    assert [flight.do(key, lambda: key * 2) for key in [1, 2, 1]] == [2, 4, 2]
+    assert flight.coalesced == 0
+
+def test_sequential_calls_are_repeated():
+
+    flight = SingleFlight()
+    calls = []
+
+    flight.do('key', lambda: calls.append(1))
+    flight.do('key', lambda: calls.append(1))
+
+    assert len(calls) == 2
+
+def test_later_generations_supersede_earlier_ones():
+
+    generations = RequestGenerations()
+
+    assert generations.begin('a', 1)
+    assert generations.begin('a', 3)
+    assert generations.isCurrent('a', 3)
+    assert not generations.isCurrent('a', 1)
+    assert not generations.begin('a', 2)
+    assert generations.superseded == 2
+
+    # Repeated generations (e.g. a retried request) remain current
+    assert generations.begin('a', 3)
+
+def test_channels_are_independent():
+
+    generations = RequestGenerations()
+
+    assert generations.begin('a', 5)
+    assert generations.begin('b', 1)
+    assert generations.isCurrent('b', 1)
+    assert generations.isCurrent('c', 0)
+
+def test_least_recently_used_channels_are_forgotten(monkeypatch):
+
+    monkeypatch.setattr(coalesce, 'MAX_CHANNELS', 3)
+    generations = RequestGenerations()
+
+    generations.begin('a', 5)
+    for channel in ['b', 'c', 'd']:
+        generations.begin(channel, 1)
+
+    assert list(generations.generations) == ['b', 'c', 'd']
+
+    # The forgotten channel accepts any generation again
+    assert generations.begin('a', 1)
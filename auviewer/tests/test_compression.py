@@ -0,0 +1,88 @@
+import json
+import zlib
+
+import pytest
+from werkzeug.datastructures import Accept
+
+from auviewer import compression
+from auviewer.compression import coalesceChunks, streamResponseBody
+from auviewer.config import config
+
+# Returns a JSON response generated in many small pieces, as by a JSON encoder
+def makeChunks(n):
+    return json.JSONEncoder().iterencode({'data': [[i * 0.5, i % 7, -i] for i in range(n)]})
+
+def getExpected(n):
+    return ''.join(makeChunks(n)).encode('utf-8')
+
+# Returns the body of a response as bytes, whether or not it was streamed
+def readBody(body):
+    return body if isinstance(body, bytes) else b''.join(body)
+
+DECOMPRESSORS = {
+    'gzip': lambda data: zlib.decompress(data, wbits=31),
+    'deflate': zlib.decompress,
+    'br': lambda data: pytest.importorskip('brotli').decompress(data),
+}
+
+@pytest.fixture(autouse=True)
+def smallChunks(monkeypatch):
+    # Small chunks, so that responses are streamed in many of them
+    monkeypatch.setitem(config, 'responseChunkSize', 4096)
+
+@pytest.mark.parametrize('encoding', ['gzip', 'deflate', 'br'])
+def test_large_responses_are_compressed_and_streamed(encoding):
+
+    if encoding == 'br':
+        pytest.importorskip('brotli')
+
+    body, contentEncoding = streamResponseBody(makeChunks(20000), Accept([(encoding, 1)]))
+
+    assert contentEncoding == encoding
+    assert not isinstance(body, bytes)
+    assert DECOMPRESSORS[encoding](readBody(body)) == getExpected(20000)
+
+def test_brotli_is_preferred_when_installed():
+
+    encoding = 'br' if compression.brotli is not None else 'gzip'
+
+    assert streamResponseBody(makeChunks(20000), Accept([('gzip', 1), ('deflate', 1), ('br', 1)]))[1] == encoding
+
+def test_brotli_is_not_negotiated_when_not_installed(monkeypatch):
+
+    monkeypatch.setattr(compression, 'brotli', None)
+
+    body, encoding = streamResponseBody(makeChunks(20000), Accept([('br', 1), ('deflate', 0.5)]))
+
+    assert encoding == 'deflate'
+    assert zlib.decompress(readBody(body)) == getExpected(20000)
+
+def test_small_responses_are_returned_uncompressed():
+
+    body, encoding = streamResponseBody(makeChunks(3), Accept([('gzip', 1)]))
+
+    assert encoding is None
+    assert body == getExpected(3)
+
+def test_responses_are_streamed_uncompressed_without_an_accepted_encoding():
+
+    body, encoding = streamResponseBody(makeChunks(20000), Accept([('identity', 1)]))
+
+    assert encoding is None
+    assert not isinstance(body, bytes)
+    assert readBody(body) == getExpected(20000)
+
+def test_responses_are_not_compressed_when_disabled(monkeypatch):
+
+    monkeypatch.setitem(config, 'responseCompressionMinSize', None)
+
+    body, encoding = streamResponseBody(makeChunks(20000), Accept([('gzip', 1)]))
+
+    assert encoding is None
+    assert readBody(body) == getExpected(20000)
+
+def test_chunks_are_coalesced():
+
+    chunks = list(coalesceChunks(['ab', b'cd', 'é', 'f' * 10, 'g'], 4))
+
+    assert chunks == [b'abcd', 'é'.encode('utf-8') + b'f' * 10, b'g']
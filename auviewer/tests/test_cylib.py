@@ -0,0 +1,88 @@
+import numpy as np
+import pytest
+
+from auviewer.cylib import (
+    buildDownsampleFromRaw, buildDownsampleFromRawChunk, buildM4Chunk, buildNextDownsampleUp,
+    buildNextDownsampleUpChunk, finishM4ChunkState, finishRawChunkState, finishUpChunkState, newM4ChunkState,
+    newRawChunkState, newUpChunkState,
+)
+
+# Chunk sizes to feed the resumable kernels, most of which split intervals
+CHUNK_SIZES = [1, 7, 100, 1001, 4096]
+
+# Returns a series of irregularly spaced data points with gaps and NaN values
+def makeSeries(n=20000, seed=0):
+    rng = np.random.default_rng(seed)
+    offsets = np.cumsum(rng.exponential(0.5, n))
+    offsets[n // 3:] += 500
+    values = rng.normal(size=n)
+    values[rng.integers(0, n, n // 50)] = np.nan
+    return offsets, values
+
+# Returns the slices of length size covering n items
+def chunks(n, size):
+    return [slice(i, min(n, i + size)) for i in range(0, n, size)]
+
+@pytest.mark.parametrize('aggregates', [False, True])
+@pytest.mark.parametrize('size', CHUNK_SIZES)
+def test_raw_chunks_build_the_same_intervals_as_the_whole_series(aggregates, size):
+
+    offsets, values = makeSeries()
+    numIntervals = 600
+    whole = buildDownsampleFromRaw(offsets, values, numIntervals, aggregates)
+
+    timePerInterval = (offsets[-1] - offsets[0]) / numIntervals
+    state = newRawChunkState(offsets[0], timePerInterval, aggregates=aggregates)
+    parts = [buildDownsampleFromRawChunk(offsets[s], values[s], offsets[0], timePerInterval, state) for s in chunks(offsets.shape[0], size)]
+    chunked = np.concatenate(parts + [finishRawChunkState(state)])
+
+    np.testing.assert_array_equal(chunked, whole)
+
+@pytest.mark.parametrize('aggregates', [False, True])
+@pytest.mark.parametrize('size', CHUNK_SIZES)
+def test_up_chunks_build_the_same_intervals_as_the_whole_downsample(aggregates, size):
+
+    offsets, values = makeSeries()
+    timePerInterval = (offsets[-1] - offsets[0]) / 5000
+    orig = buildDownsampleFromRaw(offsets, values, 5000, aggregates)
+    whole = buildNextDownsampleUp(orig, timePerInterval, 3)
+
+    state = newUpChunkState(aggregates=aggregates)
+    parts = [buildNextDownsampleUpChunk(orig[s], timePerInterval, 3, state) for s in chunks(orig.shape[0], size)]
+    chunked = np.concatenate(parts + [finishUpChunkState(state)])
+
+    np.testing.assert_array_equal(chunked, whole)
+
+@pytest.mark.parametrize('size', CHUNK_SIZES)
+def test_m4_chunks_build_the_same_points_as_the_whole_series(size):
+
+    offsets, values = makeSeries()
+    timePerInterval = 3.7
+
+    state = newM4ChunkState()
+    whole = np.concatenate([buildM4Chunk(offsets, values, offsets[0], timePerInterval, state), finishM4ChunkState(state)])
+
+    state = newM4ChunkState()
+    parts = [buildM4Chunk(offsets[s], values[s], offsets[0], timePerInterval, state) for s in chunks(offsets.shape[0], size)]
+    chunked = np.concatenate(parts + [finishM4ChunkState(state)])
+
+    np.testing.assert_array_equal(chunked, whole)
+
+def test_m4_points_hold_the_extremes_of_each_bucket():
+
+    offsets, values = makeSeries()
+    timePerInterval = 3.7
+
+    state = newM4ChunkState()
+    points = np.concatenate([buildM4Chunk(offsets, values, offsets[0], timePerInterval, state), finishM4ChunkState(state)])
+
+    buckets = np.floor((offsets - offsets[0]) / timePerInterval)
+    pointBuckets = np.floor((points[:, 0] - offsets[0]) / timePerInterval)
+    present = ~np.isnan(values)
+    for b in np.unique(buckets[present])[::50]:
+        inBucket = present & (buckets == b)
+        kept = points[pointBuckets == b]
+        assert kept.shape[0] <= 4
+        assert kept[:, 1].min() == values[inBucket].min()
+        assert kept[:, 1].max() == values[inBucket].max()
+        assert kept[0, 0] == offsets[inBucket][0] and kept[-1, 0] == offsets[inBucket][-1]
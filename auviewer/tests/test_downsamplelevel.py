@@ -0,0 +1,97 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from auviewer.config import config
+from auviewer.downsampleset import DISPLAY_COLUMNS, MIN_POINT_BUDGET, coarsenIntervals, getPointBudget
+from auviewer.file import File
+from auviewer.tests.conftest import writeOriginalFile
+
+# The downsamples are only read, so are processed once for the module
+@pytest.fixture(scope='module')
+def dss(tmp_path_factory):
+    tmp_path = tmp_path_factory.mktemp('downsamplelevel')
+    writeOriginalFile(tmp_path / 'orig.h5')
+    f = File(None, -1, tmp_path / 'orig.h5', tmp_path / 'orig_processed.h5')
+    f.process()
+    dss = f.getSeries('/data/waveforms/II:value').dss
+    assert dss.numDownsamples > 2
+    yield dss
+    f.close()
+
+# Returns the time-per-interval of each downsample of the set, by index
+def getTimePerIntervals(dss):
+    return [dss.getTimePerIntervalByIndex(i) for i in range(dss.numDownsamples)]
+
+@pytest.mark.parametrize('maxIntervals', [None, 100, 800, 3000, 20000])
+@pytest.mark.parametrize('fraction', [1, 0.5, 0.1, 0.01])
+def test_chosen_downsample_is_the_finest_within_the_budget(dss, maxIntervals, fraction):
+
+    timespan = dss.seriesparent.rd.timespan * fraction
+    maxTimePerInterval = timespan / (config['M'] if maxIntervals is None else maxIntervals)
+    timePerIntervals = getTimePerIntervals(dss)
+
+    dsi = dss.whichDownsampleIndexForTimespan(timespan, maxIntervals)
+
+    if dsi == -1:
+        # Raw data is used only once the finest downsample has at least two
+        # data points per interval of the budget
+        assert maxTimePerInterval <= timePerIntervals[-1] / 2
+    else:
+        # The downsample delivers no more than the budget, unless even the
+        # coarsest one would exceed it, while the next finer one would not
+        assert timePerIntervals[dsi] >= maxTimePerInterval or dsi == 0
+        if dsi + 1 < len(timePerIntervals):
+            assert timePerIntervals[dsi + 1] < maxTimePerInterval
+
+def test_larger_budgets_choose_finer_downsamples(dss):
+
+    timespan = dss.seriesparent.rd.timespan / 3
+    indices = [dss.whichDownsampleIndexForTimespan(timespan, maxIntervals) for maxIntervals in [100, 200, 400, 800, 1600, 3200, 6400]]
+
+    # Raw data (-1) is the finest of all
+    ranks = [len(indices) * 100 if i == -1 else i for i in indices]
+    assert ranks == sorted(ranks)
+    assert len(set(indices)) > 1
+
+def test_no_budget_targets_m_intervals(dss):
+
+    timespan = dss.seriesparent.rd.timespan / 7
+
+    assert dss.whichDownsampleIndexForTimespan(timespan) == dss.whichDownsampleIndexForTimespan(timespan, config['M'])
+
+def test_short_timespans_use_raw_data(dss):
+
+    assert dss.whichDownsampleIndexForTimespan(dss.getTimePerIntervalByIndex(-1), 100) == -1
+
+def test_point_budget():
+
+    assert getPointBudget() is None
+    assert getPointBudget(points=1000) == 1000
+    assert getPointBudget(width=500) == 500 * config['intervalsPerPixel']
+    assert getPointBudget(points=1000, width=50) == 1000
+    assert getPointBudget(points=1) == MIN_POINT_BUDGET
+    assert getPointBudget(width=10**9) == config['maxPointBudget']
+
+def test_coarsened_intervals_keep_the_extremes_of_each_group():
+
+    rng = np.random.default_rng(0)
+    n = 1003
+    intervals = pd.DataFrame({'0': np.arange(n, dtype=np.float64), '1': rng.normal(size=n), '2': rng.normal(size=n) + 5}, columns=DISPLAY_COLUMNS)
+    intervals.loc[10, '1'] = np.nan
+
+    coarsened = coarsenIntervals(intervals, 100)
+
+    assert coarsened.shape[0] <= 100
+    k = int(np.ceil(n / 100))
+    np.testing.assert_array_equal(coarsened['0'].values, intervals['0'].values[::k])
+    for g in range(coarsened.shape[0]):
+        group = intervals.iloc[g * k:(g + 1) * k]
+        assert coarsened['1'].values[g] == np.nanmin(group['1'].values)
+        assert coarsened['2'].values[g] == np.nanmax(group['2'].values)
+
+def test_intervals_within_the_budget_are_not_coarsened():
+
+    intervals = pd.DataFrame({'0': [0., 1.], '1': [0., 1.], '2': [1., 2.]}, columns=DISPLAY_COLUMNS)
+
+    assert coarsenIntervals(intervals, 100) is intervals
@@ -0,0 +1,57 @@
+import numpy as np
+import pandas as pd
+
+from auviewer.events import EventSeries
+
+def test_event_texts_hold_the_non_empty_values_of_other_columns():
+
+    df = pd.DataFrame({
+        'name': [b'heparin', b'', b'insulin', None],
+        'time': [3.0, 1.0, 2.0, 4.0],
+        'dose': [1.0, np.nan, 2.5, np.nan],
+        'count': [2, 0, 1, 3],
+        'route': pd.Categorical(['iv', '', 'po', 'iv']),
+    })
+
+    events = EventSeries.fromDataFrame(df, 'time')
+
+    assert events.getOutput() == [
+        (3.0, 'heparin\n1.0\n2\niv'),
+        (1.0, '0'),
+        (2.0, 'insulin\n2.5\n1\npo'),
+        (4.0, '3\niv'),
+    ]
+
+def test_event_texts_omit_missing_values_and_decode_byte_strings():
+
+    # Values read from HDF5 as bytes are decoded (invalid UTF-8 is replaced)
+    # rather than shown as their reprs, and NaN & None are omitted rather than
+    # shown as 'nan' & 'None'
+    df = pd.DataFrame({
+        'time': [1.0, 2.0, 3.0],
+        'name': [b'caf\xc3\xa9', b'\xff', None],
+        'dose': [np.nan, 0.5, np.nan],
+    })
+
+    texts = [text for _, text in EventSeries.fromDataFrame(df, 'time').getOutput()]
+
+    assert texts == ['caf\u00e9', '\ufffd\n0.5', '']
+    assert not any("b'" in t or 'nan' in t or 'None' in t for t in texts)
+
+def test_event_output_is_limited_to_time_range():
+
+    events = EventSeries.fromDataFrame(pd.DataFrame({'date': np.arange(10.0), 'event': [f'e{i}' for i in range(10)]}), 'date')
+
+    assert events.getOutput(2.0, 4.0) == [(2.0, 'e2'), (3.0, 'e3'), (4.0, 'e4')]
+    assert events.getOutput(starttime=8.0) == [(8.0, 'e8'), (9.0, 'e9')]
+    assert events.getOutput(20.0, 30.0) == []
+
+def test_empty_event_table():
+    assert EventSeries.fromDataFrame(pd.DataFrame({'time': np.array([], dtype=float), 'name': np.array([], dtype=object)}), 'time').getOutput() == []
+
+def test_event_summary_holds_count_and_time_extent():
+
+    events = EventSeries.fromDataFrame(pd.DataFrame({'date': [5.0, 2.0, 9.0], 'event': ['a', 'b', 'c']}), 'date')
+
+    assert events.getSummary() == {'count': 3, 'start': 2.0, 'stop': 9.0}
+    assert EventSeries(np.array([]), np.array([], dtype=object)).getSummary() == {'count': 0, 'start': None, 'stop': None}
@@ -0,0 +1,89 @@
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import event
+
+from auviewer import models
+from auviewer.file import File
+
+NUM_PATTERN_SETS = 50
+
+# The queries are built without SQLAlchemy coercing them (e.g. subqueries to
+# selects)
+pytestmark = pytest.mark.filterwarnings('error::sqlalchemy.exc.SAWarning')
+
+@pytest.fixture
+def project(app):
+    """A project with one file, a user & another user, and pattern sets which are unassigned, assigned to the user, or
+    assigned to the other user only. Each pattern set holds patterns of the file & another file, and annotations of
+    them by both users."""
+
+    db = models.db
+    user = models.User(email='user@example.com', password='')
+    other = models.User(email='other@example.com', password='')
+    project = models.Project(name='project', path='/data/project')
+    db.session.add_all([user, other, project])
+    db.session.flush()
+
+    file = models.File(project_id=project.id, path='/data/project/originals/file.h5')
+    otherFile = models.File(project_id=project.id, path='/data/project/originals/other.h5')
+    db.session.add_all([file, otherFile])
+    db.session.flush()
+
+    for i in range(NUM_PATTERN_SETS):
+        ps = models.PatternSet(project_id=project.id, name=f'set {i}', show_by_default=i % 2 == 0)
+        if i % 3 == 1:
+            ps.users.append(user)
+        elif i % 3 == 2:
+            ps.users.append(other)
+        db.session.add(ps)
+        db.session.flush()
+        for f in [file, otherFile]:
+            pattern = models.Pattern(pattern_set_id=ps.id, project_id=project.id, file_id=f.id, series='s', left=i, right=i + 1, label=f'p{i}')
+            db.session.add(pattern)
+            db.session.flush()
+            for u in [user, other]:
+                db.session.add(models.Annotation(user_id=u.id, project_id=project.id, file_id=f.id, pattern_id=pattern.id, pattern_set_id=ps.id, series='s', left=i, right=i + 1, label=f'a{i}'))
+
+    for u in [user, other]:
+        db.session.add(models.Annotation(user_id=u.id, project_id=project.id, file_id=file.id, series='s', left=0, right=1, label='general'))
+
+    db.session.commit()
+
+    return SimpleNamespace(id=project.id, user=user.id, file=File(SimpleNamespace(id=project.id), file.id, Path(file.path), Path('/data/project/processed/file_processed.h5')))
+
+# Counts the queries executed against the database while the returned list is
+# being appended to
+@pytest.fixture
+def queries(app):
+    executed = []
+    listener = lambda conn, cursor, statement, *args: executed.append(statement)
+    event.listen(models.db.engine, 'before_cursor_execute', listener)
+    yield executed
+    event.remove(models.db.engine, 'before_cursor_execute', listener)
+
+def test_user_payload_queries_do_not_grow_with_pattern_sets(project, queries):
+
+    models.db.session.expire_all()
+    payload = project.file.getUserPayload(project.user)
+
+    assert len(queries) <= 4
+
+    # Unassigned pattern sets and those assigned to the user are visible
+    visible = [i for i in range(NUM_PATTERN_SETS) if i % 3 != 2]
+    assert [ps['name'] for ps in payload['patternsets']] == [f'set {i}' for i in visible]
+    assert [s['name'] for s in payload['annotationsets']] == ['General'] + [f'set {i}' for i in visible]
+
+def test_user_payload_holds_the_users_annotations_and_the_files_patterns(project):
+
+    payload = project.file.getUserPayload(project.user)
+
+    general = payload['annotationsets'][0]['annotations']
+    assert len(general) == 1 and general[0][2] == 'file.h5' and general[0][8] == 'general'
+
+    for annotationSet, patternSet in zip(payload['annotationsets'][1:], payload['patternsets']):
+        i = int(patternSet['name'].split()[1])
+        assert patternSet['show'] == annotationSet['show'] == (i % 2 == 0)
+        assert [(p[2], p[8]) for p in patternSet['patterns']] == [('file.h5', f'p{i}')]
+        assert [(a[2], a[8], a[9]) for a in annotationSet['annotations']] == [('file.h5', f'a{i}', patternSet['patterns'][0][0])]
@@ -0,0 +1,91 @@
+import h5py
+import numpy as np
+import pytest
+
+from auviewer.layout import TIME_BASE_ATTR, appendToDataset, createDataset, readIntervals
+
+COLUMNS = [str(j) for j in range(8)]
+
+# Returns intervals of 8 columns (time offset, min, max, count, sum, sum of
+# squares, first & last) with time offsets far from zero
+def makeIntervals(n, start=1e9, seed=0):
+    rng = np.random.default_rng(seed)
+    intervals = rng.normal(size=(n, 8))
+    intervals[:,0] = start + np.arange(n) * 0.5
+    intervals[:,3] = rng.integers(1, 100, n)
+    return intervals
+
+def makeLayout(chunkRows=None, compression=None, float32=False, timeOffsets=False):
+    return {'chunkRows': chunkRows, 'compression': compression, 'compressionLevel': None, 'float32': float32, 'timeOffsets': timeOffsets}
+
+LAYOUTS = [
+    makeLayout(),
+    makeLayout(chunkRows=64, compression='gzip'),
+    makeLayout(compression='lzf', timeOffsets=True),
+    makeLayout(chunkRows=16, float32=True, timeOffsets=True),
+]
+
+@pytest.fixture
+def group(tmp_path):
+    with h5py.File(str(tmp_path / 'layout.h5'), 'w') as h:
+        yield h
+
+# Asserts that the intervals read back equal those stored, exactly unless the
+# layout stores values as float32
+def assertSameIntervals(df, intervals, layout):
+    for j, c in enumerate(COLUMNS):
+        expected = intervals[:,j]
+        if layout['float32'] and c in ['1', '2', '6', '7']:
+            expected = expected.astype(np.float32).astype(np.float64)
+        np.testing.assert_array_equal(df[c].to_numpy(), expected, err_msg=c)
+
+@pytest.mark.parametrize('layout', LAYOUTS)
+def test_created_dataset_reads_back_the_intervals(group, layout):
+
+    intervals = makeIntervals(300)
+    ds = createDataset(group, 'd', intervals, layout, 0.5, 150.)
+
+    assertSameIntervals(readIntervals(ds, COLUMNS), intervals, layout)
+    assert ds.attrs[TIME_BASE_ATTR] == (intervals[0,0] if layout['timeOffsets'] else 0.0)
+
+@pytest.mark.parametrize('layout', LAYOUTS)
+def test_appended_dataset_reads_back_all_of_the_intervals(group, layout):
+
+    intervals = makeIntervals(300)
+    ds = createDataset(group, 'd', intervals[:100], layout, 0.5, 150.)
+    appendToDataset(ds, intervals[100:101])
+    appendToDataset(ds, intervals[101:])
+
+    assertSameIntervals(readIntervals(ds, COLUMNS), intervals, layout)
+
+@pytest.mark.parametrize('layout', LAYOUTS)
+def test_read_slice_of_columns(group, layout):
+
+    intervals = makeIntervals(300)
+    ds = createDataset(group, 'd', intervals, layout, 0.5, 150.)
+
+    df = readIntervals(ds, ['0', '3'], 50, 120)
+
+    assert list(df.columns) == ['0', '3']
+    np.testing.assert_array_equal(df['0'].to_numpy(), intervals[50:120,0])
+    np.testing.assert_array_equal(df['3'].to_numpy(), intervals[50:120,3])
+
+def test_relative_time_offsets_are_stored_as_float32_when_resolved(group):
+
+    # Offsets within a short timespan resolve to well within the interval
+    intervals = makeIntervals(300)
+    ds = createDataset(group, 'short', intervals, makeLayout(timeOffsets=True), 0.5, 150.)
+    assert ds.dtype['0'] == np.float32
+
+    # Offsets over a long timespan would not
+    ds = createDataset(group, 'long', intervals, makeLayout(timeOffsets=True), 0.5, 1e9)
+    assert ds.dtype['0'] == np.float64
+    assertSameIntervals(readIntervals(ds, COLUMNS), intervals, makeLayout(timeOffsets=True))
+
+def test_created_dataset_without_intervals_can_be_appended_to(group):
+
+    intervals = makeIntervals(10)
+    ds = createDataset(group, 'd', intervals[:0], makeLayout(), 0.5, 5.)
+    appendToDataset(ds, intervals)
+
+    assertSameIntervals(readIntervals(ds, COLUMNS), intervals, makeLayout())
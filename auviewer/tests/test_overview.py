@@ -0,0 +1,105 @@
+from pathlib import Path
+
+import numpy as np
+
+from auviewer import file as filemodule
+from auviewer.config import config
+from auviewer.file import File
+from auviewer.tests.conftest import readDatasets
+
+WAVEFORM_ID = '/data/waveforms/II:value'
+NUMERICS_ID = '/data/numerics/HR:HR'
+
+# Returns the datasets of the overview of a file (see File.processOverview)
+# which hold downsamples or time indexes, by path
+def readOverviewDatasets(path):
+    return {name: d for name, d in readDatasets(path).items() if name.startswith('data/')}
+
+def test_overview_is_served_while_downsampling_and_replaced_by_the_processed_file(tmp_path, origFile, monkeypatch):
+
+    # The overview holds fewer levels than the processed file
+    monkeypatch.setitem(config, 'downsampleOverviewLevels', 3)
+
+    procPath = tmp_path / 'orig_processed.h5'
+    overviewPath = Path(str(procPath) + '.overview')
+
+    # Opened while the file is being downsampled, as by a user
+    reader = File(None, -1, origFile, procPath)
+
+    checks = []
+    def onSeriesComplete(seriesIDs):
+
+        # The downsamples are incomplete, so the overview is served
+        assert Path(str(procPath) + '.tmp').exists()
+        assert reader.isProgressive()
+        assert Path(reader.pf.hdf.filename) == overviewPath
+
+        _ = reader.f
+        s = reader.getSeries(WAVEFORM_ID)
+        assert 0 < s.dss.numDownsamples <= config['downsampleOverviewLevels']
+        output = s.getFullOutput()
+        assert output['output_type'] == 'downsample' and len(output['data']) > 0
+        checks.append(readOverviewDatasets(overviewPath))
+
+    writer = File(None, -1, origFile, procPath)
+    writer.process(onSeriesComplete=onSeriesComplete)
+    writer.close()
+
+    assert len(checks) > 0
+
+    # Once complete, the overview is deleted & the processed file served
+    # instead
+    assert not overviewPath.exists()
+    assert not reader.isProgressive()
+    assert Path(reader.pf.hdf.filename) == procPath
+    assert reader.getSeries(WAVEFORM_ID).dss.numDownsamples > config['downsampleOverviewLevels']
+
+    # The processed file holds the overview's levels, though built from a
+    # finer level than the overview's own, so their intervals may be bounded
+    # slightly differently. The time index of the raw data is the same.
+    processed = readDatasets(procPath)
+    overview = {name: d for name, d in checks[-1].items() if name.startswith('data/waveforms/')}
+    assert len(overview) == config['downsampleOverviewLevels'] + 1
+    for name, d in overview.items():
+        if d.dtype.names is None:
+            np.testing.assert_array_equal(d, processed[name], err_msg=name)
+            continue
+        assert abs(d.shape[0] - processed[name].shape[0]) <= 1
+        assert np.nanmin(d['1']) == np.nanmin(processed[name]['1'])
+        assert np.nanmax(d['2']) == np.nanmax(processed[name]['2'])
+        assert d['3'].sum() == processed[name]['3'].sum()
+
+    reader.close()
+
+def test_overview_of_visible_series_is_published_first(tmp_path, origFile, monkeypatch):
+
+    procPath = tmp_path / 'orig_processed.h5'
+    overviewPath = Path(str(procPath) + '.overview')
+    reader = File(None, -1, origFile, procPath)
+
+    # Open the overview as published after the visible series, before the
+    # overview of the rest of the series is built
+    published = []
+    processAndStoreOverviewGroup = filemodule.processAndStoreOverviewGroup
+    def readingProcessAndStoreOverviewGroup(seriesGroup, hdf):
+        if any(s.id == WAVEFORM_ID for s in seriesGroup):
+            assert reader.isProgressive()
+            published.append(sorted(readOverviewDatasets(overviewPath)))
+        processAndStoreOverviewGroup(seriesGroup, hdf)
+    monkeypatch.setattr(filemodule, 'processAndStoreOverviewGroup', readingProcessAndStoreOverviewGroup)
+
+    def onSeriesComplete(seriesIDs):
+
+        # The overview was republished with all series, and is reopened
+        assert reader.isProgressive()
+        assert any(name.startswith('data/waveforms/') for name in readOverviewDatasets(reader.pf.hdf.filename))
+
+    writer = File(None, -1, origFile, procPath)
+    writer.process(onSeriesComplete=onSeriesComplete, visibleSeries=[NUMERICS_ID])
+    writer.close()
+
+    assert len(published) == 1
+    assert any(name.startswith('data/numerics/') for name in published[0])
+    assert not any(name.startswith('data/waveforms/') for name in published[0])
+
+    reader.close()
@@ -0,0 +1,71 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from auviewer import downsampleset
+from auviewer.config import config
+from auviewer.cylib import buildDownsampleFromRaw, buildNextDownsampleUp, finishRawChunkState, finishUpChunkState
+from auviewer.downsampleset import buildDownsampleFromRawPartitioned, buildNextDownsampleUpPartitioned
+from auviewer.tests.conftest import assertSameDatasets
+from auviewer.tests.test_cylib import makeSeries
+
+NUM_PARTITIONS = 4
+
+# Splits at the nominal split indices, without seeking interval boundaries, so
+# that partitions begin mid-interval and are rebuilt sequentially when merged
+def getNominalPartitionBoundaries(offsets, baseOffset, timePerInterval, numPartitions):
+    n = offsets.shape[0]
+    return [p * n // numPartitions for p in range(numPartitions)] + [n]
+
+@pytest.fixture(params=['boundary', 'midInterval'])
+def splits(request, monkeypatch):
+    if request.param == 'midInterval':
+        monkeypatch.setattr(downsampleset, 'getPartitionBoundaries', getNominalPartitionBoundaries)
+    return request.param
+
+@pytest.mark.parametrize('aggregates', [False, True])
+def test_partitioned_raw_build_equals_whole_series_build(splits, aggregates):
+
+    offsets, values = makeSeries()
+    whole = buildDownsampleFromRaw(offsets, values, 600, aggregates)
+
+    with ThreadPoolExecutor(max_workers=NUM_PARTITIONS) as executor:
+        completed, state = buildDownsampleFromRawPartitioned(offsets, values, 600, NUM_PARTITIONS, executor, aggregates)
+
+    np.testing.assert_array_equal(np.concatenate([completed, finishRawChunkState(state)]), whole)
+
+@pytest.mark.parametrize('aggregates', [False, True])
+def test_partitioned_up_build_equals_whole_downsample_build(splits, aggregates):
+
+    offsets, values = makeSeries()
+    timePerInterval = (offsets[-1] - offsets[0]) / 5000
+    orig = buildDownsampleFromRaw(offsets, values, 5000, aggregates)
+    whole = buildNextDownsampleUp(orig, timePerInterval, 3)
+
+    with ThreadPoolExecutor(max_workers=NUM_PARTITIONS) as executor:
+        completed, state = buildNextDownsampleUpPartitioned(orig, timePerInterval, 3, NUM_PARTITIONS, executor)
+
+    np.testing.assert_array_equal(np.concatenate([completed, finishUpChunkState(state)]), whole)
+
+def test_nominal_splits_fall_mid_interval():
+
+    # Guards that the midInterval case above indeed exercises the sequential
+    # rebuild of partitions
+    offsets, values = makeSeries()
+    timePerInterval = (offsets[-1] - offsets[0]) / 600
+    boundaries = getNominalPartitionBoundaries(offsets, offsets[0], timePerInterval, NUM_PARTITIONS)
+    intervalIndices = np.floor((offsets - offsets[0]) / timePerInterval)
+    assert any(intervalIndices[b - 1] == intervalIndices[b] for b in boundaries[1:-1])
+
+def test_partitioned_threaded_processing_equals_single_threaded_processing(processFile, monkeypatch, splits):
+
+    monkeypatch.setattr(downsampleset, 'MIN_PARTITION_LENGTH', 1000)
+
+    monkeypatch.setitem(config, 'downsamplePartitions', 1)
+    sequential = processFile('sequential.h5', threads=1)
+
+    monkeypatch.setitem(config, 'downsamplePartitions', NUM_PARTITIONS)
+    partitioned = processFile('partitioned.h5', threads=2)
+
+    assertSameDatasets(sequential, partitioned)
@@ -0,0 +1,164 @@
+from concurrent.futures import ThreadPoolExecutor
+import os
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from auviewer import file, payloadcache
+from auviewer.config import config
+from auviewer.file import File
+from auviewer.payloadcache import SharedPayloadCache, getBlobPathObj, getBlobPathObjs, getPointBudgetBucket, readBlob, writeBlob
+
+VERSION = (1, 2, 'lttb')
+
+# Returns a shared payload with the series data as columns
+def makePayload():
+    return {
+        'eventSeries': {},
+        'metadata': {'name': 'file'},
+        'preview': False,
+        'series': {
+            '/data/numerics/HR:HR': {
+                'id': '/data/numerics/HR:HR',
+                'output_type': 'real',
+                'columns': {'time': np.arange(4) * 0.5, 'value': np.array([60., 61., np.nan, 63.])},
+            },
+        },
+    }
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = SharedPayloadCache()
+    monkeypatch.setattr(payloadcache, 'sharedPayloadCache', cache)
+    monkeypatch.setattr(file, 'sharedPayloadCache', cache)
+    return cache
+
+@pytest.mark.parametrize('maxPoints, bucket', [
+    (None, None),
+    (0, 1),
+    (1, 1),
+    (1000, 1024),
+    (1024, 1024),
+    (1025, 2048),
+    # Buckets are no more than the maximum point budget, unless the requested
+    # budget is more
+    (19000, 20000),
+    (30000, 30000),
+])
+def test_point_budget_buckets(monkeypatch, maxPoints, bucket):
+    monkeypatch.setitem(config, 'maxPointBudget', 20000)
+    assert getPointBudgetBucket(maxPoints) == bucket
+
+def test_blobs_are_read_only_for_their_version(tmp_path):
+
+    pathObj = getBlobPathObj(tmp_path / 'file.h5', 1024)
+    writeBlob(pathObj, VERSION, makePayload())
+
+    payload = readBlob(pathObj, VERSION)
+    expected = makePayload()
+    assert payload['metadata'] == expected['metadata']
+    np.testing.assert_array_equal(payload['series']['/data/numerics/HR:HR']['columns']['value'], expected['series']['/data/numerics/HR:HR']['columns']['value'])
+
+    assert readBlob(pathObj, (1, 3, 'lttb')) is None
+    assert readBlob(getBlobPathObj(tmp_path / 'file.h5', 2048), VERSION) is None
+
+def test_blobs_of_a_previous_content_version_are_not_read(tmp_path, monkeypatch):
+
+    pathObj = getBlobPathObj(tmp_path / 'file.h5', None)
+    writeBlob(pathObj, VERSION, makePayload())
+
+    monkeypatch.setattr(payloadcache, 'BLOB_CONTENT_VERSION', payloadcache.BLOB_CONTENT_VERSION + 1)
+    assert readBlob(pathObj, VERSION) is None
+
+def test_least_recently_written_blobs_are_pruned(tmp_path, monkeypatch):
+
+    monkeypatch.setitem(config, 'payloadBlobsPerFile', 2)
+    procPathObj = tmp_path / 'file.h5'
+
+    # Blobs of another processed file are left alone
+    writeBlob(getBlobPathObj(tmp_path / 'other.h5', 1), VERSION, makePayload())
+
+    for i, maxPoints in enumerate([1024, 2048, 4096]):
+        pathObj = getBlobPathObj(procPathObj, maxPoints)
+        writeBlob(pathObj, VERSION, makePayload())
+        os.utime(pathObj, ns=(i * 10 ** 9, i * 10 ** 9))
+
+    assert sorted(p.name for p in getBlobPathObjs(tmp_path, procPathObj.name + '.payload')) == ['file.h5.payload-2048', 'file.h5.payload-4096']
+    assert getBlobPathObj(tmp_path / 'other.h5', 1).exists()
+    assert not any(p.name.endswith('.tmp') for p in tmp_path.iterdir())
+
+def test_concurrent_misses_load_once(cache):
+
+    NUM_CALLERS = 8
+    calls = []
+    released = threading.Event()
+
+    def load():
+        calls.append(1)
+        released.wait(5)
+        return makePayload()
+
+    executor = ThreadPoolExecutor(max_workers=NUM_CALLERS)
+    futures = [executor.submit(cache.get, 'key', load) for _ in range(NUM_CALLERS)]
+
+    # Wait for the other callers to join the first one's load before releasing it
+    for _ in range(500):
+        if cache.flights.coalesced == NUM_CALLERS - 1:
+            break
+        time.sleep(0.01)
+    released.set()
+    executor.shutdown(wait=True)
+
+    assert len(calls) == 1
+    assert len({id(f.result()) for f in futures}) == 1
+    assert cache.getStats()['payloads'] == 1
+
+    # Later calls are served from the cache
+    assert cache.get('key', load) is futures[0].result()
+    assert len(calls) == 1
+
+# Returns a reader of the processed original file, as served once downsampled
+@pytest.fixture
+def servedFile(processFile, origFile):
+    f = File(None, -1, origFile, processFile('orig_processed.h5'))
+    yield f
+    f.close()
+
+def test_payloads_are_reloaded_when_the_processed_file_changes(servedFile, cache):
+
+    assert not servedFile.isPreview() and not servedFile.isProgressive()
+
+    first = servedFile.getSharedPayload(1000, columnar=True)
+    assert servedFile.getSharedPayload(1000, columnar=True) is first
+    assert cache.getStats()['payloads'] == 1
+
+    # The payload is keyed by the processed file's modification time & size
+    st = servedFile.procFilePathObj.stat()
+    os.utime(servedFile.procFilePathObj, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+
+    second = servedFile.getSharedPayload(1000, columnar=True)
+    assert second is not first
+    assert cache.getStats()['payloads'] == 2
+    assert cache.getStats()['misses'] == 2
+
+def test_blobs_deleted_while_pruning_are_skipped(tmp_path, monkeypatch):
+
+    monkeypatch.setitem(config, 'payloadBlobsPerFile', 1)
+    procPathObj = tmp_path / 'file.h5'
+    gone = getBlobPathObj(procPathObj, 1024)
+    writeBlob(gone, VERSION, makePayload())
+
+    # Another writer deletes the blob as it is listed
+    def getBlobPathObjsThenDelete(folderPathObj, prefix):
+        blobs = getBlobPathObjs(folderPathObj, prefix)
+        gone.unlink(missing_ok=True)
+        return blobs
+
+    monkeypatch.setattr(payloadcache, 'getBlobPathObjs', getBlobPathObjsThenDelete)
+
+    pathObj = getBlobPathObj(procPathObj, 2048)
+    writeBlob(pathObj, VERSION, makePayload())
+
+    assert readBlob(pathObj, VERSION) is not None
@@ -0,0 +1,143 @@
+import threading
+import time
+
+import pytest
+
+from auviewer import prefetch
+from auviewer.config import config
+from auviewer.prefetch import Prefetcher, getAdjacentRanges, prefetchAdjacentRanges
+
+# Seconds to wait for prefetches before failing
+TIMEOUT = 5
+
+# Waits until predicate() is true, failing after TIMEOUT seconds
+def waitFor(predicate):
+    for _ in range(TIMEOUT * 100):
+        if predicate():
+            return
+        time.sleep(0.01)
+    raise AssertionError('Timed out')
+
+@pytest.fixture
+def prefetcher(monkeypatch):
+    monkeypatch.setitem(config, 'prefetchBudget', 3)
+    monkeypatch.setitem(config, 'prefetchThreads', 2)
+    prefetcher = Prefetcher()
+    monkeypatch.setattr(prefetch, 'prefetcher', prefetcher)
+    yield prefetcher
+    prefetcher.shutdown()
+
+class FakeFile:
+    """Stands in for a File, recording the ranges of which its series output is read."""
+
+    def __init__(self, preview=False, progressive=False):
+        self.preview = preview
+        self.progressive = progressive
+        self.reads = []
+
+    def isPreview(self):
+        return self.preview
+
+    def isProgressive(self):
+        return self.progressive
+
+    def getSeriesRangedOutput(self, seriesids, start, stop, maxPoints=None, columnar=False):
+        self.reads.append((seriesids, start, stop, maxPoints, columnar))
+
+def test_oldest_pending_ranges_beyond_the_budget_are_dropped(prefetcher):
+
+    calls = []
+
+    # Hold a foreground request so that nothing is read while queueing
+    with prefetcher.foreground():
+        for i in range(5):
+            prefetcher.submit('a', calls.append, (('a', i),))
+        prefetcher.submit('b', calls.append, (('b', 0),))
+
+        assert [entry[3] for entry in prefetcher.queue] == [True, True, False, False, False, False]
+        assert prefetcher.getStats() == {'pending': 4, 'completed': 0, 'dropped': 2, 'failed': 0}
+
+    waitFor(lambda: prefetcher.getStats()['completed'] == 4)
+
+    assert sorted(calls) == [('a', 2), ('a', 3), ('a', 4), ('b', 0)]
+    assert prefetcher.getStats() == {'pending': 0, 'completed': 4, 'dropped': 2, 'failed': 0}
+
+def test_prefetching_is_paused_during_foreground_requests(prefetcher):
+
+    calls = []
+
+    with prefetcher.foreground():
+        with prefetcher.foreground():
+            prefetcher.submit('a', calls.append, (1,))
+        time.sleep(0.1)
+        assert calls == []
+        assert prefetcher.getStats()['pending'] == 1
+
+    waitFor(lambda: calls == [1])
+
+def test_failed_prefetches_are_counted(prefetcher):
+
+    prefetcher.submit('a', lambda: 1 / 0, ())
+    waitFor(lambda: prefetcher.getStats()['failed'] == 1)
+
+    assert prefetcher.getStats()['completed'] == 0
+
+def test_shutdown_waits_for_the_range_being_read(prefetcher, monkeypatch):
+
+    # With one thread, the second range remains pending while the first is read
+    monkeypatch.setitem(config, 'prefetchThreads', 1)
+    started = threading.Event()
+    released = threading.Event()
+
+    def read():
+        started.set()
+        released.wait(TIMEOUT)
+
+    prefetcher.submit('a', read, ())
+    prefetcher.submit('a', lambda: None, ())
+    assert started.wait(TIMEOUT)
+
+    shutdown = threading.Thread(target=prefetcher.shutdown)
+    shutdown.start()
+    time.sleep(0.1)
+    assert shutdown.is_alive()
+
+    released.set()
+    shutdown.join(TIMEOUT)
+    assert not shutdown.is_alive()
+    assert len(prefetcher.threads) == 1
+    assert not any(thread.is_alive() for thread in prefetcher.threads)
+
+    # Pending ranges are dropped, and no more are queued
+    prefetcher.submit('a', lambda: None, ())
+    assert prefetcher.getStats() == {'pending': 0, 'completed': 1, 'dropped': 0, 'failed': 0}
+
+def test_prefetching_is_disabled_by_a_zero_budget(prefetcher, monkeypatch):
+
+    monkeypatch.setitem(config, 'prefetchBudget', 0)
+    prefetcher.submit('a', lambda: None, ())
+
+    assert prefetcher.getStats()['pending'] == 0
+    assert prefetcher.threads == []
+
+def test_adjacent_ranges_of_a_view_are_prefetched(prefetcher):
+
+    file = FakeFile()
+    prefetchAdjacentRanges('a', file, ['s'], 10, 20, 1000)
+    waitFor(lambda: prefetcher.getStats()['completed'] == 3)
+
+    assert sorted(file.reads) == sorted((['s'], a, b, 1000, True) for a, b in getAdjacentRanges(10, 20))
+    assert sorted(getAdjacentRanges(10, 20)) == [(0, 10), (0, 30), (20, 30)]
+
+@pytest.mark.parametrize('file, starttime, stoptime', [
+    (FakeFile(preview=True), 10, 20),
+    (FakeFile(progressive=True), 10, 20),
+    (FakeFile(), None, 20),
+    (FakeFile(), 20, 20),
+])
+def test_files_being_downsampled_and_empty_views_are_not_prefetched(prefetcher, file, starttime, stoptime):
+
+    prefetchAdjacentRanges('a', file, ['s'], starttime, stoptime)
+
+    assert prefetcher.getStats()['pending'] == 0
+    assert prefetcher.threads == []
@@ -0,0 +1,97 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from auviewer import rawdata
+from auviewer.file import File
+from auviewer.project import Project
+from auviewer.rawdata import getPreviewBlocks
+from auviewer.tests.conftest import readDatasets
+
+SERIES_ID = '/data/waveforms/II:value'
+
+# Returns the raw data of the waveform of the original file, which has not been
+# processed
+@pytest.fixture
+def rd(tmp_path, origFile):
+    f = File(None, -1, origFile, tmp_path / 'orig_processed.h5')
+    _ = f.f
+    yield f.getSeries(SERIES_ID).rd
+    f.close()
+
+# Counts the rows read from raw data while the returned list is appended to
+@pytest.fixture
+def rowsRead(monkeypatch):
+    rowsRead = []
+    readColumns = rawdata.readColumns
+    def countingReadColumns(ds, columns, start=None, stop=None):
+        rows = readColumns(ds, columns, start, stop)
+        rowsRead.append(rows.shape[0])
+        return rows
+    monkeypatch.setattr(rawdata, 'readColumns', countingReadColumns)
+    return rowsRead
+
+def test_preview_blocks_cover_all_rows_up_to_the_cap(monkeypatch):
+
+    monkeypatch.setattr(rawdata, 'PREVIEW_CHUNK_ROWS', 1000)
+    monkeypatch.setattr(rawdata, 'PREVIEW_MAX_ROWS', 10000)
+
+    assert getPreviewBlocks(5, 2505) == [(5, 1005), (1005, 2005), (2005, 2505)]
+
+def test_preview_blocks_beyond_the_cap_are_spread_over_the_rows(monkeypatch):
+
+    monkeypatch.setattr(rawdata, 'PREVIEW_MAX_ROWS', 1000)
+    monkeypatch.setattr(rawdata, 'PREVIEW_BLOCK_ROWS', 100)
+
+    blocks = getPreviewBlocks(500, 100500)
+
+    assert len(blocks) == 10
+    assert blocks[0] == (500, 600) and blocks[-1] == (100400, 100500)
+    assert all(b - a == 100 for a, b in blocks)
+    assert all(blocks[i][1] <= blocks[i + 1][0] for i in range(len(blocks) - 1))
+
+def test_preview_of_a_long_series_reads_at_most_the_cap(rd, rowsRead, monkeypatch):
+
+    full, fullType = rd.getPreviewColumns(numIntervals=100)
+    assert fullType == 'downsample'
+    assert sum(rowsRead) >= rd.len
+
+    monkeypatch.setattr(rawdata, 'PREVIEW_MAX_ROWS', 20000)
+    monkeypatch.setattr(rawdata, 'PREVIEW_BLOCK_ROWS', 100)
+    rd.fullPreview = None
+    rowsRead.clear()
+
+    sampled, sampledType = rd.getPreviewColumns(numIntervals=100)
+
+    assert sampledType == 'downsample'
+    assert sum(rowsRead) <= 20000 + 2
+
+    # The sampled preview covers the intervals of the full one, within their
+    # extremes
+    np.testing.assert_array_equal(sampled['time'], full['time'])
+    assert (sampled['min'] >= full['min']).all()
+    assert (sampled['max'] <= full['max']).all()
+
+def test_preview_of_a_range_reads_at_most_the_cap(rd, rowsRead, origFile, monkeypatch):
+
+    monkeypatch.setattr(rawdata, 'PREVIEW_MAX_ROWS', 20000)
+    monkeypatch.setattr(rawdata, 'PREVIEW_BLOCK_ROWS', 100)
+
+    times = readDatasets(origFile)['data/waveforms/II']['time']
+    preview, outputType = rd.getPreviewColumns(times[1000], times[150000], 100)
+
+    assert outputType == 'downsample'
+    assert sum(rowsRead) <= 20000
+    assert preview['time'][0] >= times[1000] and preview['time'][-1] <= times[150000]
+
+def test_unparsable_project_templates_show_all_series():
+
+    assert Project.getVisibleSeriesIDs(SimpleNamespace(projectTemplateSeries=None)) is None
+
+def test_visible_series_of_the_project_template():
+
+    series = {'_default': {'show': False}, 'a': {'show': True, 'members': ['b']}, 'c': {'show': False}}
+
+    assert Project.getVisibleSeriesIDs(SimpleNamespace(projectTemplateSeries=series)) == ['a', 'b']
+    assert Project.getVisibleSeriesIDs(SimpleNamespace(projectTemplateSeries={'_default': {'show': True}})) is None
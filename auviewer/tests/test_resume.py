@@ -0,0 +1,106 @@
+from pathlib import Path
+
+import pytest
+
+from auviewer import api, models
+from auviewer.config import config
+from auviewer.downsamplequeue import DownsampleQueue
+from auviewer.file import File
+from auviewer.shared import getProcFNFromOrigFN
+from auviewer.tests.conftest import assertSameDatasets
+
+# Series of the dataset downsampled first, ahead of the waveform, so that the
+# waveform remains to be downsampled when interrupted
+VISIBLE_SERIES = ['/data/numerics/HR:HR']
+
+class Killed(BaseException):
+    """Simulates the worker process being killed, which leaves the processed file partially completed."""
+
+# Processes the original file into the destination folder, and kills the
+# processing once the first group of series has been completed. Returns the IDs
+# of the series completed.
+def processUntilKilled(origFile, destination):
+
+    completed = []
+    def onSeriesComplete(seriesIDs):
+        completed.extend(seriesIDs)
+        raise Killed()
+
+    f = File(None, -1, origFile, destination / getProcFNFromOrigFN(origFile))
+    with pytest.raises(Killed):
+        f.process(onSeriesComplete=onSeriesComplete, visibleSeries=VISIBLE_SERIES)
+    f._processed_file.close()
+    f.close()
+
+    assert set(completed) >= set(VISIBLE_SERIES)
+    return completed
+
+@pytest.fixture
+def uninterrupted(tmp_path, origFile):
+    destination = tmp_path / 'uninterrupted'
+    destination.mkdir()
+    api.downsampleFile(str(origFile), str(destination))
+    return destination / getProcFNFromOrigFN(origFile)
+
+@pytest.fixture
+def interrupted(tmp_path, origFile):
+    destination = tmp_path / 'interrupted'
+    destination.mkdir()
+    return destination, processUntilKilled(origFile, destination)
+
+@pytest.fixture
+def restarts(monkeypatch):
+    restarts = []
+    monkeypatch.setattr(api, 'reportJobRestarted', lambda: restarts.append(1))
+    return restarts
+
+def test_resumed_processing_equals_uninterrupted_processing(origFile, uninterrupted, interrupted, restarts):
+
+    destination, completed = interrupted
+    procPath = destination / getProcFNFromOrigFN(origFile)
+    assert Path(str(procPath) + '.tmp').exists()
+
+    api.downsampleFile(str(origFile), str(destination), resume=completed, visibleSeries=VISIBLE_SERIES)
+
+    assert restarts == []
+    assert not Path(str(procPath) + '.tmp').exists()
+    assertSameDatasets(procPath, uninterrupted)
+
+def test_processing_restarts_from_scratch_when_it_cannot_be_resumed(origFile, uninterrupted, interrupted, restarts, monkeypatch):
+
+    destination, completed = interrupted
+
+    # The partially completed processed file was built in another layout
+    monkeypatch.setitem(config, 'downsampleCompression', 'lzf')
+
+    api.downsampleFile(str(origFile), str(destination), resume=completed, visibleSeries=VISIBLE_SERIES)
+
+    assert restarts == [1]
+    assertSameDatasets(destination / getProcFNFromOrigFN(origFile), uninterrupted)
+
+def test_restarted_jobs_forget_their_completed_series(app):
+
+    project = models.Project(name='project', path='/data/project')
+    models.db.session.add(project)
+    models.db.session.flush()
+    file = models.File(project_id=project.id, path='/data/project/originals/file.h5')
+    models.db.session.add(file)
+    models.db.session.flush()
+    job = models.DownsampleJob(file_id=file.id, type='DOWNSAMPLE', status='RUNNING', priority=0)
+    models.db.session.add(job)
+    models.db.session.commit()
+    jobID = job.id
+
+    queue = DownsampleQueue(app, concurrency=1)
+    try:
+        queue.jobIDs['key'] = jobID
+        queue.handleEvent('key', 'series', {'series': ['a', 'b'], 'numSeries': 3})
+        assert {s.series for s in models.DownsampleJob.query.get(jobID).series} == {'a', 'b'}
+
+        queue.handleEvent('key', 'restarted', None)
+        assert models.DownsampleJob.query.get(jobID).series == []
+
+        queue.handleEvent('key', 'series', {'series': ['b'], 'numSeries': 3})
+        assert [s.series for s in models.DownsampleJob.query.get(jobID).series] == ['b']
+    finally:
+        queue.shutdown()
@@ -0,0 +1,201 @@
+import json
+import os
+import threading
+import time
+
+import pytest
+
+from auviewer import scheduler as schedulerModule
+from auviewer.config import config
+from auviewer.scheduler import DownsampleScheduler, PRIORITY_DEFAULT, PRIORITY_REQUESTED, initializeWorker, runJob
+
+# Memory limit of jobs in megabytes, where limited
+JOB_MEMORY_LIMIT = 64
+
+# Seconds to wait for a job event before failing
+TIMEOUT = 30
+
+# Job which waits until the file at path exists, so that the jobs submitted
+# after it are queued
+def waitForFile(path):
+    for _ in range(TIMEOUT * 100):
+        if os.path.exists(path):
+            return
+        time.sleep(0.01)
+    raise TimeoutError(path)
+
+def succeed():
+    return None
+
+def fail():
+    raise ValueError('failed')
+
+# Job which records the ID of its worker process & its data segment size limit
+# to the file at path, then allocates megabytes of memory
+def allocate(path, megabytes):
+    import resource
+    with open(path, 'w') as f:
+        json.dump({'pid': os.getpid(), 'limit': resource.getrlimit(resource.RLIMIT_DATA)[0]}, f)
+    data = bytearray(megabytes * 1024 * 1024)
+    data[-1] = 1
+
+# Job whose worker process dies abruptly, as when killed for running out of
+# memory
+def crash():
+    os._exit(1)
+
+class Events:
+    """Records the events of a scheduler's jobs, as (key, event, data) tuples, in the order they are received."""
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.events = []
+
+    def __call__(self, key, event, data):
+        with self.condition:
+            self.events.append((key, event, data))
+            self.condition.notify_all()
+
+    # Waits until the jobs with the given keys have completed or failed, and
+    # returns the events received
+    def waitForJobs(self, *keys):
+        with self.condition:
+            assert self.condition.wait_for(lambda: set(keys) <= {k for k, e, _ in self.events if e in ('completed', 'failed')}, TIMEOUT)
+            return list(self.events)
+
+    # Waits until the job with the given key has started
+    def waitForStart(self, key):
+        with self.condition:
+            assert self.condition.wait_for(lambda: (key, 'started', None) in self.events, TIMEOUT)
+
+    def getStarted(self):
+        with self.condition:
+            return [k for k, e, _ in self.events if e == 'started']
+
+    def getResult(self, key):
+        with self.condition:
+            return next((e, d) for k, e, d in self.events if k == key and e in ('completed', 'failed'))
+
+@pytest.fixture
+def events():
+    return Events()
+
+@pytest.fixture
+def scheduler(events):
+    scheduler = DownsampleScheduler(concurrency=1, onEvent=events)
+    yield scheduler
+    scheduler.shutdown()
+
+def test_requested_jobs_start_before_earlier_default_jobs(scheduler, events, tmp_path):
+
+    release = str(tmp_path / 'release')
+    scheduler.submit('blocker', waitForFile, (release,))
+    events.waitForStart('blocker')
+    for key in ['a', 'b']:
+        assert scheduler.submit(key, succeed, priority=PRIORITY_DEFAULT)
+    assert scheduler.submit('c', succeed, priority=PRIORITY_REQUESTED)
+
+    open(release, 'w').close()
+    events.waitForJobs('blocker', 'a', 'b', 'c')
+
+    assert events.getStarted() == ['blocker', 'c', 'a', 'b']
+
+def test_prioritized_jobs_start_once(scheduler, events, tmp_path):
+
+    release = str(tmp_path / 'release')
+    scheduler.submit('blocker', waitForFile, (release,))
+    events.waitForStart('blocker')
+    for key in ['a', 'b']:
+        scheduler.submit(key, succeed)
+
+    # Resubmitting a queued job raises its priority rather than queueing it
+    # again, leaving a superseded entry in the heap
+    assert scheduler.prioritize('b')
+    assert not scheduler.submit('b', succeed, priority=PRIORITY_REQUESTED)
+    assert len(scheduler.queue) == 3
+
+    open(release, 'w').close()
+    events.waitForJobs('blocker', 'a', 'b')
+
+    assert events.getStarted() == ['blocker', 'b', 'a']
+    assert not scheduler.isScheduled('b')
+    assert not scheduler.prioritize('b')
+
+def test_failed_jobs_report_their_error(scheduler, events):
+
+    scheduler.submit('failing', fail)
+    scheduler.submit('succeeding', succeed)
+    events.waitForJobs('failing', 'succeeding')
+
+    assert events.getResult('failing') == ('failed', 'ValueError: failed')
+    assert events.getResult('succeeding') == ('completed', None)
+
+def test_pool_is_replaced_when_a_worker_dies(scheduler, events):
+
+    # The job queued behind the crashing one runs in the replacement pool
+    scheduler.submit('crashing', crash)
+    scheduler.submit('queued', succeed)
+    events.waitForJobs('crashing', 'queued')
+
+    assert events.getResult('crashing')[0] == 'failed'
+    assert 'BrokenProcessPool' in events.getResult('crashing')[1]
+    assert events.getResult('queued') == ('completed', None)
+
+    # As do jobs submitted after the crash
+    scheduler.submit('later', succeed)
+    events.waitForJobs('later')
+
+    assert events.getResult('later') == ('completed', None)
+
+def test_worker_memory_budget_is_limited_per_thread(monkeypatch):
+
+    monkeypatch.setattr(schedulerModule, 'workerEvents', None)
+    monkeypatch.setattr(schedulerModule, 'workerJobMemoryLimit', None)
+    monkeypatch.setitem(config, 'downsampleThreads', 4)
+    monkeypatch.setitem(config, 'downsampleMemoryBudget', 1000)
+
+    initializeWorker(JOB_MEMORY_LIMIT, None)
+
+    assert config['downsampleMemoryBudget'] == JOB_MEMORY_LIMIT // 4
+    assert schedulerModule.workerJobMemoryLimit == JOB_MEMORY_LIMIT
+
+def test_job_memory_limit_is_set_for_each_job_and_restored(monkeypatch):
+
+    resource = pytest.importorskip('resource')
+    monkeypatch.setattr(schedulerModule, 'workerJobMemoryLimit', JOB_MEMORY_LIMIT)
+
+    limits = resource.getrlimit(resource.RLIMIT_DATA)
+    limit = runJob('job', resource.getrlimit, (resource.RLIMIT_DATA,))[0]
+
+    # The limit is relative to the memory used as the job starts
+    assert limit != resource.RLIM_INFINITY
+    assert limit >= JOB_MEMORY_LIMIT * 1024 * 1024
+    assert resource.getrlimit(resource.RLIMIT_DATA) == limits
+
+    # Also when the job fails
+    with pytest.raises(ValueError):
+        runJob('job', fail, ())
+    assert resource.getrlimit(resource.RLIMIT_DATA) == limits
+
+def test_jobs_exceeding_the_memory_limit_fail_and_the_worker_runs_the_next(events, tmp_path):
+
+    resource = pytest.importorskip('resource')
+    scheduler = DownsampleScheduler(concurrency=1, jobMemoryLimit=JOB_MEMORY_LIMIT, onEvent=events)
+    try:
+        scheduler.submit('exceeding', allocate, (str(tmp_path / 'exceeding'), 8 * JOB_MEMORY_LIMIT))
+        scheduler.submit('within', allocate, (str(tmp_path / 'within'), JOB_MEMORY_LIMIT // 4))
+        events.waitForJobs('exceeding', 'within')
+    finally:
+        scheduler.shutdown()
+
+    assert events.getResult('exceeding')[0] == 'failed'
+    assert events.getResult('exceeding')[1].startswith('MemoryError')
+    assert events.getResult('within') == ('completed', None)
+
+    # The next job ran in the same worker, under a limit of its own
+    with open(tmp_path / 'exceeding') as f:
+        exceeding = json.load(f)
+    with open(tmp_path / 'within') as f:
+        within = json.load(f)
+    assert within['pid'] == exceeding['pid']
+    assert resource.RLIM_INFINITY not in (exceeding['limit'], within['limit'])
@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+
+from auviewer.shared import getStatisticsFromAggregates
+from auviewer.tests.conftest import readDatasets
+
+def test_statistics_from_aggregates():
+
+    values = np.array([1., 2., 4., 9.])
+    statistics = getStatisticsFromAggregates(values.shape[0], values.sum(), np.dot(values, values), 1., 9., 2.)
+
+    assert statistics['count'] == 4
+    assert statistics['mean'] == pytest.approx(values.mean())
+    assert statistics['variance'] == pytest.approx(values.var())
+    assert statistics['density'] == 2.
+    assert statistics['first'] == 1.
+    assert statistics['last'] == 9.
+
+def test_statistics_from_aggregates_of_an_empty_range():
+
+    statistics = getStatisticsFromAggregates(0, 0., 0., None, None, 0.)
+
+    assert statistics == {'count': 0, 'mean': None, 'variance': None, 'density': None, 'first': None, 'last': None}
+
+def test_variance_from_aggregates_is_not_negative():
+
+    # The sum of squares less the squared mean may round below zero for
+    # constant values
+    values = np.full(3, 0.1)
+    statistics = getStatisticsFromAggregates(values.shape[0], values.sum(), np.dot(values, values), 0.1, 0.1, 1.)
+
+    assert statistics['variance'] >= 0
+
+# Returns the raw data of the waveform
+def getRaw(origFile):
+    return readDatasets(origFile)['data/waveforms/II']
+
+# Returns the statistics of the raw values of the waveform within starttime to
+# stoptime
+def getExpectedStatistics(origFile, starttime, stoptime):
+    raw = getRaw(origFile)
+    values = raw['value'][(raw['time'] >= starttime) & (raw['time'] <= stoptime)]
+    return values.shape[0], values.mean(), values.var(), values[0], values[-1]
+
+def test_statistics_of_the_whole_series_from_downsample_aggregates(processedFile, origFile):
+
+    s = processedFile.getSeries('/data/waveforms/II:value')
+    times = getRaw(origFile)['time']
+    starttime, stoptime = times[0], times[-1]
+
+    output = s.getStatistics(starttime, stoptime)
+
+    assert output['output_type'] == 'downsample'
+    count, mean, variance, first, last = getExpectedStatistics(origFile, starttime, stoptime)
+    statistics = output['statistics']
+    assert statistics['count'] == count
+    assert statistics['mean'] == pytest.approx(mean)
+    assert statistics['variance'] == pytest.approx(variance)
+    assert statistics['density'] == pytest.approx(count / (stoptime - starttime))
+    assert statistics['first'] == first
+    assert statistics['last'] == last
+
+def test_statistics_of_a_short_range_from_raw_data(processedFile, origFile):
+
+    s = processedFile.getSeries('/data/waveforms/II:value')
+    times = getRaw(origFile)['time']
+    starttime, stoptime = times[1000], times[1500]
+
+    output = s.getStatistics(starttime, stoptime)
+
+    assert output['output_type'] == 'real'
+    count, mean, variance, first, last = getExpectedStatistics(origFile, starttime, stoptime)
+    statistics = output['statistics']
+    assert statistics['count'] == count
+    assert statistics['mean'] == pytest.approx(mean)
+    assert statistics['variance'] == pytest.approx(variance)
+    assert statistics['first'] == first
+    assert statistics['last'] == last
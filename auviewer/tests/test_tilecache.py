@@ -0,0 +1,124 @@
+import os
+
+import numpy as np
+import pytest
+
+from auviewer import tilecache
+from auviewer.config import config
+from auviewer.tilecache import TileCache, getFileVersion, getTiledRange
+
+TILE_WIDTH = 10.
+
+# Rows of a dataset with times 0, 0.5, ... 999.5 and their indices as values
+ROWS = np.column_stack([np.arange(2000) * 0.5, np.arange(2000, dtype=np.float64)])
+
+# Returns the rows expected within starttime and stoptime (inclusive)
+def getExpected(rows, starttime, stoptime):
+    return rows[(rows[:, 0] >= starttime) & (rows[:, 0] <= stoptime)]
+
+# Returns a loadRange function over the rows (see getTiledRange) which records
+# the ranges loaded
+def newLoadRange(rows, loaded):
+    def loadRange(a, b):
+        loaded.append((a, b))
+        return rows[(rows[:, 0] >= a) & (rows[:, 0] < b)]
+    return loadRange
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = TileCache()
+    monkeypatch.setattr(tilecache, 'tileCache', cache)
+    monkeypatch.setitem(config, 'tileCacheBudget', 64)
+    return cache
+
+@pytest.mark.parametrize('starttime, stoptime', [(0., 10.), (10., 20.), (9.5, 10.), (10., 10.), (15., 15.25), (3., 97.5), (990., 1000.)])
+def test_ranges_at_tile_boundaries(cache, starttime, stoptime):
+
+    loaded = []
+    rows = getTiledRange('key', TILE_WIDTH, starttime, stoptime, newLoadRange(ROWS, loaded))
+
+    np.testing.assert_array_equal(rows, getExpected(ROWS, starttime, stoptime))
+
+    # Only the tiles spanning the range are loaded, each over its full width
+    first, last = int(starttime // TILE_WIDTH), int(stoptime // TILE_WIDTH)
+    assert loaded == [(k * TILE_WIDTH, (k + 1) * TILE_WIDTH) for k in range(first, last + 1)]
+
+def test_overlapping_ranges_share_tiles(cache):
+
+    loaded = []
+    getTiledRange('key', TILE_WIDTH, 5., 35., newLoadRange(ROWS, loaded))
+    rows = getTiledRange('key', TILE_WIDTH, 12., 28., newLoadRange(ROWS, loaded))
+
+    np.testing.assert_array_equal(rows, getExpected(ROWS, 12., 28.))
+    assert len(loaded) == 4
+    assert cache.getStats()['hits'] == 2
+
+def test_ranges_spanning_too_many_tiles_are_loaded_directly(cache):
+
+    loaded = []
+    stoptime = TILE_WIDTH * tilecache.MAX_TILES_PER_RANGE + 5.
+    rows = getTiledRange('key', TILE_WIDTH, 0., stoptime, newLoadRange(ROWS, loaded))
+
+    np.testing.assert_array_equal(rows, getExpected(ROWS, 0., stoptime))
+    assert len(loaded) == 1
+    assert cache.getStats()['tiles'] == 0
+
+def test_least_recently_used_tiles_are_evicted(cache, monkeypatch):
+
+    # Each tile holds 20 rows of 2 float64 columns, so the budget fits 3 tiles
+    tileBytes = 20 * 2 * 8
+    monkeypatch.setitem(config, 'tileCacheBudget', 3.5 * tileBytes / (1024 * 1024))
+
+    loaded = []
+    loadRange = newLoadRange(ROWS, loaded)
+    for k in [0, 1, 2, 0, 3]:
+        getTiledRange('key', TILE_WIDTH, k * TILE_WIDTH + 1, k * TILE_WIDTH + 2, loadRange)
+
+    stats = cache.getStats()
+    assert stats['evictions'] == 1
+    assert stats['tiles'] == 3
+    assert stats['bytes'] <= stats['budget']
+
+    # Tile 1 was the least recently used, as tile 0 was used again
+    assert [k for _, k in cache.tiles] == [2, 0, 3]
+    loaded.clear()
+    getTiledRange('key', TILE_WIDTH, 1., 2., loadRange)
+    getTiledRange('key', TILE_WIDTH, 11., 12., loadRange)
+    assert loaded == [(10., 20.)]
+
+def test_tiles_are_not_cached_without_a_budget(cache, monkeypatch):
+
+    monkeypatch.setitem(config, 'tileCacheBudget', 0)
+
+    loaded = []
+    rows = getTiledRange('key', TILE_WIDTH, 3., 27., newLoadRange(ROWS, loaded))
+
+    np.testing.assert_array_equal(rows, getExpected(ROWS, 3., 27.))
+    assert cache.getStats()['tiles'] == 0
+
+def test_tiles_of_a_changed_file_are_not_served(cache, tmp_path):
+
+    path = str(tmp_path / 'rows.npy')
+
+    # Reads the range of the rows stored in the file, through tiles keyed by
+    # the version of the file
+    def readRange(starttime, stoptime):
+        return getTiledRange((path, getFileVersion(path)), TILE_WIDTH, starttime, stoptime, newLoadRange(np.load(path), []))
+
+    np.save(path, ROWS)
+    np.testing.assert_array_equal(readRange(3., 27.), getExpected(ROWS, 3., 27.))
+
+    # Rewrite the file in place with the same number of rows
+    changed = ROWS.copy()
+    changed[:, 1] = -changed[:, 1]
+    np.save(path, changed)
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000000))
+
+    misses = cache.getStats()['misses']
+    np.testing.assert_array_equal(readRange(3., 27.), getExpected(changed, 3., 27.))
+    assert cache.getStats()['misses'] == misses + 3
+
+def test_version_of_a_missing_file(tmp_path):
+
+    assert getFileVersion(str(tmp_path / 'missing.h5')) is None
@@ -0,0 +1,80 @@
+import h5py
+import numpy as np
+import pytest
+
+from auviewer.timeindex import TIME_INDEX_STRIDE, TimeIndex, loadTimeIndex, storeTimeIndex
+
+STRIDES = [1, 3, 16, 100, TIME_INDEX_STRIDE]
+
+# Returns sorted times with runs of repeated times, some of which straddle
+# block boundaries
+def makeTimes(n=10000, seed=0):
+    rng = np.random.default_rng(seed)
+    return np.sort(np.round(rng.random(n) * n / 4)) + 0.5
+
+@pytest.fixture
+def ds(tmp_path):
+    times = makeTimes()
+    with h5py.File(str(tmp_path / 'timeindex.h5'), 'w') as h:
+        rec = np.zeros(times.shape[0], dtype=[('time', np.float64), ('value', np.float64)])
+        rec['time'] = times
+        yield h.create_dataset('data', data=rec, maxshape=(None,))
+
+# Returns targets to search for in the times: each of a sample of the times,
+# between them, at the indexed times, and beyond either end
+def getTargets(times, stride):
+    sample = times[::97]
+    return np.concatenate([sample, sample + 0.25, sample - 0.25, times[::stride][:50], [times[0] - 1, times[-1] + 1, -np.inf, np.inf]])
+
+@pytest.mark.parametrize('stride', STRIDES)
+@pytest.mark.parametrize('side', ['left', 'right'])
+def test_searchsorted_equals_searching_the_full_time_column(ds, stride, side):
+
+    times = ds.fields('time')[:]
+    index = TimeIndex(ds, 'time', stride=stride)
+
+    for target in getTargets(times, stride):
+        assert index.searchsorted(target, side) == np.searchsorted(times, target, side), target
+
+@pytest.mark.parametrize('stride', STRIDES)
+def test_slice_equals_searching_the_full_time_column(ds, stride):
+
+    times = ds.fields('time')[:]
+    index = TimeIndex(ds, 'time', stride=stride)
+    targets = getTargets(times, stride)
+
+    rng = np.random.default_rng(1)
+    for starttime, stoptime in zip(rng.choice(targets, 300), rng.choice(targets, 300)):
+        starttime, stoptime = min(starttime, stoptime), max(starttime, stoptime)
+        assert index.getSlice(starttime, stoptime) == (np.searchsorted(times, starttime, 'left'), np.searchsorted(times, stoptime, 'right')), (starttime, stoptime)
+
+def test_index_of_an_empty_dataset(tmp_path):
+
+    with h5py.File(str(tmp_path / 'empty.h5'), 'w') as h:
+        ds = h.create_dataset('data', shape=(0,), dtype=[('time', np.float64)])
+        index = TimeIndex(ds, 'time', stride=4)
+        assert index.getSlice(0, 10) == (0, 0)
+        assert index.searchsorted(5) == 0
+
+def test_index_is_not_current_once_rows_are_appended(ds):
+
+    index = TimeIndex(ds, 'time', stride=16)
+    assert index.isCurrent()
+
+    ds.resize((ds.shape[0] + 1,))
+    assert not index.isCurrent()
+
+def test_stored_index_is_loaded_only_while_current(ds):
+
+    group = ds.parent
+    times = ds.fields('time')[::TIME_INDEX_STRIDE]
+    storeTimeIndex(group, 'timeindex', times, ds.shape[0])
+
+    index = loadTimeIndex(group['timeindex'], ds, 'time')
+    assert index is not None
+    np.testing.assert_array_equal(index.times, times)
+    assert index.getSlice(100, 200) == TimeIndex(ds, 'time').getSlice(100, 200)
+
+    ds.resize((ds.shape[0] + 1,))
+    assert loadTimeIndex(group['timeindex'], ds, 'time') is None
+    assert loadTimeIndex(None, ds, 'time') is None
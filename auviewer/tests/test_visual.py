@@ -0,0 +1,110 @@
+import numpy as np
+import pytest
+
+from auviewer.cylib import buildM4Chunk, finishM4ChunkState, largestTriangleThreeBuckets, newM4ChunkState
+from auviewer.tests.test_cylib import makeSeries
+
+# Straightforward implementation of largest-triangle-three-buckets, returning
+# the indices of the selected data points
+def referenceLargestTriangleThreeBuckets(times, values, threshold):
+
+    n = times.shape[0]
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    every = (n - 2) / (threshold - 2)
+    selected = [0]
+    for i in range(threshold - 2):
+        averageStart = int(np.floor((i + 1) * every)) + 1
+        averageEnd = min(int(np.floor((i + 2) * every)) + 1, n)
+        averageTime = times[averageStart:averageEnd].mean()
+        averageValue = values[averageStart:averageEnd].mean()
+
+        a = selected[-1]
+        rangeStart = int(np.floor(i * every)) + 1
+        rangeEnd = int(np.floor((i + 1) * every)) + 1
+        j = np.arange(rangeStart, rangeEnd)
+        areas = np.abs((times[a] - averageTime) * (values[j] - values[a]) - (times[a] - times[j]) * (averageValue - values[a]))
+        selected.append(rangeStart + int(np.argmax(areas)))
+    selected.append(n - 1)
+
+    return np.array(selected)
+
+# Returns a series without NaN values, which LTTB expects
+def makeSeriesWithoutNaN(n=20000):
+    offsets, values = makeSeries(n)
+    present = ~np.isnan(values)
+    return offsets[present], values[present]
+
+# Returns the M4 points of the data points with buckets of timePerInterval
+def buildM4(offsets, values, baseOffset, timePerInterval):
+    state = newM4ChunkState()
+    return np.concatenate([buildM4Chunk(offsets, values, baseOffset, timePerInterval, state), finishM4ChunkState(state)])
+
+@pytest.mark.parametrize('threshold', [3, 4, 100, 1000, 7777])
+def test_lttb_selects_the_same_points_as_the_reference(threshold):
+
+    times, values = makeSeriesWithoutNaN()
+
+    np.testing.assert_array_equal(largestTriangleThreeBuckets(times, values, threshold), referenceLargestTriangleThreeBuckets(times, values, threshold))
+
+@pytest.mark.parametrize('threshold', [3, 100, 1000])
+def test_lttb_keeps_the_endpoints_and_one_point_per_bucket(threshold):
+
+    times, values = makeSeriesWithoutNaN()
+    n = times.shape[0]
+
+    indices = largestTriangleThreeBuckets(times, values, threshold)
+
+    assert indices.shape[0] == threshold
+    assert indices[0] == 0 and indices[-1] == n - 1
+    assert (np.diff(indices) > 0).all()
+
+    # Each bucket between the endpoints contributes exactly one point
+    every = (n - 2) / (threshold - 2)
+    bucketStarts = np.floor(np.arange(threshold - 1) * every) + 1
+    buckets = np.searchsorted(bucketStarts, indices[1:-1], side='right') - 1
+    np.testing.assert_array_equal(buckets, np.arange(threshold - 2))
+
+@pytest.mark.parametrize('threshold', [0, 2, 500, 30000])
+def test_lttb_keeps_all_points_when_not_reducing(threshold):
+
+    times, values = makeSeriesWithoutNaN(500)
+
+    np.testing.assert_array_equal(largestTriangleThreeBuckets(times, values, threshold), np.arange(times.shape[0]))
+
+def test_lttb_keeps_an_isolated_spike():
+
+    times = np.arange(1000, dtype=np.float64)
+    values = np.zeros(1000)
+    values[517] = 100.
+
+    assert 517 in largestTriangleThreeBuckets(times, values, 50)
+
+def test_m4_skips_nan_values():
+
+    offsets, values = makeSeries()
+    present = ~np.isnan(values)
+
+    np.testing.assert_array_equal(buildM4(offsets, values, offsets[0], 3.7), buildM4(offsets[present], values[present], offsets[0], 3.7))
+
+def test_m4_points_are_in_time_order_and_distinct():
+
+    offsets, values = makeSeries()
+
+    points = buildM4(offsets, values, offsets[0], 3.7)
+
+    assert (np.diff(points[:, 0]) > 0).all()
+
+@pytest.mark.parametrize('factor', [2, 4, 16])
+def test_coarser_m4_points_built_from_finer_ones_equal_those_built_from_raw_data(factor):
+
+    offsets, values = makeSeries()
+    timePerInterval = 3.7
+
+    finer = buildM4(offsets, values, offsets[0], timePerInterval)
+
+    np.testing.assert_array_equal(
+        buildM4(finer[:, 0], finer[:, 1], offsets[0], timePerInterval * factor),
+        buildM4(offsets, values, offsets[0], timePerInterval * factor),
+    )
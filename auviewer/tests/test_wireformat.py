@@ -0,0 +1,200 @@
+import json
+import struct
+
+import numpy as np
+import pytest
+import simplejson
+
+from auviewer.series import columnsToRows
+from auviewer.wireformat import (
+    JSON_ROWS_PER_CHUNK, MAGIC, VERSION, decodeBinaryPayload, encodeBinaryPayload, encodeColumnarJSONPayload, encodeJSONArray,
+    iterBinaryPayload, iterPayload,
+)
+
+# Returns a payload with a downsample output, a raw output & an empty output
+def makePayload():
+    times = np.arange(5) * 0.25 + 1e9
+    return {
+        'filename': 'file.h5',
+        'baseTime': 1e9,
+        'series': {
+            '/data/waveforms/II:value': {
+                'id': '/data/waveforms/II:value',
+                'output_type': 'downsample',
+                'columns': {'time': times, 'min': np.array([0., -1., np.nan, -np.inf, 2.]), 'max': np.array([1., 1., np.nan, np.inf, 3.])},
+            },
+            '/data/numerics/HR:HR': {
+                'id': '/data/numerics/HR:HR',
+                'output_type': 'real',
+                'columns': {'time': times[:3], 'value': np.array([60, 61, 62], dtype=np.int64)},
+            },
+            '/data/numerics/HR:RR': {
+                'id': '/data/numerics/HR:RR',
+                'output_type': 'real',
+                'columns': {'time': np.empty(0), 'value': np.empty(0)},
+            },
+        },
+    }
+
+# Decodes a binary payload per the format, independently of decodeBinaryPayload:
+# returns the prefix fields, the header & the columns of each series by name
+def decodeByHand(data):
+
+    magic, version, reserved, headerLength = struct.unpack_from('<4sHHI', data)
+    header = json.loads(data[12:12 + headerLength].decode('utf-8'))
+
+    columns = {}
+    for id, output in header.get('series', {}).items():
+        columns[id] = {c['name']: np.frombuffer(data, dtype='<f8', count=c['length'], offset=12 + headerLength + c['offset']) for c in output['columns']}
+
+    return (magic, version, reserved, headerLength), header, columns
+
+def test_binary_payload_layout():
+
+    payload = makePayload()
+    data = encodeBinaryPayload(payload)
+
+    (magic, version, reserved, headerLength), header, columns = decodeByHand(data)
+
+    assert (magic, version, reserved) == (MAGIC, VERSION, 0)
+
+    # The columns begin 8-byte aligned, right after the header, and follow
+    # each other without gaps through to the end of the data
+    assert (12 + headerLength) % 8 == 0
+    offset = 0
+    for output in header['series'].values():
+        for c in output['columns']:
+            assert c['offset'] == offset
+            offset = offset + c['length'] * 8
+    assert len(data) == 12 + headerLength + offset
+
+    # Other fields are kept in the header
+    assert header['filename'] == 'file.h5' and header['baseTime'] == 1e9
+    assert header['series']['/data/numerics/HR:HR']['output_type'] == 'real'
+
+    for id, output in payload['series'].items():
+        assert list(columns[id]) == list(output['columns'])
+        for name, values in output['columns'].items():
+            np.testing.assert_array_equal(columns[id][name], np.asarray(values, dtype=np.float64))
+
+def test_binary_payload_preserves_non_finite_values():
+
+    _, _, columns = decodeByHand(encodeBinaryPayload(makePayload()))
+
+    mins = columns['/data/waveforms/II:value']['min']
+    assert np.isnan(mins[2]) and mins[3] == -np.inf
+
+def test_empty_series_have_empty_columns():
+
+    _, header, columns = decodeByHand(encodeBinaryPayload(makePayload()))
+
+    assert [c['length'] for c in header['series']['/data/numerics/HR:RR']['columns']] == [0, 0]
+    assert columns['/data/numerics/HR:RR']['time'].shape == (0,)
+
+def test_payload_without_series():
+
+    _, header, columns = decodeByHand(encodeBinaryPayload({'filename': 'file.h5', 'value': float('nan')}))
+
+    assert header == {'filename': 'file.h5', 'value': None}
+    assert columns == {}
+
+def test_decoded_payload_equals_hand_decoded_payload():
+
+    data = encodeBinaryPayload(makePayload())
+    _, header, columns = decodeByHand(data)
+
+    payload = decodeBinaryPayload(data)
+
+    for id, output in payload['series'].items():
+        assert {k: v for k, v in output.items() if k != 'columns'} == {k: v for k, v in header['series'][id].items() if k != 'columns'}
+        for name, values in output['columns'].items():
+            np.testing.assert_array_equal(values, columns[id][name])
+
+def test_streamed_binary_payload_equals_encoded_payload():
+
+    assert b''.join(bytes(chunk) for chunk in iterBinaryPayload(makePayload())) == encodeBinaryPayload(makePayload())
+
+def test_other_data_is_not_decoded():
+
+    with pytest.raises(ValueError):
+        decodeBinaryPayload(b'JSON' + bytes(8))
+
+@pytest.mark.parametrize('values', [
+    [],
+    [0.1, -2.5, 1e300, -1e-300, 5e-324, 0., -0., 60.],
+    [np.nan, np.inf, -np.inf],
+    [1.5, np.nan, -np.inf, 2.25, np.inf, 1e20],
+])
+def test_json_array_round_trip(values):
+
+    encoded = encodeJSONArray(np.array(values, dtype=np.float64))
+
+    # Finite values are read back exactly, and non-finite ones as null
+    assert json.loads(encoded) == [v if np.isfinite(v) else None for v in values]
+    assert 'NaN' not in encoded and 'Infinity' not in encoded
+
+def test_json_array_of_integers():
+
+    assert json.loads(encodeJSONArray(np.array([60, 61], dtype=np.int64))) == [60., 61.]
+
+def test_columnar_json_payload_round_trip():
+
+    payload = makePayload()
+
+    decoded = json.loads(encodeColumnarJSONPayload(payload))
+
+    assert decoded['filename'] == 'file.h5'
+    output = decoded['series']['/data/waveforms/II:value']
+    assert output['output_type'] == 'downsample'
+    assert output['times'] == payload['series']['/data/waveforms/II:value']['columns']['time'].tolist()
+    assert output['mins'] == [0., -1., None, None, 2.]
+    assert output['maxs'] == [1., 1., None, None, 3.]
+    assert decoded['series']['/data/numerics/HR:RR']['values'] == []
+
+# Returns the payload with the data of each series output as rows, as output
+# in the 'json' format
+def toRows(payload):
+    return {**payload, 'series': {
+        id: {**{k: v for k, v in output.items() if k != 'columns'}, 'data': columnsToRows(output['columns'])}
+        for id, output in payload['series'].items()
+    }}
+
+def test_json_payload_round_trip():
+
+    payload = toRows(makePayload())
+
+    decoded = json.loads(''.join(iterPayload(payload, 'json')))
+
+    assert decoded == json.loads(simplejson.dumps(payload, ignore_nan=True))
+    assert decoded['series']['/data/waveforms/II:value']['data'][2] == [payload['series']['/data/waveforms/II:value']['data'][2][0], None, None]
+    assert decoded['series']['/data/numerics/HR:RR']['data'] == []
+
+def test_json_payload_of_a_long_series_is_encoded_in_blocks_of_rows():
+
+    n = 100000
+    times = np.arange(n) * 0.01
+    payload = {'series': {'/data/waveforms/II:value': {
+        'id': '/data/waveforms/II:value',
+        'output_type': 'real',
+        'data': columnsToRows({'time': times, 'value': np.sin(times)}),
+    }}}
+
+    chunks = iterPayload(payload, 'json')
+
+    # The first piece is yielded before the rest are encoded
+    assert next(chunks).startswith('{"series":')
+    rest = list(chunks)
+
+    assert len(rest) >= n // JSON_ROWS_PER_CHUNK
+    assert max(len(c) for c in rest) < 2 * len(simplejson.dumps(payload['series']['/data/waveforms/II:value']['data'][:JSON_ROWS_PER_CHUNK]))
+    decoded = json.loads('{"series":' + ''.join(rest))
+    assert decoded['series']['/data/waveforms/II:value']['data'] == json.loads(simplejson.dumps(payload['series']['/data/waveforms/II:value']['data']))
+
+@pytest.mark.parametrize('payload', [
+    {'preview': False},
+    {'series': simplejson.RawJSON('{"a":{"data":[[1.0,null,null,2.0]]}}'), 'metadata': {}},
+    {'series': {'a': None}},
+])
+def test_json_payloads_without_rows_of_series_data(payload):
+
+    assert json.loads(''.join(iterPayload(payload, 'json'))) == json.loads(simplejson.dumps(payload))
@@ -0,0 +1,129 @@
+"""Process-wide cache of time-aligned tiles of ranged series output."""
+
+from collections import OrderedDict
+from math import floor
+import os
+import threading
+
+import numpy as np
+
+from .config import config
+
+# Nominal number of rows (downsample intervals, M4 points or raw data points)
+# per tile. Tiles span a fixed time width per downsample level (or raw data
+# series) so that they are shared by any requested range over the level.
+TILE_ROWS = 1024
+
+# Requests spanning more tiles than this are read directly rather than through
+# the cache (e.g. raw data around a gap in a series).
+MAX_TILES_PER_RANGE = 64
+
+class TileCache:
+    """
+    LRU cache of decoded tiles (2D float64 NumPy arrays), bounded by the tileCacheBudget config setting (in
+    megabytes). Shared by all files & users served by the process, and safe to use from multiple threads.
+    """
+
+    def __init__(self):
+
+        # Guards the tiles & counters
+        self.lock = threading.Lock()
+
+        # Cached tiles by key, from least to most recently used, and their
+        # total size in bytes
+        self.tiles = OrderedDict()
+        self.numBytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, load):
+        """Returns the tile with the given key, loaded with load() and cached if it is not already cached."""
+
+        with self.lock:
+            tile = self.tiles.get(key)
+            if tile is not None:
+                self.tiles.move_to_end(key)
+                self.hits = self.hits + 1
+                return tile
+            self.misses = self.misses + 1
+
+        tile = load()
+        tile.setflags(write=False)
+        self.put(key, tile)
+
+        return tile
+
+    def put(self, key, tile):
+        """Caches the tile with the given key, evicting the least recently used tiles to stay within the budget."""
+
+        budget = config['tileCacheBudget'] * 1024 * 1024
+        if tile.nbytes > budget:
+            return
+
+        with self.lock:
+
+            if key in self.tiles:
+                return
+
+            self.tiles[key] = tile
+            self.numBytes = self.numBytes + tile.nbytes
+
+            while self.numBytes > budget:
+                _, evicted = self.tiles.popitem(last=False)
+                self.numBytes = self.numBytes - evicted.nbytes
+                self.evictions = self.evictions + 1
+
+    def clear(self):
+        """Removes all tiles from the cache."""
+        with self.lock:
+            self.tiles.clear()
+            self.numBytes = 0
+
+    def getStats(self):
+        """Returns the number & size of cached tiles, the budget, and the hit, miss & eviction counts as a dict."""
+        with self.lock:
+            return {
+                'tiles': len(self.tiles),
+                'bytes': self.numBytes,
+                'budget': config['tileCacheBudget'] * 1024 * 1024,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+# The tile cache of this process
+tileCache = TileCache()
+
+# Returns the version of the file at the given path for the keys of its tiles:
+# its modification time in nanoseconds, or None if it does not exist. Tiles of
+# a file changed in place (e.g. an original file rewritten with the same number
+# of rows, or a processed file rebuilt) are thus never served.
+def getFileVersion(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+# Returns the rows of a dataset with times within starttime and stoptime
+# (inclusive) as a 2D float64 array whose first column is time, assembled from
+# the cached tiles of the given time width which span the range. The key
+# identifies the dataset (and its version & columns) in the cache, and
+# loadRange(a, b) returns the rows with times a <= t < b. Tile k spans times
+# k * tileWidth to (k + 1) * tileWidth.
+def getTiledRange(key, tileWidth, starttime, stoptime, loadRange):
+
+    if tileWidth > 0 and config['tileCacheBudget'] > 0:
+        first, last = int(floor(starttime / tileWidth)), int(floor(stoptime / tileWidth))
+    else:
+        first, last = 0, MAX_TILES_PER_RANGE
+
+    if last - first >= MAX_TILES_PER_RANGE:
+        rows = loadRange(starttime, np.nextafter(stoptime, np.inf))
+    else:
+        rows = np.concatenate([tileCache.get((key, k), lambda k=k: loadRange(k * tileWidth, (k + 1) * tileWidth)) for k in range(first, last + 1)])
+
+    # Trim the rows of the first & last tiles outside of the range
+    times = rows[:, 0]
+    return rows[np.searchsorted(times, starttime, 'left'):np.searchsorted(times, stoptime, 'right')]
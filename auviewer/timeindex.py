@@ -0,0 +1,87 @@
+"""Sparse in-memory indexes of the time columns of datasets."""
+
+import numpy as np
+
+# Number of rows per block of a time index, i.e. between consecutive indexed
+# times
+TIME_INDEX_STRIDE = 4096
+
+# Name of the dataset holding the persisted time index of the raw data of a
+# series, within the group of its downsamples in the processed file
+TIME_INDEX_NAME = 'timeindex'
+
+class TimeIndex:
+    """
+    Sparse index of the sorted time column of an HDF5 dataset, holding the time of the first row of each block of
+    stride rows. The rows within a time range are found by searching the index, then reading only the block(s) of
+    times in which the ends of the range fall, rather than probing the dataset row by row.
+    """
+
+    def __init__(self, ds, timecol, times=None, stride=TIME_INDEX_STRIDE):
+
+        # HDF5 dataset & name of its time column
+        self.ds = ds
+        self.timecol = timecol
+
+        # Number of rows of the dataset when it was indexed
+        self.nrow = ds.shape[0]
+
+        # Indexed times, read from the dataset unless provided
+        self.stride = stride
+        self.times = ds.fields(timecol)[::stride].astype(np.float64) if times is None else np.asarray(times, dtype=np.float64)
+
+    def isCurrent(self):
+        """Returns whether the index still covers all rows of the dataset (i.e. no rows have been appended since)."""
+        return self.ds.shape[0] == self.nrow
+
+    def getSlice(self, starttime, stoptime):
+        """
+        Returns the start & stop indices of the rows of the dataset with times within starttime and stoptime
+        (inclusive), i.e. the equivalent of searchsorted on the full time column with side 'left' & 'right'.
+        """
+
+        lo0, hi0 = self.getBlock(starttime, 'left')
+        lo1, hi1 = self.getBlock(stoptime, 'right')
+
+        # If both ends fall within neighboring blocks, read them at once
+        if lo0 <= lo1 and hi1 - lo0 <= 2 * self.stride:
+            times = self.readTimes(lo0, hi1)
+            return lo0 + int(np.searchsorted(times, starttime, 'left')), lo0 + int(np.searchsorted(times, stoptime, 'right'))
+
+        return lo0 + int(np.searchsorted(self.readTimes(lo0, hi0), starttime, 'left')), lo1 + int(np.searchsorted(self.readTimes(lo1, hi1), stoptime, 'right'))
+
+    def searchsorted(self, target, side='left'):
+        """Returns the index at which target would be inserted in the time column of the dataset (see getSlice)."""
+        lo, hi = self.getBlock(target, side)
+        return lo + int(np.searchsorted(self.readTimes(lo, hi), target, side))
+
+    # Returns the range of rows [lo, hi) of the dataset within which target
+    # would be inserted, per the index. All rows before lo precede target, and
+    # no row from hi on does (on the given side).
+    def getBlock(self, target, side):
+        j = int(np.searchsorted(self.times, target, side))
+        return max(0, (j - 1) * self.stride), min(j * self.stride, self.nrow)
+
+    # Reads the times of rows start to stop of the dataset
+    def readTimes(self, start, stop):
+        if stop <= start:
+            return np.empty(0)
+        return self.ds.fields(self.timecol)[start:stop]
+
+# Returns the time index persisted in the HDF5 dataset stored (see
+# storeTimeIndex) for the time column of the HDF5 dataset ds, or None if there
+# is none or it is out of date.
+def loadTimeIndex(stored, ds, timecol):
+    if stored is None or stored.attrs.get('stride') != TIME_INDEX_STRIDE or stored.attrs.get('nrow') != ds.shape[0]:
+        return None
+    return TimeIndex(ds, timecol, times=stored[()])
+
+# Stores the indexed times (every TIME_INDEX_STRIDE-th time) of a time column of
+# nrow rows as a dataset named name in the HDF5 group, replacing any existing
+# one.
+def storeTimeIndex(group, name, times, nrow):
+    if name in group:
+        del group[name]
+    ds = group.create_dataset(name, data=np.asarray(times, dtype=np.float64))
+    ds.attrs['stride'] = TIME_INDEX_STRIDE
+    ds.attrs['nrow'] = nrow
@@ -0,0 +1,199 @@
+"""Columnar wire formats (binary & JSON) for series data responses."""
+
+import json
+import struct
+
+import numpy as np
+import simplejson
+
+# Identifies a binary series data response, and the version of its format
+MAGIC = b'AUVB'
+VERSION = 1
+
+# MIME type of binary series data responses
+BINARY_MIMETYPE = 'application/vnd.auviewer.series'
+
+# MIME type & version of columnar JSON series data responses (see
+# encodeColumnarJSONPayload)
+COLUMNAR_JSON_MIMETYPE = 'application/vnd.auviewer.columnar+json'
+COLUMNAR_JSON_VERSION = 2
+
+# Formats of series data responses by MIME type. The 'json' format, with the
+# data of each series as rows, is the original format, which is produced for
+# clients which do not request another.
+SERIES_DATA_FORMATS = {
+    'application/json': 'json',
+    COLUMNAR_JSON_MIMETYPE: 'columnar',
+    BINARY_MIMETYPE: 'binary',
+}
+
+# Number of rows of series data encoded at a time in the JSON format (see
+# iterJSONPayload)
+JSON_ROWS_PER_CHUNK = 4096
+
+# Names of the arrays of series data in the columnar JSON format, by column
+COLUMNAR_JSON_NAMES = {'time': 'times', 'min': 'mins', 'max': 'maxs', 'value': 'values'}
+
+# Returns the format of a series data response ('json', 'columnar' or 'binary')
+# per the format requested explicitly, if valid, or else per the client's
+# accepted MIME types (e.g. request.accept_mimetypes).
+def negotiateFormat(acceptMimetypes, format=None):
+    if format in SERIES_DATA_FORMATS.values():
+        return format
+    return SERIES_DATA_FORMATS[acceptMimetypes.best_match(list(SERIES_DATA_FORMATS), default='application/json')]
+
+# Returns the MIME type of series data responses of the given format
+def getMimetype(format):
+    return next(mimetype for mimetype, f in SERIES_DATA_FORMATS.items() if f == format)
+
+# Prefix of a binary series data response: magic, version, reserved & length of
+# the header in bytes (little-endian)
+PREFIX = struct.Struct('<4sHHI')
+
+# Returns the binary encoding of a payload (e.g. see File.getInitialPayload)
+# whose series outputs hold their data as columns of NumPy arrays (see
+# Series.getFullOutput). The encoding consists of:
+#
+#   - The prefix (see PREFIX);
+#   - A UTF-8 JSON header, padded with spaces to a multiple of 8 bytes, holding
+#     the payload with the columns of each series output replaced by a list of
+#     their names, offsets (in bytes, from the end of the header) & lengths;
+#   - The columns, as little-endian float64 arrays.
+#
+# The columns are written straight from their NumPy buffers, and NaN values are
+# preserved (whereas the JSON encoding emits null).
+def encodeBinaryPayload(payload):
+    return b''.join(iterBinaryPayload(payload))
+
+# Yields the binary encoding of a payload (see encodeBinaryPayload) in chunks:
+# the prefix & header, then each column.
+def iterBinaryPayload(payload):
+
+    buffers = []
+    offset = 0
+
+    header = dict(payload)
+    if 'series' in payload:
+        header['series'] = {}
+
+    for id, output in payload.get('series', {}).items():
+
+        columns = []
+        for name, values in output['columns'].items():
+            values = np.ascontiguousarray(values, dtype='<f8')
+            columns.append({'name': name, 'offset': offset, 'length': values.shape[0]})
+            buffers.append(values)
+            offset = offset + values.nbytes
+
+        header['series'][id] = {k: v for k, v in output.items() if k != 'columns'}
+        header['series'][id]['columns'] = columns
+
+    headerBytes = simplejson.dumps(header, ignore_nan=True).encode('utf-8')
+    headerBytes = headerBytes + b' ' * (-(PREFIX.size + len(headerBytes)) % 8)
+
+    yield PREFIX.pack(MAGIC, VERSION, 0, len(headerBytes)) + headerBytes
+    for b in buffers:
+        yield memoryview(b).cast('B')
+
+# Returns the payload encoded in the binary format (see encodeBinaryPayload),
+# with the columns of each series output as read-only NumPy arrays backed by the
+# encoded data.
+def decodeBinaryPayload(data):
+
+    magic, version, _, headerLength = PREFIX.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("Not a binary series data payload of a supported version.")
+
+    payload = json.loads(bytes(data[PREFIX.size:PREFIX.size + headerLength]).decode('utf-8'))
+
+    offset = PREFIX.size + headerLength
+    for output in payload.get('series', {}).values():
+        output['columns'] = {c['name']: np.frombuffer(data, dtype='<f8', count=c['length'], offset=offset + c['offset']) for c in output['columns']}
+
+    return payload
+
+# Returns the columnar JSON encoding of a payload whose series outputs hold
+# their data as columns (see encodeBinaryPayload). The payload is encoded as is,
+# with a version field, except that each series output holds its columns as
+# 'times' & either 'mins' & 'maxs' or 'values' arrays (see COLUMNAR_JSON_NAMES)
+# rather than rows of data. NaN values are output as null. The arrays are
+# encoded by the C JSON encoder from NumPy data, rather than per-element.
+def encodeColumnarJSONPayload(payload):
+    return ''.join(iterColumnarJSONPayload(payload))
+
+# Yields the columnar JSON encoding of a payload (see encodeColumnarJSONPayload)
+# in chunks: the payload up to its series, then each series output.
+def iterColumnarJSONPayload(payload):
+
+    if 'series' not in payload:
+        yield simplejson.dumps(payload, ignore_nan=True)
+        return
+
+    header = {k: v for k, v in payload.items() if k != 'series'}
+    header['version'] = COLUMNAR_JSON_VERSION
+
+    body = simplejson.dumps(header, ignore_nan=True)
+    yield f'{body[:-1]},"series":{{'
+
+    for i, (id, output) in enumerate(payload['series'].items()):
+        meta = simplejson.dumps({k: v for k, v in output.items() if k != 'columns'}, ignore_nan=True)
+        arrays = ','.join(f'"{COLUMNAR_JSON_NAMES[name]}":{encodeJSONArray(values)}' for name, values in output['columns'].items())
+        yield f'{"," if i > 0 else ""}{simplejson.dumps(id)}:{meta[:-1]}{"," if len(meta) > 2 else ""}{arrays}}}'
+
+    yield '}}'
+
+# Yields the JSON encoding of a payload, with NaN values as null, as it is
+# encoded: the payload up to its series, then the output of each series, with
+# its rows of data in blocks of JSON_ROWS_PER_CHUNK rows. Only one block is
+# encoded at a time, so that the encoding of a large payload is never held
+# whole (see serve.py). Series held pre-encoded (see encodeRawJSON) are emitted
+# as is.
+def iterJSONPayload(payload):
+
+    if 'series' not in payload:
+        yield simplejson.dumps(payload, ignore_nan=True)
+        return
+
+    body = simplejson.dumps({k: v for k, v in payload.items() if k != 'series'}, ignore_nan=True)
+    yield f'{body[:-1]}{"," if len(body) > 2 else ""}"series":'
+
+    if not isinstance(payload['series'], dict):
+        yield simplejson.dumps(payload['series'], ignore_nan=True)
+        yield '}'
+        return
+
+    yield '{'
+
+    for i, (id, output) in enumerate(payload['series'].items()):
+
+        prefix = f'{"," if i > 0 else ""}{simplejson.dumps(id)}:'
+        if not isinstance(output, dict) or not isinstance(output.get('data'), list):
+            yield prefix + simplejson.dumps(output, ignore_nan=True)
+            continue
+
+        meta = simplejson.dumps({k: v for k, v in output.items() if k != 'data'}, ignore_nan=True)
+        yield f'{prefix}{meta[:-1]}{"," if len(meta) > 2 else ""}"data":['
+
+        rows = output['data']
+        for j in range(0, len(rows), JSON_ROWS_PER_CHUNK):
+            yield f'{"," if j > 0 else ""}{simplejson.dumps(rows[j:j + JSON_ROWS_PER_CHUNK], ignore_nan=True)[1:-1]}'
+
+        yield ']}'
+
+    yield '}}'
+
+# Yields the encoding of a series data payload in the given format ('json',
+# 'columnar' or 'binary', see negotiateFormat) as it is encoded, in pieces of
+# any size (see compression.py, which coalesces them into chunks)
+def iterPayload(payload, format):
+    if format == 'binary':
+        return iterBinaryPayload(payload)
+    elif format == 'columnar':
+        return iterColumnarJSONPayload(payload)
+    return iterJSONPayload(payload)
+
+# Returns the JSON encoding of an array of floats, with non-finite values as
+# null. The C encoder of simplejson emits null for them as it writes each value,
+# so the encoding need not be rewritten afterwards.
+def encodeJSONArray(values):
+    return simplejson.dumps(np.asarray(values, dtype=np.float64).tolist(), ignore_nan=True, separators=(',', ':'))
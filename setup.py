@@ -73,6 +73,10 @@ setup(
         'sqlalchemy',
         'sklearn'
     ],
+    extras_require={
+        'blosc': ['hdf5plugin'],
+        'brotli': ['brotli'],
+    },
     packages=find_packages(),
     setup_requires=['numpy'],
     python_requires='>=3.7',
@@ -0,0 +1,90 @@
+"""
+Benchmarks reading windows of raw series data through audata (which builds a
+DataFrame) against the direct NumPy read path used for ranged output (see
+auviewer.rawdata.readColumns).
+
+Usage: python bench_raw_reads.py [file.h5 dataset timecol valcol]
+
+Without arguments, a synthetic series of 5M rows is written to a temporary file,
+both gzip-compressed (audata's default) and uncompressed, and windows of 1M rows
+are read from each.
+"""
+
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import audata
+import h5py
+import numpy as np
+import pandas as pd
+
+from auviewer.rawdata import readColumns
+
+# Number of rows per window read, and number of windows timed per read path
+windowRows = 1_000_000
+repeats = 10
+
+# Returns the best time, in milliseconds, of repeats calls of fn() for each of
+# the window starts
+def bench(fn, starts):
+    best = []
+    for start in starts:
+        times = []
+        for _ in range(repeats):
+            t0 = time.perf_counter()
+            fn(start)
+            times.append(time.perf_counter() - t0)
+        best.append(min(times))
+    return 1000 * np.median(best)
+
+# Times reading windows of the time & value columns of the dataset in the file
+# through audata & directly
+def run(path, dataset, timecol, valcol):
+
+    f = audata.File.open(str(path))
+    ds = f[dataset]
+    starts = np.linspace(0, max(0, ds.nrow - windowRows), 5).astype(int)
+
+    # The previous path: slice through audata, then convert & zip the columns
+    def viaDataFrame(start):
+        df = ds[start:start + windowRows]
+        times = df[timecol].values.astype(np.float64)
+        values = df[valcol].values.astype(np.float64)
+        return np.column_stack((times, values))
+
+    # The direct path
+    def viaNumPy(start):
+        return readColumns(ds, [timecol, valcol], start, start + windowRows)
+
+    assert np.array_equal(viaDataFrame(starts[0]), viaNumPy(starts[0]), equal_nan=True)
+
+    print(f"{path} {dataset} ({ds.hdf.compression or 'uncompressed'}): {ds.nrow} rows, windows of {min(windowRows, ds.nrow)} rows")
+    a = bench(viaDataFrame, starts)
+    b = bench(viaNumPy, starts)
+    print(f"  audata DataFrame: {a:8.1f} ms")
+    print(f"  direct NumPy:     {b:8.1f} ms ({a / b:.1f}x)")
+
+    f.close()
+
+if len(sys.argv) == 5:
+    run(Path(sys.argv[1]), sys.argv[2], sys.argv[3], sys.argv[4])
+else:
+    with tempfile.TemporaryDirectory() as tmp:
+
+        path = Path(tmp) / 'bench.h5'
+        n = 5 * windowRows
+
+        f = audata.File.new(str(path))
+        f['data/gzip'] = pd.DataFrame({'time': np.arange(n) / 250.0, 'value': np.random.randn(n).astype(np.float32)})
+        f.close()
+
+        # Copy the series to an uncompressed dataset
+        with h5py.File(path, 'a') as h:
+            h.create_dataset('data/uncompressed', data=h['data/gzip'][()])
+            for k, v in h['data/gzip'].attrs.items():
+                h['data/uncompressed'].attrs[k] = v
+
+        run(path, 'data/gzip', 'time', 'value')
+        run(path, 'data/uncompressed', 'time', 'value')